@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from website.views.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = "Run pending background export jobs (BASE_EXPORT_EXECUTOR = 'db')."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the pending jobs once and exit.')
+        parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait when there is no pending job.')
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending()
+            if count:
+                self.stdout.write('%s export job(s) done.' % count)
+            if options['once']:
+                break
+            if not count:
+                time.sleep(options['sleep'])
@@ -0,0 +1,68 @@
+import inspect
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.exceptions import PermissionDenied
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
+
+from website.models import UserSetting
+from website.views.configs import ROOT_PATH_NAME
+from website.views.views import DashboardViewTemplate
+
+
+class Command(BaseCommand):
+    help = "Create the initial dashboard widgets and positions for users who have not opened the dashboard yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only these users (default: all active staff users).')
+        parser.add_argument('--path', help='URL path of the dashboard (default: the index page of the site).')
+
+    def get_view_class(self, path):
+        try:
+            view = inspect.unwrap(resolve(path).func)
+        except Resolver404:
+            raise CommandError('%s is not a URL of the site.' % path)
+        if not (inspect.isclass(view) and issubclass(view, DashboardViewTemplate)):
+            raise CommandError('%s is not a dashboard.' % path)
+        if not view.widget_customiz:
+            raise CommandError('The dashboard at %s is not customizable, nothing to save.' % path)
+        return view
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            try:
+                path = reverse('%s:index' % ROOT_PATH_NAME)
+            except NoReverseMatch:
+                raise CommandError('Use --path to give the URL path of the dashboard.')
+        view_class = self.get_view_class(path)
+
+        users = get_user_model().objects.filter(is_active=True)
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        else:
+            users = users.filter(is_staff=True)
+
+        created = skipped = 0
+        keys = None
+        for user in users.iterator():
+            request = RequestFactory().get(path)
+            request.user = user
+            request.session = SessionBase()
+            try:
+                view = view_class(request)
+            except PermissionDenied:
+                skipped += 1
+                continue
+            if keys is None:
+                # 位置设置的键对所有用户相同，已有的用户一次查出
+                key = view.get_portal_key()
+                keys = set(UserSetting.objects.filter(key=key, user__in=users).values_list('user_id', flat=True))
+            if user.pk in keys:
+                skipped += 1
+                continue
+            view.get_init_widget()
+            created += 1
+        self.stdout.write('%s: %d dashboard(s) created, %d skipped.' % (path, created, skipped))
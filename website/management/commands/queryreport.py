@@ -0,0 +1,54 @@
+import json
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from website.views.configs import QUERY_PROFILE_LOG
+
+
+class Command(BaseCommand):
+    help = "Summarize the per-view query records written when BASE_QUERY_PROFILE and BASE_QUERY_PROFILE_LOG are set."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=QUERY_PROFILE_LOG, help='Query record file (BASE_QUERY_PROFILE_LOG).')
+        parser.add_argument('--top', type=int, default=5, help='Duplicated statements shown for each view.')
+        parser.add_argument('--clear', action='store_true', help='Empty the record file after printing.')
+
+    def handle(self, *args, **options):
+        if not options['file']:
+            raise CommandError('BASE_QUERY_PROFILE_LOG is not set and no --file given.')
+        views = {}
+        try:
+            with open(options['file'], encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    v = views.setdefault(record['name'], {
+                        'requests': 0, 'count': 0, 'max': 0, 'time': 0.0, 'hooks': Counter(),
+                        'duplicates': {}, 'slow': 0})
+                    v['requests'] += 1
+                    v['count'] += record['count']
+                    v['max'] = max(v['max'], record['count'])
+                    v['time'] += record['time']
+                    v['hooks'].update(record['hooks'])
+                    v['slow'] += len(record['slow'])
+                    for shape, n, hooks in record['duplicates']:
+                        d = v['duplicates'].setdefault(shape, [0, Counter()])
+                        d[0] = max(d[0], n)
+                        d[1].update(hooks)
+        except FileNotFoundError:
+            raise CommandError('No query records in %s.' % options['file'])
+
+        # 平均查询数多的视图在前
+        for name, v in sorted(views.items(), key=lambda i: -i[1]['count'] / i[1]['requests']):
+            n = v['requests']
+            self.stdout.write('%s: %d requests, %.1f queries avg, %d max, %.1fms avg, %d slow' % (
+                name, n, v['count'] / n, v['max'], v['time'] / n, v['slow']))
+            for hook, count in v['hooks'].most_common(options['top']):
+                self.stdout.write('    %-40s %.1f queries/request' % (hook, count / n))
+            duplicates = sorted(v['duplicates'].items(), key=lambda i: -i[1][0])[:options['top']]
+            for shape, (most, hooks) in duplicates:
+                self.stdout.write('    up to %dx [%s] %s' % (most, ', '.join(sorted(hooks)), shape))
+        if options['clear']:
+            open(options['file'], 'w').close()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import get_resolver
+
+from website.views import search
+from website.views.configs import SEARCH_INDEX_BATCH
+
+
+class Command(BaseCommand):
+    help = "Build or sync the full-text search indexes of list views using the sqlite_fts or postgres search backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', metavar='app_label.ModelName',
+                            help='Only index these models.')
+        parser.add_argument('--rebuild', action='store_true', help='Drop and rebuild the indexes.')
+        parser.add_argument('--batch-size', type=int, default=SEARCH_INDEX_BATCH,
+                            help='Objects written per batch (BASE_SEARCH_INDEX_BATCH).')
+
+    def handle(self, *args, **options):
+        # 模型配置在 URLconf 导入时注册
+        get_resolver().url_patterns
+        labels = set(label.lower() for label in options['models'])
+        backends = [b for b in search.indexes() if not labels or b.model._meta.label_lower in labels]
+        if not backends:
+            raise CommandError('No model uses an indexed search backend.')
+        for backend in backends:
+            count = backend.sync(rebuild=options['rebuild'], batch_size=options['batch_size'])
+            self.stdout.write('%s: %d objects indexed in %s (%s)' % (
+                backend.model._meta.label, count, backend.table, backend.name))
@@ -0,0 +1,39 @@
+# Generated by django 2.2.28 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('website', '0004_auto_20190515_0532'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=256, verbose_name='列表地址')),
+                ('query', models.TextField(blank=True, verbose_name='查询参数')),
+                ('columns', models.TextField(blank=True, verbose_name='导出列')),
+                ('export_type', models.CharField(max_length=10, verbose_name='格式')),
+                ('status', models.CharField(choices=[('pending', '等待'), ('running', '导出中'), ('done', '完成'), ('failed', '失败')], db_index=True, default='pending', max_length=10, verbose_name='状态')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='已导出行数')),
+                ('file', models.CharField(blank=True, max_length=256, verbose_name='文件')),
+                ('error', models.TextField(blank=True, verbose_name='错误信息')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType', verbose_name='模型')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '导出任务',
+                'verbose_name_plural': '导出任务',
+            },
+        ),
+    ]
@@ -87,3 +87,37 @@ class Viewmark(models.Model):
     class Meta:
         verbose_name = '视图'
         verbose_name_plural = verbose_name
+
+
+class ExportJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', '等待'),
+        ('running', '导出中'),
+        ('done', '完成'),
+        ('failed', '失败'),
+    )
+    user = models.ForeignKey(AUTH_USER_MODEL, verbose_name='用户', on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, verbose_name='模型', on_delete=models.CASCADE)
+    path = models.CharField('列表地址', max_length=256)
+    query = models.TextField('查询参数', blank=True)
+    columns = models.TextField('导出列', blank=True)
+    export_type = models.CharField('格式', max_length=10)
+    status = models.CharField('状态', max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    rows = models.PositiveIntegerField('已导出行数', default=0)
+    file = models.CharField('文件', max_length=256, blank=True)
+    error = models.TextField('错误信息', blank=True)
+    created = models.DateTimeField('创建时间', auto_now_add=True)
+    finished = models.DateTimeField('完成时间', blank=True, null=True)
+
+    def get_columns(self):
+        return json.loads(self.columns) if self.columns else []
+
+    def set_columns(self, columns):
+        self.columns = json.dumps(list(columns), ensure_ascii=False)
+
+    def __str__(self):
+        return "%s%s导出" % (self.user, self.content_type)
+
+    class Meta:
+        verbose_name = '导出任务'
+        verbose_name_plural = verbose_name
@@ -9,8 +9,8 @@ from website.views.views import IFrameViewTemplate, LoginView, LogoutView, UserS
     LayoutViewTemplate, ResetPasswordSendView, ResetPasswordComfirmView, ResetPasswordCompleteView, ViewTemplate, \
     UploadView, UploadDrogImgView, UserViewConfig, GroupViewConfig, PermissionViewConfig, ViewmarkViewConfig, \
     UserSettingViewConfig, \
-    UserComponentViewConfig, ContentTypeViewConfig, SessionViewConfig
-from website.models import UserComponent, UserSetting, ContentType
+    UserComponentViewConfig, ContentTypeViewConfig, SessionViewConfig, ExportJobView, ExportJobViewConfig
+from website.models import UserComponent, UserSetting, ContentType, ExportJob
 from django.db.models.base import ModelBase, Model
 from django.urls import re_path
 from django.urls.conf import path, include
@@ -18,9 +18,10 @@ from django.views.decorators.cache import never_cache
 import logging
 from website.views.plugins import *
 from website.views.views import ModelFormViewTemplate, DetailView, ListViewTemplate
-from website.views.views import DashboardViewTemplate
+from website.views.views import DashboardViewTemplate, compilefunchain
 import functools
 from website.views.views import ViewTemplate
+from website.views import rowcache, search
 from website.views.views import ListViewTemplate
 from django.contrib.sessions.models import Session
 from functools import lru_cache
@@ -73,7 +74,19 @@ class NotRegistered(Exception):
 class ViewMeta(type):
     def __new__(mcs, name, bases, website, rear, front=None, **opts):
         plugins = mcs.getpluginclasses(mcs, website, rear, front)
-        return type(name, bases, {'pluginclasses': plugins, 'website': website}, **opts)
+        cls = type(name, bases, {'pluginclasses': plugins, 'website': website}, **opts)
+        cls.pluginhooks = mcs.compilepluginhooks(mcs, cls, plugins)
+        return cls
+
+    def compilepluginhooks(mcs, cls, plugins):
+        """
+        视图类创建时一次性编译所有 pluginhook 的插件函数链，请求时直接执行
+        """
+        hooks = {}
+        for name in dir(cls):
+            if getattr(getattr(cls, name, None), 'pluginhook', False):
+                hooks[name] = compilefunchain(plugins, name)
+        return hooks
 
     def getpluginclasses(mcs, website, rear, *front):
         l = []
@@ -212,6 +225,7 @@ class WebSite:
         self.register_modelorview(Viewmark, ViewmarkViewConfig)
         self.register_modelorview(UserSetting, UserSettingViewConfig)
         self.register_modelorview(UserComponent, UserComponentViewConfig)
+        self.register_modelorview(ExportJob, ExportJobViewConfig)
         self.add_urlview(r'^$', DashboardViewTemplate, name='index')
         self.add_urlview(r'^main', IFrameViewTemplate, name='main')
         self.add_urlview(r'^login/$', LoginView, name='login')
@@ -229,6 +243,7 @@ class WebSite:
 
         self.add_urlview(r'^website/password_reset/complete/$', ResetPasswordCompleteView,
                          name='base_password_reset_complete')
+        self.add_urlview(r'^export/(\d+)/$', ExportJobView, name='export_job')
         self.add_urlview(r'^ckupload/$', UploadView, name='ckupload')
         self.add_urlview(r'^ckupdrogload/$', UploadDrogImgView, name='ckupdrogupload')
         self.set_login_view(LoginView)
@@ -359,6 +374,9 @@ class WebSite:
                     new_class = type(str("%s%sView" % (model._meta.app_label, model._meta.model_name)),
                                      (config,), attrs or {})
                     new_class.model = model
+                    if getattr(new_class, 'list_row_cache', False):
+                        rowcache.enable(model)
+                    search.enable(model, new_class)
                     if not hasattr(new_class, "order"):
                         new_class.order = self.menu_index
                         self.menu_index += 1
@@ -506,7 +524,8 @@ class WebSite:
                     'title': view.menu_name or str(capfirst(model._meta.verbose_name_plural)),
                     'url': self.get_model_url(model, "changelist"),
                     'icon': view.menu_icon,
-                    'perm': self.get_model_perm(model, 'view'),
+                    # 有查看或修改权限即可进入列表页
+                    'perm': (self.get_model_perm(model, 'view'), self.get_model_perm(model, 'change')),
                     'order': view.order,
                 }
                 self.menugroup(view, leaf)
@@ -525,7 +544,11 @@ class WebSite:
     def get_module_menu(self, app_label):
         return self.menus[app_label]
 
-    def get_select_menu(self, select_app):
+    @cached_property
+    def select_menus(self):
+        """
+        模块菜单，首页地址只解析一次
+        """
         ret = []
         for app_label, mod in list(self.modules.items()):
             if hasattr(mod, 'menu_name'):
@@ -553,11 +576,13 @@ class WebSite:
                     'title': getattr(mod, 'menu_name', str(capfirst(app_label))),
                     'url': m_first_url,
                     'icon': '',
-                    'selected': app_label == select_app
                 })
                 mod.index_url = m_first_url
         return ret
 
+    def get_select_menu(self, select_app):
+        return [dict(menu, selected=menu['app_label'] == select_app) for menu in self.select_menus]
+
     # </editor-fold>
 
 
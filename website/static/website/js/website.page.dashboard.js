@@ -75,4 +75,42 @@ jQuery(function() {
   $('.btn-quick-form').on('post-success', function(e){
     window.location.reload();
   });
-});
\ No newline at end of file
+});
+
+// 延迟加载的区块（widget_render 为 lazy 或 parallel 超时）
+jQuery(function() {
+  $('.widget-lazy').each(function(){
+    var el = $(this);
+    $.ajax({
+      url: el.data('widget-url'),
+      dataType: 'html',
+      timeout: el.data('widget-timeout') * 1000
+    }).done(function(html){
+      var body = el.parent();
+      el.replaceWith(html);
+      body.trigger('widget-loaded');
+    }).fail(function(){
+      el.html('<p class="text-danger"><i class="fa fa-exclamation-triangle"></i> ' +
+        gettext('This widget failed to load.') + '</p>');
+    });
+  });
+});
+
+// 刷新区块：不使用缓存重新渲染区块内容
+jQuery(function() {
+  $('.dashboard').on('click', '.widget-refresh', function(){
+    var box = $(this).closest('.widget'),
+        body = box.find('.panel-body, .box-body').first(),
+        index = $('.dashboard .widget').index(box),
+        url = window.location.pathname + (window.location.search ? window.location.search + '&' : '?') +
+          '_widget=' + index + '&_refresh=1';
+    body.find('.widget-refresh-error').remove();
+    $.ajax({url: url, dataType: 'html'}).done(function(html){
+      body.html(html);
+      body.trigger('widget-loaded');
+    }).fail(function(){
+      body.prepend('<p class="text-danger widget-refresh-error">' + gettext('This widget failed to load.') + '</p>');
+    });
+    return false;
+  });
+});
@@ -47,12 +47,19 @@ $(document).ready(function(){
       })
     };
 
-    $('.chart-tab a').click(function(e){
-      e.preventDefault();
-      $(this).tab('show');
+    function init(root){
+      root.find('.chart-tab a').click(function(e){
+        e.preventDefault();
+        $(this).tab('show');
 
-      $($(this).attr('href')).chart();
+        $($(this).attr('href')).chart();
+      });
+      root.find('.chart-tab a:first').click();
+      root.find('.chart.init').chart();
+    }
+    init($(document));
+    // 仪表盘延迟加载的区块
+    $(document).on('widget-loaded', function(e){
+      init($(e.target));
     });
-    $('.chart-tab a:first').click();
-    $('.chart.init').chart();
 });
\ No newline at end of file
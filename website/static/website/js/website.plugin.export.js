@@ -0,0 +1,36 @@
+(function($) {
+
+  var STATUS = {'pending': '等待导出', 'running': '正在导出', 'done': '导出完成', 'failed': '导出失败'};
+
+  $.fn.exportjob = function(url){
+    var el = this;
+    var poll = function(){
+      $.getJSON(url, function(data){
+        var text = STATUS[data.status] + (data.rows ? '，已导出 ' + data.rows + ' 行' : '');
+        if(data.status == 'done'){
+          el.html(text + ' <a class="btn btn-primary btn-xs" href="' + data.download_url + '"><i class="fa fa-download"></i> 下载</a>');
+        } else if(data.status == 'failed'){
+          el.html('<span class="text-danger">' + text + '</span>');
+        } else {
+          el.text(text + '...');
+          setTimeout(poll, 2000);
+        }
+      });
+    };
+    poll();
+    return this;
+  };
+
+  $(function(){
+    $('.export .modal form').submit(function(e){
+      var f = $(this);
+      if(!f.find('input[name=export_async]').is(':checked')) return true;
+      var status = f.find('.export-job-status').text('正在提交...');
+      $.getJSON(window.location.pathname, f.serialize(), function(data){
+        status.exportjob(data.url);
+      });
+      return false;
+    });
+  });
+
+})(jQuery);
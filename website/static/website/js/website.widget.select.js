@@ -21,10 +21,13 @@
                             return {
                                 '_q_' : term,
                                 '_cols': 'id.__str__',
-                                'p': page - 1
+                                'p': page - 1,
+                                '_c': page > 1 ? ($el.data('cursor') || '') : ''
                             };
                         },
                         results: function (data, page) {
+                            // keyset 分页的列表返回下一页游标
+                            $el.data('cursor', data.cursor);
                             return {results: data.objects, more: data.has_more};
                         }
                     },
@@ -48,10 +51,13 @@
                             return {
                                 '_q_' : term,
                                 '_cols': 'id.__str__',
-                                'p': page - 1
+                                'p': page - 1,
+                                '_c': page > 1 ? ($el.data('cursor') || '') : ''
                             };
                         },
                         results: function (data, page) {
+                            // keyset 分页的列表返回下一页游标
+                            $el.data('cursor', data.cursor);
                             return {results: data.objects, more: data.has_more};
                         }
                     },
@@ -77,10 +83,13 @@
                             return {
                                 '_q_' : term,
                                 '_cols': 'id.__str__',
-                                'p': page - 1
+                                'p': page - 1,
+                                '_c': page > 1 ? ($el.data('cursor') || '') : ''
                             };
                         },
                         results: function (data, page) {
+                            // keyset 分页的列表返回下一页游标
+                            $el.data('cursor', data.cursor);
                             return {results: data.objects, more: data.has_more};
                         }
                     },
@@ -26,7 +26,7 @@
     </div>
 {% endif %}
 {% if not cl.pop and  cl.can_select_all %}
-    {% if cl.result_count != cl.result_list|length %}
+    {% if cl.result_count is not None and cl.result_count != cl.result_list|length %}
         <a class="question btn btn-default" href="javascript:" style="display: none;" title="{% trans "Click here to select the objects across all pages" %}">{% blocktrans with cl.result_count as total_count %}Select all {{ total_count }} {{ module_name }}{% endblocktrans %}</a>
         <a class="clear btn btn-default" href="javascript:" style="display: none;">{% trans "Clear selection" %}</a>
     {% endif %}
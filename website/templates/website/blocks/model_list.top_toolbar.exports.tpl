@@ -41,6 +41,12 @@
               <label class="checkbox">
                 <input type="checkbox" name="all" value="on"> {% trans "Export all data." %}
               </label>
+              {% if export_async %}
+              <label class="checkbox">
+                <input type="checkbox" name="export_async" value="on"> 后台导出，完成后在此下载
+              </label>
+              <div class="export-job-status"></div>
+              {% endif %}
           </div>
           <div class="modal-footer">
             <button type="button" class="btn btn-default" data-dismiss="modal">{% trans "Close" %}</button>
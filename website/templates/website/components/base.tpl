@@ -11,6 +11,9 @@
         <i class='{{ widget_icon }}'></i>
         {{ widget_title }}
     {% endblock title %}
+    {% if widget.cache_timeout %}
+        <a class="widget-refresh pull-right" title="{% trans "Refresh" %}"><i class="fa fa-refresh"></i></a>
+    {% endif %}
 {% endblock box_title %}
 
 {% block box_content %}
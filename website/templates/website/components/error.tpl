@@ -0,0 +1,6 @@
+{% extends "website/components/base.tpl" %}
+{% load i18n %}
+
+{% block content %}
+    <p class="text-danger"><i class="fa fa-exclamation-triangle"></i> {% trans "This widget failed to load." %}</p>
+{% endblock content %}
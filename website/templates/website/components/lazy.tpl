@@ -0,0 +1,8 @@
+{% extends "website/components/base.tpl" %}
+{% load i18n %}
+
+{% block content %}
+    <div class="widget-lazy" data-widget-url="{{ widget_url }}" data-widget-timeout="{{ widget_timeout }}">
+        <span class="text-muted"><i class="fa fa-spinner fa-spin"></i> {% trans "Loading..." %}</span>
+    </div>
+{% endblock content %}
@@ -2,7 +2,7 @@
 {% load i18n website_tags %}
 
 {% block title %}
-    <a href="{{ page_url }}" class="pull-right"><span class="badge badge-info">{{ result_count }}</span></a>
+    <a href="{{ page_url }}" class="pull-right"><span class="badge badge-info">{{ result_count|default_if_none:"" }}</span></a>
     {{ block.super }}
 {% endblock title %}
 
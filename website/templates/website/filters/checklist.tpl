@@ -6,7 +6,7 @@
         <li{% if choice.selected %} class="active"{% endif %}>
         	<a href="{% if choice.selected %}{{ choice.remove_query_string|iriencode }}{% else %}{{ choice.query_string|iriencode }}{% endif %}">
         		<input type="checkbox" {% if choice.selected %} checked="checked"{% endif %}>
-        		{{ choice.display }}
+        		{{ choice.display }}{% if choice.count is not None %} <span class="badge">{{ choice.count }}</span>{% endif %}
         	</a>
         </li>
     {% endfor %}
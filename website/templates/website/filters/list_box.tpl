@@ -11,7 +11,7 @@
             <div class="box-body no-padding">
               <ul class="nav nav-pills nav-stacked">
     {% for choice in choices %}
-                <li {% if choice.selected %} class="active"{% endif %}><a href="{{ choice.query_string|iriencode }}">{{ choice.display }}</a></li>
+                <li {% if choice.selected %} class="active"{% endif %}><a href="{{ choice.query_string|iriencode }}">{{ choice.display }}{% if choice.count is not None %} <span class="badge">{{ choice.count }}</span>{% endif %}</a></li>
     {% endfor %}
               </ul>
             </div>
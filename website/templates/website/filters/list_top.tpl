@@ -1,5 +1,5 @@
 {% load i18n %}
     <li class="btn" style="color: #999">{{ title }}：</li>
     {% for choice in choices %}
-        <li class="btn {% if choice.selected %}mactive{% endif %}"><a href="{{ choice.query_string|iriencode }}">{{ choice.display }}</a></li>
+        <li class="btn {% if choice.selected %}mactive{% endif %}"><a href="{{ choice.query_string|iriencode }}">{{ choice.display }}{% if choice.count is not None %} <span class="badge">{{ choice.count }}</span>{% endif %}</a></li>
     {% endfor %}
@@ -4,7 +4,7 @@
   <ul class="dropdown-menu">
     {% for choice in choices %}
         <li{% if choice.selected %} class="active"{% endif %}>
-        <a href="{{ choice.query_string|iriencode }}">{{ choice.display }}</a></li>
+        <a href="{{ choice.query_string|iriencode }}">{{ choice.display }}{% if choice.count is not None %} <span class="badge">{{ choice.count }}</span>{% endif %}</a></li>
     {% endfor %}
   </ul>
 </li>
\ No newline at end of file
@@ -0,0 +1 @@
+{% block box_content %}{% endblock box_content %}
@@ -1,5 +1,9 @@
 {% load i18n %}
-  <li><span><span class="text-success">{{ cl.result_count }}</span> {% ifequal cl.result_count 1 %}{{ cl.opts.verbose_name }}{% else %}{{ cl.opts.verbose_name_plural }}{% endifequal %}</span></li>
+{% if keyset %}
+  <li{% if not prev_url %} class="disabled"{% endif %}><a href="{{ prev_url|default:'javascript:;' }}">&laquo; {% trans 'Previous' %}</a></li>
+  <li{% if not next_url %} class="disabled"{% endif %}><a href="{{ next_url|default:'javascript:;' }}" class="end">{% trans 'Next' %} &raquo;</a></li>
+{% else %}
+  <li><span><span class="text-success">{% if cl.result_count_approximate %}~{% endif %}{{ cl.result_count }}</span> {% ifequal cl.result_count 1 %}{{ cl.opts.verbose_name }}{% else %}{{ cl.opts.verbose_name_plural }}{% endifequal %}</span></li>
   {% if pagination_required %}
     {% for num in page_range %}
         <li>{{ num }}</li>
@@ -8,3 +12,4 @@
   {% if show_all_url %}
     <li><a href="{{ show_all_url }}" class="showall">{% trans 'Show all' %}</a></li>
   {% endif %}
+{% endif %}
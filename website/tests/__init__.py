@@ -0,0 +1,88 @@
+from unittest import TestCase
+
+
+def setup_django(**options):
+    """
+    测试模块独立运行时（python -m unittest website.tests.xxx）使用的最小 Django 配置
+    """
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        defaults = {
+            'INSTALLED_APPS': ['django.contrib.contenttypes', 'django.contrib.auth', 'django.contrib.sessions',
+                               'django.contrib.messages', 'crispy_forms', 'website'],
+            'TEMPLATES': [{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'APP_DIRS': True,
+                           'OPTIONS': {'context_processors': ['django.template.context_processors.request']}}],
+            'DATABASES': {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+            'SECRET_KEY': 'website-tests',
+            'ROOT_URLCONF': __name__,
+        }
+        defaults.update(options)
+        settings.configure(**defaults)
+        django.setup()
+
+
+def migrate():
+    """
+    在测试数据库中建表
+    """
+    from django.core.management import call_command
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+class DatabaseTestCase(TestCase):
+    """
+    用到数据库的测试，setUpClass 时建表
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(DatabaseTestCase, cls).setUpClass()
+        migrate()
+
+
+def create_request(params=None, user=None, path='/'):
+    """
+    GET 请求，user 默认为不在数据库中的超级用户
+    """
+    from django.contrib.auth.models import User
+    from django.test import RequestFactory
+
+    request = RequestFactory().get(path, params or {})
+    request.user = user or User(username='admin', is_active=True, is_superuser=True)
+    return request
+
+
+def create_viewclass(model=None, config=None, plugins=(), viewclass=None, site=None, namespace='tests'):
+    """
+    生成视图类，viewclass 默认为 ListViewTemplate。没有 site 时以 namespace 新建一个站点，以 config 注册 model（有
+    model 时），并按顺序添加 plugins
+    """
+    from website.site import WebSite
+    from website.views.views import ListViewTemplate
+
+    viewclass = viewclass or ListViewTemplate
+    if site is None:
+        site = WebSite(namespace, ismainsite=False)
+        if model is not None:
+            site.register_modelorview(model, config)
+        for plugin in plugins:
+            site.add_plugin(plugin, viewclass)
+    return site.createviewclass(viewclass, site.modelconfigs[model] if model is not None else None)
+
+
+def create_view(model=None, config=None, plugins=(), params=None, user=None, result_list=True, **options):
+    """
+    生成视图实例，options 见 create_viewclass，params、user 见 create_request。result_list 为真时先执行
+    get_result_list()
+    """
+    view = create_viewclass(model, config, plugins, **options)(create_request(params, user))
+    if result_list:
+        view.get_result_list()
+    return view
+
+
+# setup_django 的 ROOT_URLCONF，测试中的视图直接调用，不需要 URL
+urlpatterns = []
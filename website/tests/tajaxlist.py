@@ -0,0 +1,103 @@
+"""
+   website.tests.tajaxlist
+   ~~~~~~~~~~~~~~~~~~~~~~~
+
+   ajax 列表（AjaxListPlugin）直接以 values_list() 取数据的测试：可用的列、has_more，输出与按对象生成的相同::
+
+       $ python -m unittest website.tests.tajaxlist
+
+"""
+import json
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import path
+from website.models import UserSetting
+from website.site import WebSite
+from website.views.plugins import AjaxListPlugin, ViewPlugin
+from website.views.views import ListViewTemplate, ViewConfigMixin
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'email', 'is_staff', 'last_login', 'date_joined')
+    list_per_page = 2
+    ordering = ('username',)
+
+    def queryset(self):
+        return super(UserConfig, self).queryset().filter(username__startswith='tajaxlist')
+
+
+class CellPlugin(ViewPlugin):
+    """
+    处理单元格的插件，使 AjaxListPlugin 按对象生成数据
+    """
+
+    def makecell(self, item, obj, field_name, row):
+        return item
+
+
+values_site = WebSite('tajaxlist', ismainsite=False)
+values_site.register_modelorview(User, UserConfig)
+objects_site = WebSite('tajaxlist_objects', ismainsite=False)
+objects_site.register_modelorview(User, UserConfig)
+objects_site.add_plugin(CellPlugin, ListViewTemplate)
+urlpatterns = [path('values/', values_site.urls), path('objects/', objects_site.urls)]
+
+
+def ajax_view(site, **params):
+    return create_view(User, params=dict(params, _ajax='1'), site=site, result_list=False)
+
+
+def get_json(site, **params):
+    return json.loads(ajax_view(site, **params).get_result_list().content.decode('utf-8'))
+
+
+class TestAjaxList(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestAjaxList, cls).setUpClass()
+        cls.settings = override_settings(ROOT_URLCONF=__name__)
+        cls.settings.enable()
+        for i in range(5):
+            User.objects.create(username='tajaxlist%d' % i, email='<u%d>@example.com' % i, is_staff=bool(i % 2))
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tajaxlist').delete()
+        cls.settings.disable()
+
+    def test_values_fields(self):
+        view = ajax_view(values_site)
+        plugin = [p for p in view.plugins if isinstance(p, AjaxListPlugin)][0]
+        self.assertEqual(list(plugin.get_values_fields(['username', 'is_staff'])), ['username', 'is_staff'])
+        # 多对多字段、方法及不存在的列需要模型实例
+        for fields in (['username', 'groups'], ['get_full_name'], ['__str__'], ['missing']):
+            self.assertIsNone(plugin.get_values_fields(fields))
+        # 外键本身显示为关联对象，attname 及外键路径可以 values()
+        plugin.model = UserSetting
+        self.assertIsNone(plugin.get_values_fields(['user']))
+        self.assertEqual(list(plugin.get_values_fields(['user_id', 'user__username'])), ['user_id', 'user__username'])
+
+    def test_same_as_objects(self):
+        for params in ({}, {'p': '1'}, {'p': '2'}, {'_fields': 'email,username'}):
+            with self.subTest(params=params):
+                with CaptureQueriesContext(connection) as queries:
+                    values = get_json(values_site, **params)
+                # 总数及当前页各一次查询，只取用到的列
+                self.assertEqual(len(queries), 2)
+                self.assertNotIn('password', queries[1]['sql'])
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(values, get_json(objects_site, **params))
+                self.assertIn('password', queries[1]['sql'])
+        self.assertEqual(get_json(values_site)['objects'][0]['email'], '&lt;u0&gt;@example.com')
+
+    def test_has_more(self):
+        pages = [get_json(values_site, p=str(i)) for i in range(3)]
+        self.assertEqual([r['has_more'] for r in pages], [True, True, False])
+        self.assertEqual([len(r['objects']) for r in pages], [2, 2, 1])
+        self.assertEqual([r['total_count'] for r in pages], [5] * 3)
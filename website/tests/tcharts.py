@@ -0,0 +1,89 @@
+"""
+   website.tests.tcharts
+   ~~~~~~~~~~~~~~~~~~~~~
+
+   图表数据的测试：数据库按时间粒度分组聚合、粒度的自动选择、LTTB 抽样及结果缓存::
+
+       $ python -m unittest website.tests.tcharts
+
+"""
+import datetime
+import math
+import threading
+import time
+
+from website.tests import setup_django, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import models
+from website.views.charts import aggregate_series, choose_bucket, lttb
+from website.views.filters import choices_cache
+
+START = datetime.datetime(2020, 1, 1, 8)
+
+
+class TestCharts(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestCharts, cls).setUpClass()
+        for i in range(12):
+            User.objects.create(username='tcharts%02d' % i, date_joined=START + datetime.timedelta(hours=i * 6))
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tcharts').delete()
+
+    def test_aggregate(self):
+        queryset = User.objects.filter(username__startswith='tcharts')
+        days, = aggregate_series(queryset, 'date_joined', ('id',), 'count', 'day')
+        self.assertEqual([n for x, n in days], [3, 4, 4, 1])
+        self.assertEqual(days[0][0].date(), START.date())
+        hours, = aggregate_series(queryset, 'date_joined', ('id',), 'count', points=100)
+        self.assertEqual(len(hours), 12)
+        staff, = aggregate_series(queryset, 'is_staff', ('id',), {'id': 'count'})
+        self.assertEqual(staff, [(False, 12)])
+
+    def test_choose_bucket(self):
+        field = models.DateTimeField()
+        end = START + datetime.timedelta(days=30)
+        self.assertEqual(choose_bucket(field, START, end, 1000), 'hour')
+        self.assertEqual(choose_bucket(field, START, end, 100), 'day')
+        self.assertEqual(choose_bucket(models.DateField(), START.date(), START.date(), 1000), 'day')
+        self.assertEqual(choose_bucket(field, START, START + datetime.timedelta(days=1500), 100), 'month')
+
+    def test_lttb(self):
+        data = [(i, math.sin(i / 10.0)) for i in range(1000)]
+        sampled = lttb(data, 50)
+        self.assertEqual(len(sampled), 50)
+        self.assertEqual((sampled[0], sampled[-1]), (data[0], data[-1]))
+        self.assertEqual(sampled, sorted(sampled))
+        # 峰值被保留
+        self.assertGreater(max(y for x, y in sampled), 0.99)
+        self.assertEqual(lttb(data[:10], 50), data[:10])
+        labels = [('a%d' % i, i) for i in range(100)]
+        self.assertEqual(lttb(labels, 10), labels)
+
+    def test_result_cache(self):
+        queryset = User.objects.filter(username__startswith='tcharts')
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return len(calls)
+
+        # 并发的请求只计算一次（线程中不访问内存数据库）
+        threads = [threading.Thread(target=choices_cache.get_result,
+                                    args=(User, 'tcharts', build, queryset, 60)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(choices_cache.get_result(User, 'tcharts', build, queryset, 60), 1)
+        # 模型变动后失效
+        User.objects.create(username='tcharts99')
+        self.assertEqual(choices_cache.get_result(User, 'tcharts', build, queryset, 60), 2)
+        self.assertEqual(choices_cache.get_result(User, 'tcharts', build, queryset, 0), 3)
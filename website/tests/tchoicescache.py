@@ -0,0 +1,100 @@
+"""
+   website.tests.tchoicescache
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   过滤器选项缓存的测试：缓存命中、模型保存及多对多变动后失效、按用户的查询范围分别缓存::
+
+       $ python -m unittest website.tests.tchoicescache
+
+"""
+
+from website.tests import setup_django, create_request, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from website.views.filters import MultiSelectFieldListFilter, choices_cache
+
+
+class FakeView(object):
+    """
+    只能看到 last_name 为自己用户名的用户
+    """
+
+    def __init__(self, user):
+        self.request = create_request(user=user)
+        self.user = user
+
+    def queryset(self):
+        return User.objects.filter(last_name=self.user.username)
+
+
+class Builder(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return sorted(Group.objects.filter(name__startswith='tchoicescache').values_list('name', flat=True))
+
+
+class TestChoicesCache(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestChoicesCache, cls).setUpClass()
+        cls.group = Group.objects.create(name='tchoicescache0')
+        cls.user = User.objects.create(username='tchoicescache')
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tchoicescache').delete()
+        Group.objects.filter(name__startswith='tchoicescache').delete()
+
+    def get(self, build, scope=None):
+        return choices_cache.get_choices(User, 'groups', build, scope=scope)
+
+    def test_hit_and_save(self):
+        build = Builder()
+        self.assertEqual(self.get(build, 'save'), ['tchoicescache0'])
+        self.assertEqual(self.get(build, 'save'), ['tchoicescache0'])
+        self.assertEqual(build.calls, 1)
+        # 字段路径上的模型保存后失效
+        group = Group.objects.create(name='tchoicescache1')
+        self.assertEqual(self.get(build, 'save'), ['tchoicescache0', 'tchoicescache1'])
+        self.assertEqual(build.calls, 2)
+        group.delete()
+        self.assertEqual(self.get(build, 'save'), ['tchoicescache0'])
+        self.assertEqual(build.calls, 3)
+
+    def test_m2m_changed(self):
+        build = Builder()
+        self.get(build, 'm2m')
+        self.user.groups.add(self.group)
+        self.get(build, 'm2m')
+        self.assertEqual(build.calls, 2)
+        self.user.groups.remove(self.group)
+        self.get(build, 'm2m')
+        self.assertEqual(build.calls, 3)
+        # 自动生成的中间表只连接 m2m_changed
+        through = User.groups.through
+        self.assertTrue(m2m_changed.has_listeners(through))
+        self.assertFalse(post_save.has_listeners(through))
+        self.assertFalse(post_delete.has_listeners(through))
+
+    def test_queryset_scope(self):
+        alice, bob = User(username='tchoicescache_a'), User(username='tchoicescache_b')
+        User.objects.create(username='tchoicescache1', first_name='a1', last_name=alice.username)
+        User.objects.create(username='tchoicescache2', first_name='b1', last_name=bob.username)
+        field = User._meta.get_field('first_name')
+
+        def choices(user):
+            view = FakeView(user)
+            return MultiSelectFieldListFilter(field, view.request, {}, User, view, 'first_name',
+                                              cache_config={'enabled': True}).lookup_choices
+
+        self.assertEqual(choices(alice), ['a1'])
+        self.assertEqual(choices(bob), ['b1'])
+        self.assertEqual(choices(alice), ['a1'])
+        # 默认不缓存
+        self.assertFalse(MultiSelectFieldListFilter.cache_config['enabled'])
@@ -0,0 +1,91 @@
+"""
+   website.tests.tcount
+   ~~~~~~~~~~~~~~~~~~~~
+
+   列表结果总数的计数方式（list_count 为 estimate、cache）及 estimate_count 的测试::
+
+       $ python -m unittest website.tests.tcount
+
+"""
+from unittest import mock
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from website.views.configs import COUNT_ESTIMATE_MIN
+from website.views.plugins import FilterPlugin
+from website.views.utils import estimate_count
+from website.views.views import ViewConfigMixin
+
+
+class EstimateConfig(ViewConfigMixin):
+    list_display = ('username',)
+    list_count = 'estimate'
+    list_per_page = 2
+
+
+class CacheConfig(ViewConfigMixin):
+    list_display = ('username',)
+    list_filter = ('is_staff',)
+    list_count = 'cache'
+
+    def queryset(self):
+        return super(CacheConfig, self).queryset().filter(username__startswith='tcount')
+
+
+def count_view(config, **params):
+    return create_view(User, config, [FilterPlugin], params)
+
+
+class TestCount(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestCount, cls).setUpClass()
+        for i in range(5):
+            User.objects.create(username='tcount%d' % i, is_staff=i < 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tcount').delete()
+
+    def test_estimate_sqlite(self):
+        # SQLite 不支持估算，使用精确计数
+        self.assertIsNone(estimate_count(User.objects.all()))
+        view = count_view(EstimateConfig)
+        self.assertFalse(view.result_count_approximate)
+        self.assertEqual(view.result_count, User.objects.count())
+
+    def test_estimate(self):
+        with mock.patch('website.views.views.estimate_count', return_value=COUNT_ESTIMATE_MIN):
+            view = count_view(EstimateConfig)
+        self.assertTrue(view.result_count_approximate)
+        self.assertEqual(view.result_count, COUNT_ESTIMATE_MIN)
+        self.assertTrue(view.has_more)
+        # 估算的行数太少时改用精确计数
+        with mock.patch('website.views.views.estimate_count', return_value=COUNT_ESTIMATE_MIN - 1):
+            view = count_view(EstimateConfig)
+        self.assertFalse(view.result_count_approximate)
+        self.assertEqual(view.result_count, User.objects.count())
+
+    def test_cache(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(count_view(CacheConfig).result_count, 5)
+        self.assertEqual(len(queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(count_view(CacheConfig).result_count, 5)
+        self.assertEqual(len(queries), 0)
+        # 过滤条件不同时分别缓存
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(count_view(CacheConfig, _p_is_staff__exact='1').result_count, 2)
+            self.assertEqual(count_view(CacheConfig, _p_is_staff__exact='0').result_count, 3)
+        self.assertEqual(len(queries), 2)
+        # 缓存期间新增的数据不计入
+        User.objects.create(username='tcount_new')
+        try:
+            self.assertEqual(count_view(CacheConfig).result_count, 5)
+        finally:
+            User.objects.filter(username='tcount_new').delete()
@@ -0,0 +1,179 @@
+"""
+   website.tests.tdashboard
+   ~~~~~~~~~~~~~~~~~~~~~~~~
+
+   仪表盘区块的并发渲染、超时改为 ajax 加载、出错隔离及渲染结果缓存的测试::
+
+       $ python -m unittest website.tests.tdashboard
+
+"""
+import time
+
+from website.tests import setup_django, create_request, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User, Permission
+from django.db import connection
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import path
+from website.models import UserComponent
+from website.site import WebSite
+from website.views import dashboard
+from website.views.forms import CSRF_TOKEN_PLACEHOLDER, WIDGET_ID_PLACEHOLDER, Component, componentmanager
+from website.views.views import DashboardViewTemplate
+
+site = WebSite('tdashboard', ismainsite=False)
+urlpatterns = [path('', site.urls)]
+
+
+@componentmanager.register
+class SlowComponent(Component):
+    widget_type = 'tdashboard_slow'
+
+    def has_perm(self):
+        return True
+
+    def context(self, context):
+        time.sleep(0.3)
+        context['content'] = 'slow %s' % self.title
+
+
+@componentmanager.register
+class CountComponent(Component):
+    widget_type = 'tdashboard_count'
+    cache_timeout = 60
+    cache_models = (User,)
+
+    def has_perm(self):
+        return True
+
+    def context(self, context):
+        context['content'] = 'users %d' % User.objects.count()
+
+
+@componentmanager.register
+class PermissionComponent(Component):
+    widget_type = 'tdashboard_perm'
+    cache_timeout = 60
+    cache_vary_on = 'permissions'
+
+    def has_perm(self):
+        return True
+
+    def context(self, context):
+        context['content'] = 'rendered for %s' % self.user.username
+
+
+@componentmanager.register
+class BrokenComponent(Component):
+    widget_type = 'tdashboard_broken'
+
+    def has_perm(self):
+        return True
+
+    def context(self, context):
+        raise ValueError('broken')
+
+
+class FakeDashboard(object):
+    widget_customiz = False
+
+    def __init__(self, request):
+        self.request = request
+        self.website = type('FakeSite', (), {'style_adminlte': False})
+
+
+class TestDashboard(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestDashboard, cls).setUpClass()
+        request = create_request(user=User(username='tdashboard', is_superuser=True))
+        cls.dashboard = FakeDashboard(request)
+
+    def make(self, widget_type, title):
+        return componentmanager.get(widget_type)(self.dashboard, {'id': 0, 'title': title})
+
+    def test_parallel(self):
+        widgets = [self.make('tdashboard_slow', 'w%d' % i) for i in range(3)]
+        start = time.time()
+        htmls = dashboard.render_parallel(widgets, 5)
+        self.assertLess(time.time() - start, 0.8)
+        self.assertEqual([('slow w%d' % i) in html for i, html in enumerate(htmls)], [True] * 3)
+
+    def test_timeout_and_error(self):
+        htmls = dashboard.render_parallel([self.make('tdashboard_slow', 'late'),
+                                           self.make('tdashboard_broken', 'broken')], 0.1)
+        self.assertIsNone(htmls[0])
+        self.assertIn('failed to load', htmls[1])
+        lazy = dashboard.render_lazy(self.make('tdashboard_slow', 'late'), '/?_widget=0', 5)
+        self.assertIn('data-widget-url="/?_widget=0"', lazy)
+        self.assertNotIn('slow late', lazy)
+        content = dashboard.render_widget(self.make('tdashboard_slow', 'x'), dashboard.CONTENT_BOX_TEMPLATE)
+        self.assertEqual(content.strip(), 'slow x')
+
+    def test_cache(self):
+        count = User.objects.count()
+        self.assertIn('users %d' % count, self.make('tdashboard_count', 'c').widget)
+        with CaptureQueriesContext(connection) as queries:
+            html = self.make('tdashboard_count', 'c').widget
+        self.assertEqual(len(queries), 0)
+        self.assertIn('users %d' % count, html)
+        # csrf token 在输出时替换
+        self.assertNotIn(CSRF_TOKEN_PLACEHOLDER, html)
+        # 依赖的模型变动后失效
+        User.objects.create(username='tdashboard1')
+        self.assertIn('users %d' % (count + 1), self.make('tdashboard_count', 'c').widget)
+        # 不经过信号的修改在刷新后生效
+        User.objects.bulk_create([User(username='tdashboard2')])
+        self.assertIn('users %d' % (count + 1), self.make('tdashboard_count', 'c').widget)
+        widget = self.make('tdashboard_count', 'c')
+        widget.refresh_cache()
+        self.assertIn('users %d' % (count + 2), widget.widget)
+        User.objects.filter(username__startswith='tdashboard').delete()
+
+    def test_cache_vary_on_permissions(self):
+        # 权限相同的用户配置相同的区块共用一份缓存，区块 id 不在键中，输出时替换
+        users = [User.objects.create(username='tdashboard_p%d' % i, is_staff=True) for i in range(3)]
+        users[2].user_permissions.add(Permission.objects.get(codename='view_user'))
+
+        def render(user, widget_id):
+            request = create_request(user=User.objects.get(pk=user.pk))
+            return componentmanager.get('tdashboard_perm')(FakeDashboard(request),
+                                                           {'id': widget_id, 'title': 'p'}).widget
+
+        try:
+            first = render(users[0], 11)
+            self.assertIn('rendered for tdashboard_p0', first)
+            self.assertIn('id="11"', first)
+            shared = render(users[1], 12)
+            self.assertIn('rendered for tdashboard_p0', shared)
+            self.assertIn('id="12"', shared)
+            self.assertIn('value="12"', shared)
+            self.assertNotIn('id="11"', shared)
+            self.assertNotIn(WIDGET_ID_PLACEHOLDER, shared)
+            # 权限不同的用户单独缓存
+            self.assertIn('rendered for tdashboard_p2', render(users[2], 13))
+        finally:
+            for user in users:
+                user.delete()
+
+    def test_get_widget(self):
+        # 通过仪表盘视图实例化的区块（带 has_change_permission）
+        user = User.objects.create(username='tdashboard_view', is_staff=True)
+        try:
+            with override_settings(ROOT_URLCONF=__name__):
+                request = create_request(user=user)
+                view = site.createviewclass(DashboardViewTemplate)(request)
+                component = UserComponent.objects.create(user=user, page_id='/', widget_type='H5',
+                                                         value='{"title": "h5", "content": "tdashboard h5"}')
+                self.assertIn('tdashboard h5', view.get_widget(component).widget)
+                self.assertIn('tdashboard h5', dashboard.render_widget(view.get_widget(component.id)))
+                # ajax 加载单个区块，序号超出范围（包括负数）时 404
+                view.get_widgets = lambda: [[view.get_widget(component)]]
+                self.assertIn(b'tdashboard h5', view.widget_response('0').content)
+                for index in ('-1', '1', 'x'):
+                    self.assertRaises(Http404, view.widget_response, index)
+        finally:
+            user.delete()
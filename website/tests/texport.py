@@ -0,0 +1,167 @@
+"""
+   website.tests.texport
+   ~~~~~~~~~~~~~~~~~~~~~
+
+   导出的测试：导出 50 万行数据时进程内存峰值的增长不超过固定上限；后台导出任务的提交、执行与下载。
+   以及 100 万行导出的基准（每秒导出行数）::
+
+       $ python -m unittest website.tests.texport
+       $ python -m website.tests.texport
+
+"""
+import json
+import resource
+import shutil
+import tempfile
+import time
+import zipfile
+
+from website.tests import setup_django, create_request, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import Group, User
+from django.http import StreamingHttpResponse
+from django.test.utils import override_settings
+from django.urls import path, resolve
+from website.models import ExportJob
+from website.site import WebSite
+from website.views import jobs
+from website.views.plugins import ExportPlugin
+from website.views.views import ListViewTemplate, ViewConfigMixin
+
+ROWS = 500000
+MEMORY_CEILING = 64 * 1024  # KB
+
+site = WebSite('texport', ismainsite=False)
+
+
+class GroupConfig(ViewConfigMixin):
+    list_display = ('name', 'id')
+    export_max = None
+    export_executor = 'db'
+
+
+site.register_modelorview(Group, GroupConfig)
+site.add_plugin(ExportPlugin, ListViewTemplate)
+urlpatterns = [path('', site.urls)]
+
+
+def request(path, user, **params):
+    match = resolve(path)
+    return match.func(create_request(params, user, path), *match.args, **match.kwargs)
+
+
+class TestExportJob(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestExportJob, cls).setUpClass()
+        cls.media = tempfile.mkdtemp()
+        cls.settings = override_settings(ROOT_URLCONF=__name__, MEDIA_ROOT=cls.media)
+        cls.settings.enable()
+        cls.user = User.objects.create_superuser('texportjob', 'texportjob@example.com', 'texportjob')
+        Group.objects.bulk_create([Group(name='job%02d' % i) for i in range(30)])
+
+    @classmethod
+    def tearDownClass(cls):
+        Group.objects.all().delete()
+        cls.settings.disable()
+        shutil.rmtree(cls.media)
+
+    def test_job(self):
+        response = request('/auth/group/', self.user, _do_='export', export_type='csv', export_csv_header='on',
+                           all='on', export_async='on', _p_name__startswith='job1')
+        data = json.loads(response.content.decode('utf-8'))
+        job = ExportJob.objects.get(pk=data['id'])
+        self.assertEqual((job.status, job.export_type, job.get_columns()), ('pending', 'csv', ['name', 'id']))
+        self.assertNotIn('export_async', job.query)
+
+        status = json.loads(request(data['url'], self.user).content.decode('utf-8'))
+        self.assertEqual((status['status'], status['download_url']), ('pending', None))
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(jobs.run_pending(), 0)
+        status = json.loads(request(data['url'], self.user).content.decode('utf-8'))
+        self.assertEqual((status['status'], status['rows']), ('done', 10))
+
+        response = request(data['url'], self.user, download='1')
+        lines = b''.join(response.streaming_content).decode('utf-8').split('\r\n')
+        self.assertEqual(lines[0], '"name","ID"')
+        self.assertEqual(sorted(line.split(',')[0] for line in lines[1:]), ['"job%02d"' % i for i in range(10, 20)])
+
+
+class TestStreamExport(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestStreamExport, cls).setUpClass()
+        cls.urlconf = override_settings(ROOT_URLCONF=__name__)
+        cls.urlconf.enable()
+        cls.user = User.objects.create_superuser('texport', 'texport@example.com', 'texport')
+        for start in range(0, ROWS, 500):
+            Group.objects.bulk_create([Group(name='group%06d' % i) for i in range(start, min(start + 500, ROWS))])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.urlconf.disable()
+
+    def export(self, export_type, **params):
+        params.update({'_do_': 'export', 'export_type': export_type, 'all': 'on'})
+        view = create_view(Group, params=params, user=self.user, site=site, result_list=False)
+        return view.get(view.request)
+
+    def consume(self, export_type, sep=b'\n', output=None, **params):
+        """导出并消费响应, 返回 (sep 出现的次数, 进程内存峰值的增长 KB)"""
+        count = 0
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        response = self.export(export_type, **params)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        for chunk in response.streaming_content:
+            count += chunk.count(sep)
+            if output:
+                output.write(chunk)
+        return count, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss
+
+    def test_csv(self):
+        lines, growth = self.consume('csv', export_csv_header='on')
+        self.assertEqual(lines, ROWS)  # 表头 + ROWS 行，行间以 \r\n 分隔
+        self.assertLess(growth, MEMORY_CEILING)
+
+    def test_ndjson(self):
+        lines, growth = self.consume('ndjson')
+        self.assertEqual(lines, ROWS)
+        self.assertLess(growth, MEMORY_CEILING)
+
+    def test_json(self):
+        objects, growth = self.consume('json', b'"name": ')
+        self.assertEqual(objects, ROWS)
+        self.assertLess(growth, MEMORY_CEILING)
+
+    def test_xlsx(self):
+        with tempfile.TemporaryFile() as f:
+            __, growth = self.consume('xlsx', output=f, export_xlsx_header='on')
+            self.assertLess(growth, MEMORY_CEILING)
+            with zipfile.ZipFile(f).open('xl/worksheets/sheet1.xml') as sheet:
+                rows, tail = 0, b''
+                for chunk in iter(lambda: sheet.read(1 << 20), b''):
+                    chunk = tail + chunk
+                    rows += chunk.count(b'</row>')
+                    tail = chunk[-5:]
+        self.assertEqual(rows, ROWS + 1)
+
+
+def bench(rows=1000000):
+    """导出 rows 行, 输出各格式每秒导出的行数与内存峰值的增长"""
+    global ROWS
+    ROWS = rows
+    TestStreamExport.setUpClass()
+    test = TestStreamExport('test_csv')
+    for export_type in ('csv', 'ndjson', 'xlsx'):
+        with tempfile.TemporaryFile() as f:
+            start = time.time()
+            __, growth = test.consume(export_type, output=f)
+            elapsed = time.time() - start
+        print('%-6s %d rows: %.0f rows/s, maxrss +%d KB' % (export_type, rows, rows / elapsed, growth))
+
+
+if __name__ == '__main__':
+    bench()
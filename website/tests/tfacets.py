@@ -0,0 +1,99 @@
+"""
+   website.tests.tfacets
+   ~~~~~~~~~~~~~~~~~~~~~
+
+   过滤器选项记录数（filter_counts）的测试：与输入型过滤器共存、记录数不含过滤器自己的条件、filter_counts_top::
+
+       $ python -m unittest website.tests.tfacets
+
+"""
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from website.views.filters import MultiSelectFieldListFilter, TextFieldListFilter
+from website.views.plugins import FilterPlugin, QuickFilterPlugin
+from website.views.views import ViewConfigMixin
+
+# (名, 姓, 是否职员)
+USERS = [('n0', 'l0', True), ('n0', 'l0', False), ('n0', 'l1', True), ('n1', 'l1', False), ('n1', 'l0', True),
+         ('n2', 'l1', False)]
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username',)
+    list_filter = ('username', 'is_staff', ('last_name', MultiSelectFieldListFilter))
+    list_quick_filter = ('first_name',)
+    search_fields = ('username',)
+    filter_counts = True
+
+
+class TopUserConfig(UserConfig):
+    filter_counts_top = 2
+
+
+# 和 WebSite.init_res 相同的注册顺序（QuickFilterPlugin 先过滤）及相反的顺序
+PLUGIN_ORDERS = [(FilterPlugin, QuickFilterPlugin), (QuickFilterPlugin, FilterPlugin)]
+
+
+def search(config, plugins=PLUGIN_ORDERS[0], **params):
+    return create_view(User, config, plugins, dict(params, _q_='tfacets'))
+
+
+def counts(spec, keys):
+    return dict((key, spec.facet_count(key)) for key in keys)
+
+
+def get_spec(specs, field_path):
+    return [s for s in specs if s.field_path == field_path][0]
+
+
+class TestFacets(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestFacets, cls).setUpClass()
+        for i, (first, last, staff) in enumerate(USERS):
+            User.objects.create(username='tfacets%d' % i, first_name=first, last_name=last, is_staff=staff)
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tfacets').delete()
+
+    def test_input_filter(self):
+        # 文本过滤器不计算记录数，不影响其他过滤器
+        view = search(UserConfig)
+        text = get_spec(view.filter_specs, 'username')
+        self.assertIsInstance(text, TextFieldListFilter)
+        self.assertIsNone(getattr(text, 'facets', None))
+        self.assertEqual(counts(get_spec(view.filter_specs, 'last_name'), ['l0', 'l1']), {'l0': 3, 'l1': 3})
+
+    def test_exclude_own_filter(self):
+        for plugins in PLUGIN_ORDERS:
+            with self.subTest(plugins=plugins):
+                view = search(UserConfig, plugins, _p_first_name__in='n0', _p_last_name__in='l1')
+                # 快速过滤：不含 first_name 的条件，只有 last_name=l1
+                quick = get_spec(view.quickfilter['filter_specs'], 'first_name')
+                self.assertEqual(counts(quick, ['n0', 'n1', 'n2', 'n9']), {'n0': 1, 'n1': 1, 'n2': 1, 'n9': 0})
+                # 过滤器：不含 last_name 的条件，只有 first_name=n0
+                last_name = get_spec(view.filter_specs, 'last_name')
+                self.assertEqual(counts(last_name, ['l0', 'l1']), {'l0': 2, 'l1': 1})
+                # 未使用的过滤器基于全部条件
+                self.assertEqual(counts(get_spec(view.filter_specs, 'is_staff'), ['1', '0']), {'1': 1, '0': 0})
+                self.assertEqual(view.list_queryset.count(), 1)
+
+    def test_quick_filter_only(self):
+        for plugins in PLUGIN_ORDERS:
+            with self.subTest(plugins=plugins):
+                view = search(UserConfig, plugins, _p_first_name__in='n0')
+                quick = get_spec(view.quickfilter['filter_specs'], 'first_name')
+                self.assertEqual(counts(quick, ['n0', 'n1', 'n2']), {'n0': 3, 'n1': 2, 'n2': 1})
+                self.assertEqual(counts(get_spec(view.filter_specs, 'last_name'), ['l0', 'l1']),
+                                 {'l0': 2, 'l1': 1})
+
+    def test_top(self):
+        view = search(TopUserConfig)
+        quick = get_spec(view.quickfilter['filter_specs'], 'first_name')
+        # 只统计数量最多的 2 个值，其他值的数量未知
+        self.assertEqual(counts(quick, ['n0', 'n1', 'n2']), {'n0': 3, 'n1': 2, 'n2': None})
@@ -0,0 +1,161 @@
+"""
+   website.tests.tkeyset
+   ~~~~~~~~~~~~~~~~~~~~~
+
+   keyset（游标）分页的测试：向后、向前翻页不重复不遗漏，按关联字段排序，错误的游标，排序列可以为 NULL 时使用页码分页::
+
+       $ python -m unittest website.tests.tkeyset
+
+"""
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from website.models import UserSetting
+from website.views.configs import CURSOR_VAR
+from website.views.utils import get_keyset_columns, keyset_predicate, encode_cursor, decode_cursor
+from website.views.views import ViewConfigMixin
+
+LAST_NAMES = ['b', 'a', 'b', 'c', 'a', 'b', 'c']
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'last_name')
+    list_per_page = 3
+    pagination = 'keyset'
+    ordering = ('last_name',)
+
+    def queryset(self):
+        return super(UserConfig, self).queryset().filter(username__startswith='tkeyset')
+
+
+class DescUserConfig(UserConfig):
+    ordering = ('-last_name',)
+
+
+class LoginUserConfig(UserConfig):
+    ordering = ('last_login',)
+
+
+class SettingConfig(ViewConfigMixin):
+    list_display = ('key', 'user')
+    list_per_page = 3
+    pagination = 'keyset'
+    ordering = ('user__username',)
+
+    def queryset(self):
+        return super(SettingConfig, self).queryset().filter(key__startswith='tkeyset')
+
+
+def page(model, config, cursor=None):
+    return create_view(model, config, params={CURSOR_VAR: cursor} if cursor else None)
+
+
+def ordered_pks(model, config):
+    """
+    不分页时列表的顺序（视图在排序后追加主键倒序）
+    """
+    return list(page(model, config).list_queryset.values_list('pk', flat=True))
+
+
+def walk(model, config):
+    """
+    从第一页向后翻到最后一页，再从最后一页向前翻回第一页，返回两个方向上各页的主键
+    """
+    forward, backward = [], []
+    view = page(model, config)
+    while True:
+        forward.append([o.pk for o in view.result_list])
+        if not view.has_more:
+            break
+        view = page(model, config, view.next_cursor)
+    backward.append([o.pk for o in view.result_list])
+    while view.has_prev:
+        view = page(model, config, view.prev_cursor)
+        backward.insert(0, [o.pk for o in view.result_list])
+    return forward, backward
+
+
+class TestKeyset(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestKeyset, cls).setUpClass()
+        cls.users = [User.objects.create(username='tkeyset%d' % i, last_name=last_name)
+                     for i, last_name in enumerate(LAST_NAMES)]
+        for i, user in enumerate(reversed(cls.users)):
+            UserSetting.objects.create(user=user, key='tkeyset%d' % i, value='')
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tkeyset').delete()
+
+    def test_columns(self):
+        columns = get_keyset_columns(User, ['-last_name'])
+        self.assertEqual([(path, desc) for path, desc, f in columns], [('last_name', True), ('id', False)])
+        columns = get_keyset_columns(UserSetting, ['user__username'])
+        self.assertEqual([(path, desc) for path, desc, f in columns], [('user__username', False), ('id', False)])
+        self.assertEqual([p for p, d, f in get_keyset_columns(UserSetting, ['user'])], ['user_id', 'id'])
+        # 主键之后的排序列不影响顺序
+        self.assertEqual(len(get_keyset_columns(User, ['pk', 'last_name'])), 1)
+        # 多值关联、随机排序及表达式不能使用 keyset 分页
+        self.assertIsNone(get_keyset_columns(User, ['groups__name']))
+        self.assertIsNone(get_keyset_columns(User, ['?']))
+        self.assertIsNone(get_keyset_columns(User, [Q(pk=1)]))
+        # 可以为 NULL 的列
+        self.assertIsNone(get_keyset_columns(User, ['last_login']))
+
+    def test_cursor(self):
+        cursor = encode_cursor(['a', 3], True)
+        self.assertEqual(decode_cursor(cursor), (['a', 3], True))
+        columns = get_keyset_columns(User, ['last_name'])
+        queryset = User.objects.filter(username__startswith='tkeyset')
+        after = queryset.filter(keyset_predicate(columns, ['b', self.users[2].pk]))
+        self.assertEqual(sorted(u.pk for u in after), sorted([self.users[5].pk, self.users[3].pk, self.users[6].pk]))
+        for bad in ('!!!', encode_cursor(['a'])[:-2], 'eyJhIjoxfQ'):
+            self.assertRaises(ValueError, decode_cursor, bad)
+        # 值的个数与排序列不一致，或含有 NULL
+        self.assertRaises(ValueError, keyset_predicate, columns, ['b'])
+        self.assertRaises(ValueError, keyset_predicate, columns, [None, self.users[2].pk])
+
+    def test_paging(self):
+        for config in (UserConfig, DescUserConfig):
+            with self.subTest(config=config):
+                forward, backward = walk(User, config)
+                self.assertEqual(sum(forward, []), ordered_pks(User, config))
+                self.assertEqual(sorted(sum(forward, [])), sorted(u.pk for u in self.users))
+                self.assertEqual(backward, forward)
+                self.assertEqual([len(page) for page in forward], [3, 3, 1])
+
+    def test_related_ordering(self):
+        forward, backward = walk(UserSetting, SettingConfig)
+        self.assertEqual(sum(forward, []), ordered_pks(UserSetting, SettingConfig))
+        self.assertEqual([UserSetting.objects.get(pk=pk).user.username for pk in sum(forward, [])],
+                         sorted(u.username for u in self.users))
+        self.assertEqual(backward, forward)
+
+    def test_bad_cursor(self):
+        first = page(User, UserConfig)
+        for cursor in ('not a cursor', encode_cursor(['x']), encode_cursor([{'a': 1}, 'b'])):
+            with self.subTest(cursor=cursor):
+                # 游标错误时从第一页开始
+                view = page(User, UserConfig, cursor)
+                self.assertEqual([o.pk for o in view.result_list], [o.pk for o in first.result_list])
+                self.assertFalse(view.has_prev)
+
+    def test_null_ordering(self):
+        # 排序列可以为 NULL 时使用页码分页，各页合起来与不分页时的顺序相同
+        User.objects.filter(pk=self.users[6].pk).update(last_login='2020-01-01 00:00:00')
+        try:
+            pages = []
+            for i in range(3):
+                view = create_view(User, LoginUserConfig, params={'p': str(i)})
+                self.assertIsNone(view.keyset_columns)
+                pages.append([o.pk for o in view.result_list])
+            self.assertEqual(sum(pages, []), ordered_pks(User, LoginUserConfig))
+            self.assertEqual(sorted(sum(pages, [])), sorted(u.pk for u in self.users))
+            self.assertEqual(pages[-1][-1], self.users[6].pk)
+        finally:
+            User.objects.filter(pk=self.users[6].pk).update(last_login=None)
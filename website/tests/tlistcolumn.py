@@ -0,0 +1,161 @@
+"""
+   website.tests.tlistcolumn
+   ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   列表页按列渲染（ListColumn）的测试，以及 500 行 x 15 列渲染的基准（逐个单元格 lookup_field vs 列渲染计划）::
+
+       $ python -m unittest website.tests.tlistcolumn
+       $ python -m website.tests.tlistcolumn
+
+"""
+import timeit
+from datetime import datetime
+from unittest import TestCase
+
+from website.tests import setup_django, create_view
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from django.test.utils import override_settings
+from django.urls import path
+from django.utils.encoding import smart_str
+from django.utils.safestring import mark_safe
+from website.site import WebSite
+from website.views.configs import EMPTY_CHANGELIST_VALUE
+from website.views.plugins import ViewPlugin
+from website.views.utils import lookup_field, display_for_field, boolean_icon
+from website.views.views import ListCell, ViewConfigMixin
+
+site = WebSite('tlistcolumn', ismainsite=False)
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'first_name', 'last_name', 'email', 'is_staff', 'is_active', 'is_superuser',
+                    'date_joined', 'last_login', 'id', 'get_full_name', 'get_short_name', 'is_anonymous',
+                    'staff_flag', '__str__')
+
+    def staff_flag(self, obj):
+        return obj.is_staff
+
+    staff_flag.boolean = True
+
+
+class MarkPlugin(ViewPlugin):
+    def makecolumn(self, column, field_name):
+        if field_name == 'email':
+            column.classes.append('email')
+            column.transforms.append(lambda item, obj, row: item.btns.append('mail'))
+        return column
+
+
+site.register_modelorview(User, UserConfig)
+urlpatterns = [path('', site.urls)]
+
+
+def legacy_makecell(view, obj, field_name, row):
+    """旧版 makecell：每个单元格都 split 字段名、lookup_field 并判断字段类型"""
+    item = ListCell(field_name, row)
+    field_name_split = field_name.split('.')
+    field_name = field_name_split[0]
+    try:
+        f, attr, value = lookup_field(field_name, obj, view)
+    except (AttributeError, ObjectDoesNotExist):
+        item.text = mark_safe("<span class='text-muted'>%s</span>" % EMPTY_CHANGELIST_VALUE)
+    else:
+        if f is None:
+            item.allow_tags = getattr(attr, 'allow_tags', False)
+            boolean = getattr(attr, 'boolean', False)
+            if boolean:
+                item.allow_tags = True
+                item.text = boolean_icon(value)
+            else:
+                item.text = smart_str(value)
+        else:
+            if isinstance(f, models.ManyToOneRel):
+                field_val = getattr(obj, f.name)
+                if field_val is None:
+                    item.text = mark_safe("<span class='text-muted'>%s</span>" % EMPTY_CHANGELIST_VALUE)
+                elif len(field_name_split) > 1:
+                    item.text = getattr(field_val, field_name_split[1])
+                else:
+                    item.text = field_val
+            else:
+                item.text = display_for_field(value, f)
+            if isinstance(f, models.DateField) or isinstance(f, models.TimeField) \
+                    or isinstance(f, models.ForeignKey):
+                item.classes.append('nowrap')
+        item.field = f
+        item.attr = attr
+        item.value = value
+    if not hasattr(obj, '_nolink'):
+        if (item.row['is_display_first'] and not view.list_display_links) \
+                or field_name in view.list_display_links:
+            item.row['is_display_first'] = False
+            item.is_display_link = True
+            item.wraps.append(view.get_link_wrap(obj))
+    return item
+
+
+def legacy_row(view, obj):
+    row = {'is_display_first': True, 'object': obj}
+    return [legacy_makecell(view, obj, field_name, row) for field_name in view.list_display]
+
+
+def create_users(count):
+    return [User(id=i + 1, username='user%d' % i, first_name='first%d' % i, last_name='last%d' % i,
+                 email='user%d@example.com' % i, is_staff=bool(i % 2), date_joined=datetime(2020, 1, 1),
+                 last_login=datetime(2020, 1, 2) if i % 3 else None) for i in range(count)]
+
+
+def cell_values(cells):
+    return [(c.field_name, str(c.text), c.classes, c.wraps, c.btns, c.allow_tags, c.is_display_link) for c in cells]
+
+
+class TestListColumn(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.settings = override_settings(ROOT_URLCONF=__name__)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+
+    def test_same_as_legacy(self):
+        view = create_view(User, UserConfig, result_list=False, namespace='tlistcolumn')
+        for obj in create_users(6):
+            self.assertEqual(cell_values(view.makerow(obj).cells), cell_values(legacy_row(view, obj)))
+
+    def test_column_once(self):
+        view = create_view(User, UserConfig, result_list=False, namespace='tlistcolumn')
+        view.makerow(User(id=1))
+        self.assertIs(view.get_column('username'), view.get_column('username'))
+        self.assertEqual(view.get_column('date_joined').kind, 'field')
+        self.assertEqual(view.get_column('get_full_name').kind, 'object')
+        self.assertEqual(view.get_column('staff_flag').kind, 'view')
+        self.assertTrue(view.get_column('staff_flag').boolean)
+
+    def test_transform(self):
+        view = create_view(User, UserConfig, [MarkPlugin], result_list=False, namespace='tlistcolumn')
+        cell = view.makerow(create_users(1)[0]).cells[3]
+        self.assertEqual(cell.field_name, 'email')
+        self.assertEqual(cell.classes, ['email'])
+        self.assertEqual(cell.btns, ['mail'])
+
+
+def bench(rows=500, number=5):
+    with override_settings(ROOT_URLCONF=__name__):
+        view = create_view(User, UserConfig, result_list=False, namespace='tlistcolumn')
+        objs = create_users(rows)
+        legacy = timeit.timeit(lambda: [legacy_row(view, obj) for obj in objs], number=number) / number
+        compiled = timeit.timeit(lambda: [view.makerow(obj) for obj in objs], number=number) / number
+    print('%d rows x %d columns' % (rows, len(view.list_display)))
+    print('makecell:    %.1f ms' % (legacy * 1e3))
+    print('ListColumn:  %.1f ms (%.1fx)' % (compiled * 1e3, legacy / compiled))
+
+
+if __name__ == '__main__':
+    bench()
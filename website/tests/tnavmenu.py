@@ -0,0 +1,81 @@
+"""
+   website.tests.tnavmenu
+   ~~~~~~~~~~~~~~~~~~~~~~
+
+   导航菜单按权限编译、缓存及权限变动后失效的测试::
+
+       $ python -m unittest website.tests.tnavmenu
+
+"""
+
+from website.tests import setup_django, create_request, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User, Group, Permission
+from website.tools.types import tree
+from website.views import navmenu
+from website.views.views import LayoutViewTemplate, ViewUtilMixin
+
+
+class FakeSite(object):
+    namespace = 'tnavmenu'
+
+    def __init__(self):
+        self.menus = tree()
+        self.menus[0] = {'data': {}, 'branch': [
+            {'data': {'title': 'auth', 'icon': '', 'url': '#'}, 'branch': [], 'up': '', 'leaf': [
+                {'title': 'users', 'url': '/auth/user/', 'perm': ('auth.view_user', 'auth.change_user')},
+                {'title': 'groups', 'url': '/auth/group/', 'perm': 'auth.view_group'},
+            ]},
+            {'data': {'title': 'admin', 'icon': '', 'url': '#'}, 'branch': [], 'up': '', 'leaf': [
+                {'title': 'settings', 'url': '/settings/', 'perm': 'super'},
+            ]},
+        ], 'leaf': [{'title': 'home', 'url': '/', 'perm': None}]}
+
+
+class FakeView(object):
+    _check_menu_permission = LayoutViewTemplate._check_menu_permission
+    user_has_perm = ViewUtilMixin.user_has_perm
+
+    def __init__(self, website, user):
+        self.website = website
+        self.user = user
+        self.request = create_request(user=user)
+
+
+def titles(menu):
+    return [l['title'] for l in menu['leaf']] + [(b['data']['title'], titles(b)) for b in menu['branch']]
+
+
+class TestNavMenu(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestNavMenu, cls).setUpClass()
+        cls.website = FakeSite()
+
+    def menu(self, user):
+        # 每次取新的用户对象，和请求中一样没有权限的缓存
+        return titles(navmenu.get_nav_menu(FakeView(self.website, User.objects.get(pk=user.pk))))
+
+    def test_compile(self):
+        user = User.objects.create(username='tnavmenu', is_staff=True)
+        admin = User.objects.create(username='tnavmenu_admin', is_superuser=True)
+        try:
+            self.assertEqual(self.menu(user), ['home'])
+            self.assertEqual(self.menu(admin), ['home', ('auth', ['users', 'groups']), ('admin', ['settings'])])
+            user.user_permissions.add(Permission.objects.get(codename='change_user'))
+            self.assertEqual(self.menu(user), ['home', ('auth', ['users'])])
+            group = Group.objects.create(name='tnavmenu')
+            user.groups.add(group)
+            group.permissions.add(Permission.objects.get(codename='view_group'))
+            self.assertEqual(self.menu(user), ['home', ('auth', ['users', 'groups'])])
+            group.delete()
+            self.assertEqual(self.menu(user), ['home', ('auth', ['users'])])
+            # 返回的是副本
+            menu = navmenu.get_nav_menu(FakeView(self.website, user))
+            menu['leaf'][0]['selected'] = True
+            self.assertNotIn('selected', navmenu.get_nav_menu(FakeView(self.website, user))['leaf'][0])
+        finally:
+            user.delete()
+            admin.delete()
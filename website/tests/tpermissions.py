@@ -0,0 +1,67 @@
+"""
+   website.tests.tpermissions
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   请求内权限快照的测试：用户及组的权限一次查出，同一请求内每个权限只判断一次::
+
+       $ python -m unittest website.tests.tpermissions
+
+"""
+
+from website.tests import setup_django, create_request, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from website.models import UserSetting, Viewmark
+from website.views import permissions
+from website.views.views import ViewUtilMixin
+
+MODELS = (User, Group, Permission, ContentType, UserSetting, Viewmark)
+
+
+class FakeView(ViewUtilMixin):
+    def __init__(self, user):
+        self.request = create_request(user=user)
+        self.user = user
+
+
+class TestPermissions(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestPermissions, cls).setUpClass()
+        cls.user = User.objects.create(username='tpermissions', is_staff=True)
+        cls.group = Group.objects.create(name='tpermissions')
+        cls.group.permissions.set(Permission.objects.filter(codename__in=['view_group', 'add_viewmark']))
+        cls.user.groups.add(cls.group)
+        cls.user.user_permissions.add(Permission.objects.get(codename='change_user'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user.delete()
+        cls.group.delete()
+
+    def check(self, view):
+        return [(view.has_model_perm(m, 'view'), view.has_model_perm(m, 'add')) for m in MODELS]
+
+    def test_snapshot(self):
+        view = FakeView(User.objects.get(pk=self.user.pk))
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(3):
+                result = self.check(view)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(result, [(True, False), (True, False), (False, False), (False, False),
+                                  (False, False), (False, True)])
+        # 和 user.has_perm 的结果相同
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(result, [(user.has_perm(view.get_model_perm(m, 'view')) or
+                                   user.has_perm(view.get_model_perm(m, 'change')),
+                                   user.has_perm(view.get_model_perm(m, 'add'))) for m in MODELS])
+        self.assertIs(permissions.get_snapshot(view.request), permissions.get_snapshot(view.request))
+        # 超级用户不查询权限
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(all(all(r) for r in self.check(FakeView(User(username='x', is_superuser=True)))))
+        self.assertEqual(len(queries), 0)
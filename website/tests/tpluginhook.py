@@ -0,0 +1,130 @@
+"""
+   website.tests.tpluginhook
+   ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   插件钩子函数链的测试，以及钩子调用开销的基准（编译函数链 vs 旧的 execfunchain）::
+
+       $ python -m unittest website.tests.tpluginhook
+       $ python -m website.tests.tpluginhook
+
+"""
+import timeit
+from unittest import TestCase, main
+
+from website.tests import setup_django, create_view
+
+setup_django()
+
+from django.contrib.auth.models import AnonymousUser
+from website.views.plugins import ViewPlugin
+from website.views.views import LayoutViewTemplate, pluginhook, execfunchain, IncorrectPluginArg
+
+
+class HookView(LayoutViewTemplate):
+
+    @pluginhook
+    def get_value(self, a):
+        return ['view:%s' % a]
+
+    @pluginhook
+    def do_nothing(self):
+        pass
+
+    @pluginhook
+    def get_bad(self):
+        return 'bad'
+
+
+class AppendPlugin(ViewPlugin):
+    def get_value(self, value, a):
+        return value + ['append:%s' % a]
+
+
+class PassPlugin(ViewPlugin):
+    def get_value(self, __, a):
+        return ['before'] + __() + ['after']
+
+
+class FirstPlugin(ViewPlugin):
+    def get_value(self, value, a):
+        return value + ['first']
+
+    get_value.priority = 1
+
+
+class NoArgPlugin(ViewPlugin):
+    called = 0
+
+    def do_nothing(self):
+        NoArgPlugin.called += 1
+
+    def get_bad(self):
+        pass
+
+
+class OffPlugin(ViewPlugin):
+    def init_request(self, *args, **kwargs):
+        return False
+
+    def get_value(self, value, a):
+        return value + ['off']
+
+
+def legacy_hook(view, name, *args, **kwargs):
+    """旧版 pluginhook 的调用方式：每次调用扫描插件、排序并 inspect"""
+    def cf():
+        return HookView.__dict__[name].__wrapped__(view, *args, **kwargs)
+
+    plugin = []
+    for a in view.plugins:
+        pn = getattr(a, name, None)
+        if callable(pn):
+            plugin.append((getattr(pn, 'priority', 10), pn))
+    pns = [pn for pr, pn in sorted(plugin, key=lambda x: x[0])]
+    return execfunchain(pns, len(pns) - 1, cf, *args, **kwargs)
+
+
+def hook_view(*plugins):
+    return create_view(plugins=plugins, user=AnonymousUser(), viewclass=HookView, result_list=False)
+
+
+class TestPluginHook(TestCase):
+    def test_compiled(self):
+        view = hook_view(AppendPlugin, PassPlugin, FirstPlugin, OffPlugin)
+        self.assertEqual(set(view.pluginhooks), {'get_value', 'do_nothing', 'get_bad', 'get_context', 'get_media',
+                                                 'get_breadcrumb', 'get_menu_icon'})
+        self.assertEqual([c.__name__ for c, pr, kind in view.pluginhooks['get_value']],
+                         ['FirstPlugin', 'AppendPlugin', 'PassPlugin', 'OffPlugin'])
+
+    def test_order(self):
+        view = hook_view(AppendPlugin, PassPlugin, FirstPlugin, OffPlugin)
+        self.assertEqual(view.get_value(1), ['before', 'view:1', 'after', 'append:1', 'first'])
+        self.assertEqual(view.get_value(2), legacy_hook(view, 'get_value', 2))
+
+    def test_noarg(self):
+        view = hook_view(NoArgPlugin)
+        NoArgPlugin.called = 0
+        view.do_nothing()
+        view.do_nothing()
+        self.assertEqual(NoArgPlugin.called, 2)
+        self.assertRaises(IncorrectPluginArg, view.get_bad)
+
+    def test_rebind(self):
+        view = hook_view(AppendPlugin, PassPlugin)
+        self.assertEqual(view.get_value(1), ['before', 'view:1', 'after', 'append:1'])
+        view.plugins = [p for p in view.plugins if not isinstance(p, PassPlugin)]
+        self.assertEqual(view.get_value(1), ['view:1', 'append:1'])
+
+
+def bench(number=20000):
+    plugins = [type('BenchPlugin%d' % i, (AppendPlugin if i % 2 else PassPlugin,), {}) for i in range(12)]
+    view = hook_view(*plugins)
+    legacy = timeit.timeit(lambda: legacy_hook(view, 'get_value', 1), number=number)
+    compiled = timeit.timeit(lambda: view.get_value(1), number=number)
+    print('%d plugins, %d calls' % (len(plugins), number))
+    print('execfunchain: %.2f us/call' % (legacy / number * 1e6))
+    print('compiled:     %.2f us/call (%.1fx)' % (compiled / number * 1e6, legacy / compiled))
+
+
+if __name__ == '__main__':
+    bench()
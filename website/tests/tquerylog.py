@@ -0,0 +1,79 @@
+"""
+   website.tests.tquerylog
+   ~~~~~~~~~~~~~~~~~~~~~~~
+
+   视图查询记录的测试：语句形式的归并、assertMaxQueries 找出列表列中的 N+1 及发出查询的钩子::
+
+       $ python -m unittest website.tests.tquerylog
+
+"""
+import re
+
+from website.tests import setup_django, create_request, create_viewclass, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import Group, User
+from website.views.plugins import ExportPlugin
+from website.views.querylog import QueryAssertionsMixin, normalize_sql
+from website.views.views import ViewConfigMixin
+
+USERS = 20
+
+
+def group_names(self, obj):
+    return ', '.join(g.name for g in obj.groups.all())
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'group_names')
+    group_names = group_names
+
+
+class PrefetchUserConfig(ViewConfigMixin):
+    list_display = ('username', 'group_names')
+
+    def group_names(self, obj):
+        return group_names(self, obj)
+
+    group_names.prefetch_related = ('groups',)
+
+
+def create_view(config):
+    return create_viewclass(User, config, [ExportPlugin]).as_view()
+
+
+class TestQueryLog(QueryAssertionsMixin, DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestQueryLog, cls).setUpClass()
+        cls.user = User.objects.create_superuser('tquerylog', 'tquerylog@example.com', 'tquerylog')
+        group = Group.objects.create(name='tquerylog')
+        for i in range(USERS):
+            User.objects.create(username='tquerylog%02d' % i).groups.add(group)
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tquerylog').delete()
+        Group.objects.filter(name='tquerylog').delete()
+
+    def request(self):
+        return create_request({'_do_': 'export', 'export_type': 'csv', 'all': 'on'}, self.user)
+
+    def test_normalize(self):
+        self.assertEqual(normalize_sql('SELECT "a" FROM "t" WHERE "id" IN (%s, %s, %s) AND "b" = \'x\' LIMIT 21'),
+                         'SELECT "a" FROM "t" WHERE "id" IN (...) AND "b" = ? LIMIT ?')
+        self.assertEqual(normalize_sql('SELECT 1 FROM "t" WHERE "id" IN (%s)'),
+                         normalize_sql('SELECT 2 FROM "t" WHERE "id" IN (%s, %s)'))
+
+    def test_n_plus_one(self):
+        with self.assertRaises(AssertionError) as cm:
+            self.assertMaxQueries(create_view(UserConfig), 5, self.request())
+        duplicate = re.search(r'(\d+)x \[makerow\] (.*)', str(cm.exception))
+        self.assertGreaterEqual(int(duplicate.group(1)), USERS)
+        self.assertIn('"auth_user_groups"', duplicate.group(2))
+
+    def test_prefetch(self):
+        profile = self.assertMaxQueries(create_view(PrefetchUserConfig), 2, self.request())
+        self.assertEqual(profile.duplicates, [])
+        self.assertEqual(dict(profile.hooks), {'stream': 2})
@@ -0,0 +1,121 @@
+"""
+   website.tests.tqueryplan
+   ~~~~~~~~~~~~~~~~~~~~~~~~
+
+   列表按显示的列规划查询（get_queryset_plan、apply_queryset_plan）的测试：外键列 select_related、多对多列
+   prefetch_related、列的查询声明、延迟加载未用到的大字段，以及带外键、多对多列的列表的查询数::
+
+       $ python -m unittest website.tests.tqueryplan
+
+"""
+
+from website.tests import setup_django, create_request, create_view, create_viewclass, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import Group, User
+from website.models import UserSetting
+from website.views.plugins import ExportPlugin
+from website.views.querylog import QueryAssertionsMixin
+from website.views.views import ViewConfigMixin
+
+ROWS = 10
+
+
+class SettingConfig(ViewConfigMixin):
+    list_display = ('key', 'user')
+
+    def queryset(self):
+        return super(SettingConfig, self).queryset().filter(key__startswith='tqueryplan')
+
+
+class HintSettingConfig(SettingConfig):
+    list_display = ('key', 'user', 'user_groups')
+
+    def user_groups(self, obj):
+        return ', '.join(g.name for g in obj.user.groups.all())
+
+    user_groups.prefetch_related = ('user__groups',)
+    user_groups.only = ('user',)
+
+
+class UnknownSettingConfig(SettingConfig):
+    list_display = ('key', 'describe')
+
+    def describe(self, obj):
+        return obj.value[:10]
+
+
+class AllRelatedSettingConfig(SettingConfig):
+    list_select_related = True
+    list_prefetch_related = ('user__user_permissions',)
+    list_defer_wide = False
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'groups')
+
+    def queryset(self):
+        return super(UserConfig, self).queryset().filter(username__startswith='tqueryplan')
+
+
+def get_plan(model, config):
+    return create_view(model, config, [ExportPlugin], result_list=False).get_queryset_plan()
+
+
+class TestQueryPlan(QueryAssertionsMixin, DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestQueryPlan, cls).setUpClass()
+        cls.user = User.objects.create_superuser('tqueryplan', 'tqueryplan@example.com', 'tqueryplan')
+        groups = [Group.objects.create(name='tqueryplan%d' % i) for i in range(2)]
+        for i in range(ROWS):
+            user = User.objects.create(username='tqueryplan%02d' % i)
+            user.groups.set(groups[:i % 3])
+            UserSetting.objects.create(user=user, key='tqueryplan%02d' % i, value='x' * 1000)
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='tqueryplan').delete()
+        Group.objects.filter(name__startswith='tqueryplan').delete()
+
+    def test_plan(self):
+        self.assertEqual(get_plan(UserSetting, SettingConfig),
+                         {'select_related': ['user'], 'prefetch_related': [], 'defer': ['value']})
+        self.assertEqual(get_plan(User, UserConfig),
+                         {'select_related': [], 'prefetch_related': ['groups'], 'defer': []})
+        # 列声明的查询
+        self.assertEqual(get_plan(UserSetting, HintSettingConfig),
+                         {'select_related': ['user'], 'prefetch_related': ['user__groups'], 'defer': ['value']})
+        # 不知道列用到哪些字段时不延迟加载
+        self.assertEqual(get_plan(UserSetting, UnknownSettingConfig)['defer'], [])
+        self.assertEqual(get_plan(UserSetting, AllRelatedSettingConfig),
+                         {'select_related': True, 'prefetch_related': ['user__user_permissions'], 'defer': []})
+
+    def test_apply(self):
+        view = create_view(UserSetting, HintSettingConfig, [ExportPlugin], user=self.user, result_list=False)
+        plan = view.get_queryset_plan()
+        queryset = view.apply_queryset_plan(UserSetting.objects.all(), plan)
+        self.assertEqual(queryset.query.select_related, {'user': {}})
+        self.assertEqual(queryset._prefetch_related_lookups, ('user__groups',))
+        self.assertEqual(queryset.query.deferred_loading, (frozenset(['value']), True))
+        # queryset 已经指定的 select_related、only 优先，prefetch 不重复
+        queryset = view.apply_queryset_plan(
+            UserSetting.objects.select_related('user').only('key', 'user').prefetch_related('user__groups'), plan)
+        self.assertEqual(queryset.query.select_related, {'user': {}})
+        self.assertEqual(queryset._prefetch_related_lookups, ('user__groups',))
+        self.assertEqual(queryset.query.deferred_loading, (frozenset(['key', 'user']), False))
+        # 列表的 queryset
+        view.get_result_list()
+        self.assertNotIn('"website_usersetting"."value"', str(view.list_queryset.query))
+
+    def request(self):
+        return create_request({'_do_': 'export', 'export_type': 'csv', 'all': 'on'}, self.user)
+
+    def test_max_queries(self):
+        # 外键、多对多列不随行数增加查询：导出全部时数据及 prefetch 各一次
+        for model, config in ((UserSetting, HintSettingConfig), (User, UserConfig)):
+            with self.subTest(config=config):
+                view = create_viewclass(model, config, [ExportPlugin]).as_view()
+                profile = self.assertMaxQueries(view, 2, self.request())
+                self.assertEqual(profile.duplicates, [])
@@ -0,0 +1,75 @@
+"""
+   website.tests.trelatemenu
+   ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   列表页关联菜单列、操作列的行模板及关联对象数量的测试::
+
+       $ python -m unittest website.tests.trelatemenu
+
+"""
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User, Group
+from django.test.utils import override_settings
+from django.urls import path, reverse
+from website.site import WebSite
+from website.views.plugins import RelateMenuPlugin
+from website.views.views import ViewConfigMixin
+
+
+class GroupConfig(ViewConfigMixin):
+    show_related_count = True
+
+
+site = WebSite('trelatemenu', ismainsite=False)
+site.register_modelorview(User, ViewConfigMixin)
+site.register_modelorview(Group, GroupConfig)
+urlpatterns = [path('', site.urls)]
+
+
+def group_view():
+    view = create_view(Group, site=site, result_list=False)
+    view.list_display = view.get_list_display()
+    return view, [p for p in view.plugins if isinstance(p, RelateMenuPlugin)][0]
+
+
+class TestRelateMenu(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestRelateMenu, cls).setUpClass()
+        cls.settings = override_settings(ROOT_URLCONF=__name__)
+        cls.settings.enable()
+        cls.groups = [Group.objects.create(name='trelatemenu%d' % i) for i in range(3)]
+        for i in range(3):
+            User.objects.create(username='trelatemenu%d' % i).groups.set(cls.groups[:i])
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='trelatemenu').delete()
+        Group.objects.filter(name__startswith='trelatemenu').delete()
+        cls.settings.disable()
+
+    def test_links(self):
+        view, plugin = group_view()
+        self.assertIn('related_link', view.list_display)
+        group = self.groups[0]
+        link = plugin.related_link(group)
+        self.assertIn('href="%s?_rel_groups__id__exact=%s"' % (reverse('trelatemenu:auth_user_changelist'), group.pk),
+                      link)
+        self.assertIn('href="%s?_rel_groups__id__exact=%s"' % (reverse('trelatemenu:auth_user_add'), group.pk), link)
+        # 主键按 reverse() 的规则转义
+        for pk in (group.pk, 'a b%/c'):
+            self.assertIn('href="%s"' % reverse('trelatemenu:auth_group_change', args=(pk,)),
+                          plugin.op_link(Group(pk=pk)))
+
+    def test_related_count(self):
+        view, plugin = group_view()
+        view.result_list = Group.objects.filter(name__startswith='trelatemenu').order_by('name')
+        plugin.get_result_list(lambda: None)
+        links = [plugin.related_link(g) for g in view.result_list]
+        self.assertIn('<span class="badge">2</span>', links[0])
+        self.assertIn('<span class="badge">1</span>', links[1])
+        self.assertIn('<span class="badge">0</span>', links[2])
@@ -0,0 +1,154 @@
+"""
+   website.tests.trowcache
+   ~~~~~~~~~~~~~~~~~~~~~~~
+
+   列表行缓存的测试：模型版本号、权限指纹、缓存命中，模型及关联模型保存、删除、多对多变动后失效，权限不同的用户
+   分别缓存::
+
+       $ python -m unittest website.tests.trowcache
+
+"""
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.test.utils import override_settings
+from django.urls import path
+from website.site import WebSite
+from website.views import rowcache
+from website.views.views import ViewConfigMixin
+
+
+class PermissionConfig(ViewConfigMixin):
+    list_display = ('codename', 'name', 'content_type')
+    list_row_cache = True
+
+    def queryset(self):
+        return super(PermissionConfig, self).queryset().filter(codename__startswith='trowcache')
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'groups')
+    list_row_cache = True
+
+    def queryset(self):
+        return super(UserConfig, self).queryset().filter(username='trowcache_owner')
+
+
+site = WebSite('trowcache', ismainsite=False)
+site.register_modelorview(Permission, PermissionConfig)
+site.register_modelorview(User, UserConfig)
+urlpatterns = [path('', site.urls)]
+
+
+def render(model, user):
+    """
+    返回 (视图, 各行单元格的文本)
+    """
+    view = create_view(model, user=user, site=site)
+    return view, [[str(c.text) for c in row.cells] for row in view.results()]
+
+
+class TestRowCache(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestRowCache, cls).setUpClass()
+        cls.settings = override_settings(ROOT_URLCONF=__name__)
+        cls.settings.enable()
+        cls.admin = User(username='admin', is_active=True, is_superuser=True)
+        cls.owner = User.objects.create(username='trowcache_owner')
+        cls.content_type = ContentType.objects.create(app_label='trowcache', model='thing')
+        for i in range(3):
+            Permission.objects.create(content_type=cls.content_type, codename='trowcache%d' % i, name='p%d' % i)
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username='trowcache_owner').delete()
+        Group.objects.filter(name__startswith='trowcache').delete()
+        cls.content_type.delete()
+        cls.settings.disable()
+
+    def assertCached(self, model, user, hits, misses):
+        view, cells = render(model, user)
+        self.assertEqual((view.row_cache_hits, view.row_cache_misses), (hits, misses))
+        return cells
+
+    def test_generation(self):
+        rowcache.enable(Permission)
+        generation = rowcache.get_generation(Permission)
+        self.assertEqual(rowcache.get_generation(Permission), generation)
+        rowcache.bump(Permission)
+        self.assertEqual(rowcache.get_generation(Permission), generation + 1)
+        # 外键关联的模型变动
+        rowcache.bump(ContentType)
+        self.assertEqual(rowcache.get_generation(Permission), generation + 2)
+        # 没有关联的模型
+        rowcache.bump(Group)
+        self.assertEqual(rowcache.get_generation(Permission), generation + 2)
+
+    def test_fingerprint(self):
+        self.assertEqual(rowcache.permission_fingerprint(self.admin), 'superuser')
+        self.assertEqual(rowcache.permission_fingerprint(User(username='x', is_active=False)), 'inactive')
+        users = [User.objects.create(username='trowcache_f%d' % i, is_staff=True) for i in range(3)]
+        perm = Permission.objects.get(codename='view_group')
+        users[0].user_permissions.add(perm)
+        users[1].user_permissions.add(perm)
+        fingerprints = [rowcache.permission_fingerprint(User.objects.get(pk=u.pk)) for u in users]
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def test_hits_and_invalidation(self):
+        first = self.assertCached(Permission, self.admin, 0, 3)
+        self.assertEqual(self.assertCached(Permission, self.admin, 3, 0), first)
+        # 模型保存、删除后失效
+        perm = Permission.objects.get(codename='trowcache0')
+        perm.name = 'changed'
+        perm.save()
+        cells = self.assertCached(Permission, self.admin, 0, 3)
+        self.assertIn('changed', sum(cells, []))
+        extra = Permission.objects.create(content_type=self.content_type, codename='trowcache9', name='p9')
+        self.assertCached(Permission, self.admin, 0, 4)
+        extra.delete()
+        self.assertCached(Permission, self.admin, 0, 3)
+        # 外键关联的模型保存后失效
+        self.content_type.save()
+        self.assertCached(Permission, self.admin, 0, 3)
+        # 不经过信号的修改不会失效
+        Permission.objects.filter(codename='trowcache0').update(name='stale')
+        cells = self.assertCached(Permission, self.admin, 3, 0)
+        self.assertNotIn('stale', sum(cells, []))
+        self.assertGreater(rowcache.stats(Permission)['hits'], 0)
+
+    def test_m2m(self):
+        group = Group.objects.create(name='trowcache')
+        self.assertCached(User, self.admin, 0, 1)
+        self.assertCached(User, self.admin, 1, 0)
+        self.owner.groups.add(group)
+        self.assertCached(User, self.admin, 0, 1)
+        group.name = 'trowcache_renamed'
+        group.save()
+        self.assertCached(User, self.admin, 0, 1)
+        self.owner.groups.remove(group)
+        self.assertCached(User, self.admin, 0, 1)
+        # 自动生成的中间表只连接 m2m_changed
+        through = User.groups.through
+        self.assertTrue(m2m_changed.has_listeners(through))
+        self.assertFalse(post_save.has_listeners(through))
+        self.assertFalse(post_delete.has_listeners(through))
+        group.delete()
+
+    def test_permissions(self):
+        view = Permission.objects.get(codename='view_permission')
+        change = Permission.objects.get(codename='change_group')
+        users = [User.objects.create(username='trowcache_p%d' % i, is_staff=True) for i in range(3)]
+        users[0].user_permissions.add(view, change)
+        users[1].user_permissions.add(view)
+        users[2].user_permissions.add(view, change)
+        self.assertCached(Permission, User.objects.get(pk=users[0].pk), 0, 3)
+        # 权限相同的用户共用缓存，权限不同的分别缓存
+        self.assertCached(Permission, User.objects.get(pk=users[2].pk), 3, 0)
+        self.assertCached(Permission, User.objects.get(pk=users[1].pk), 0, 3)
@@ -0,0 +1,75 @@
+"""
+   website.tests.tsearch
+   ~~~~~~~~~~~~~~~~~~~~~
+
+   列表搜索后端的测试：orm、memory、sqlite_fts 的搜索结果一致，索引随模型保存、删除同步，按相关度排序::
+
+       $ python -m unittest website.tests.tsearch
+
+"""
+
+from website.tests import setup_django, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from website.views import search
+
+NAMES = ['tsearch apple pie', 'tsearch apple', 'tsearch banana split', 'tsearch cherry apple tart']
+
+
+def names(backend, query):
+    conditions, rank = backend.search(query)
+    queryset = Group.objects.filter(*conditions)
+    if rank is not None:
+        queryset = queryset.annotate(**{search.RANK_NAME: rank}).order_by('-' + search.RANK_NAME, 'name')
+    else:
+        queryset = queryset.order_by('name')
+    return list(queryset.values_list('name', flat=True))
+
+
+class TestSearch(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestSearch, cls).setUpClass()
+        for name in NAMES:
+            Group.objects.create(name=name)
+        cls.orm = search.get_backend(Group, 'orm', ['name'])
+        cls.memory = search.get_backend(Group, 'memory', ['name'])
+        cls.fts = search.get_backend(Group, 'sqlite_fts', ['name'])
+        cls.memory.watch()
+        cls.fts.watch()
+
+    @classmethod
+    def tearDownClass(cls):
+        Group.objects.filter(name__startswith='tsearch').delete()
+        with connection.cursor() as cursor:
+            cls.fts.drop(cursor)
+
+    def test_backends(self):
+        self.assertEqual(sorted(names(self.orm, 'apple')), sorted(NAMES[:2] + NAMES[3:]))
+        self.assertEqual(sorted(names(self.memory, 'apple tsearch')), sorted(names(self.orm, 'apple tsearch')))
+        self.assertEqual(self.fts.sync(), Group.objects.count())
+        self.assertEqual(sorted(names(self.fts, 'app tse')), sorted(names(self.orm, 'app tse')))
+        self.assertEqual(names(self.fts, 'banana split'), ['tsearch banana split'])
+        self.assertEqual(names(self.memory, 'nothing'), [])
+
+    def test_rank(self):
+        # 完整匹配的词、较短的文本排在前面
+        self.assertEqual(names(self.memory, 'apple')[0], 'tsearch apple')
+        self.fts.sync()
+        self.assertEqual(names(self.fts, 'apple')[0], 'tsearch apple')
+
+    def test_sync(self):
+        self.fts.sync()
+        group = Group.objects.create(name='tsearch durian')
+        self.assertEqual(names(self.fts, 'durian'), ['tsearch durian'])
+        self.assertEqual(names(self.memory, 'durian'), ['tsearch durian'])
+        group.name = 'tsearch elderberry'
+        group.save()
+        self.assertEqual(names(self.fts, 'durian'), [])
+        self.assertEqual(names(self.memory, 'elder'), ['tsearch elderberry'])
+        group.delete()
+        self.assertEqual(names(self.fts, 'elderberry'), [])
+        self.assertEqual(names(self.memory, 'elderberry'), [])
@@ -0,0 +1,137 @@
+"""
+   website.tests.ttotals
+   ~~~~~~~~~~~~~~~~~~~~~
+
+   结果总数与汇总行合并为一次查询（get_result_totals、count_with_totals、AggregationPlugin）的测试：只在
+   list_count 为 cache 时缓存，以及估算总数、keyset 分页时汇总行单独查询::
+
+       $ python -m unittest website.tests.ttotals
+
+"""
+from unittest import mock
+
+from website.tests import setup_django, create_view, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Max
+from django.test.utils import CaptureQueriesContext
+from website.views.configs import COUNT_ESTIMATE_MIN
+from website.views.plugins import AggregationPlugin
+from website.views.views import ViewConfigMixin
+
+
+class UserConfig(ViewConfigMixin):
+    list_display = ('username', 'id', 'is_staff')
+    aggregate_fields = {'id': 'max'}
+    result_cache_timeout = 0
+
+
+class CachedUserConfig(UserConfig):
+    list_count = 'cache'
+    list_count_timeout = 60
+
+
+class ExactUserConfig(UserConfig):
+    result_cache_timeout = 60
+
+
+class EstimateUserConfig(UserConfig):
+    list_count = 'estimate'
+
+
+class KeysetUserConfig(UserConfig):
+    pagination = 'keyset'
+    ordering = ('id',)
+
+
+def totals_view(config):
+    view = create_view(User, config, [AggregationPlugin], result_list=False)
+    return view, [p for p in view.plugins if isinstance(p, AggregationPlugin)][0]
+
+
+def aggregate_text(plugin):
+    return dict((c.field_name, str(c.text)) for c in plugin._get_aggregate_row().cells)['id']
+
+
+class TestTotals(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestTotals, cls).setUpClass()
+        for i in range(3):
+            User.objects.create(username='ttotals%d' % i)
+
+    @classmethod
+    def tearDownClass(cls):
+        User.objects.filter(username__startswith='ttotals').delete()
+
+    def expected(self):
+        return User.objects.count(), User.objects.aggregate(Max('id'))['id__max']
+
+    def test_one_query(self):
+        count, max_id = self.expected()
+        view, plugin = totals_view(UserConfig)
+        with CaptureQueriesContext(connection) as queries:
+            view.get_result_list()
+            text = aggregate_text(plugin)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(view.result_count, count)
+        self.assertEqual(view.result_totals, {'id__max': max_id})
+        self.assertEqual(text, str(max_id))
+        self.assertEqual(view.count_with_totals(User.objects.all(), {'n': Count('id')}), (count, {'n': count}))
+
+    def test_cache(self):
+        count, max_id = self.expected()
+        totals_view(CachedUserConfig)[0].get_result_list()
+        view, plugin = totals_view(CachedUserConfig)
+        with CaptureQueriesContext(connection) as queries:
+            view.get_result_list()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual((view.result_count, view.result_totals), (count, {'id__max': max_id}))
+        # 模型变动后重新计算
+        User.objects.create(username='ttotals_new')
+        view, plugin = totals_view(CachedUserConfig)
+        view.get_result_list()
+        self.assertEqual(view.result_count, count + 1)
+        self.assertEqual(aggregate_text(plugin), str(User.objects.aggregate(Max('id'))['id__max']))
+        User.objects.filter(username='ttotals_new').delete()
+
+    def test_exact(self):
+        # 精确计数时不缓存
+        count, max_id = self.expected()
+        totals_view(ExactUserConfig)[0].get_result_list()
+        view, plugin = totals_view(ExactUserConfig)
+        with CaptureQueriesContext(connection) as queries:
+            view.get_result_list()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual((view.result_count, view.result_totals), (count, {'id__max': max_id}))
+
+    def test_estimate_fallback(self):
+        count, max_id = self.expected()
+        view, plugin = totals_view(EstimateUserConfig)
+        with mock.patch('website.views.views.estimate_count', return_value=COUNT_ESTIMATE_MIN):
+            view.get_result_list()
+        self.assertTrue(view.result_count_approximate)
+        self.assertEqual(view.result_count, COUNT_ESTIMATE_MIN)
+        self.assertIsNone(view.result_totals)
+        # 汇总行单独查询
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(aggregate_text(plugin), str(max_id))
+        self.assertEqual(len(queries), 1)
+        # 无法估算（SQLite）时与精确计数相同
+        view, plugin = totals_view(EstimateUserConfig)
+        view.get_result_list()
+        self.assertFalse(view.result_count_approximate)
+        self.assertEqual((view.result_count, view.result_totals), (count, {'id__max': max_id}))
+
+    def test_keyset_fallback(self):
+        count, max_id = self.expected()
+        view, plugin = totals_view(KeysetUserConfig)
+        view.get_result_list()
+        self.assertIsNone(view.result_count)
+        self.assertIsNone(view.result_totals)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(aggregate_text(plugin), str(max_id))
+        self.assertEqual(len(queries), 1)
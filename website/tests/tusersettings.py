@@ -0,0 +1,74 @@
+"""
+   website.tests.tusersettings
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   用户设置的请求内共用、跨请求缓存及提交后失效的测试::
+
+       $ python -m unittest website.tests.tusersettings
+
+"""
+
+from website.tests import setup_django, create_request, DatabaseTestCase
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from website.models import UserSetting
+from website.views import usersettings
+
+
+class TestUserSettings(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestUserSettings, cls).setUpClass()
+        cls.user = User.objects.create(username='tusersettings')
+        UserSetting.objects.create(user=cls.user, key='website-theme', value='"a.css"')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user.delete()
+
+    def request(self):
+        return create_request(user=self.user)
+
+    def test_cache(self):
+        request = self.request()
+        with CaptureQueriesContext(connection) as queries:
+            settings = usersettings.get_settings(request)
+            self.assertEqual(settings.json('website-theme'), 'a.css')
+            self.assertIsNone(settings.get('missing'))
+            self.assertIs(usersettings.get_settings(request), settings)
+        self.assertEqual(len(queries), 1)
+        # 之后的请求从缓存读取
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn('website-theme', usersettings.get_settings(self.request()))
+        self.assertEqual(len(queries), 0)
+        # set 及模型的保存、删除使缓存失效
+        settings.set('dashboard:/:pos', '1|2')
+        self.assertEqual(usersettings.get_settings(self.request()).get('dashboard:/:pos'), '1|2')
+        setting = UserSetting.objects.get(user=self.user, key='dashboard:/:pos')
+        setting.value = '2|1'
+        setting.save()
+        self.assertEqual(usersettings.get_settings(self.request()).get('dashboard:/:pos'), '2|1')
+        setting.delete()
+        self.assertNotIn('dashboard:/:pos', usersettings.get_settings(self.request()))
+
+    def test_rollback(self):
+        usersettings.get_settings(self.request()).get('website-theme')
+        try:
+            with transaction.atomic():
+                settings = usersettings.get_settings(self.request())
+                settings.set('website-theme', '"b.css"')
+                # 提交前不修改缓存
+                self.assertEqual(settings.json('website-theme'), 'b.css')
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(usersettings.get_settings(self.request()).json('website-theme'), 'a.css')
+                self.assertEqual(len(queries), 0)
+                raise ValueError
+        except ValueError:
+            pass
+        # 回滚的修改没有进入缓存
+        self.assertEqual(usersettings.get_settings(self.request()).json('website-theme'), 'a.css')
+        self.assertEqual(UserSetting.objects.get(user=self.user, key='website-theme').value, '"a.css"')
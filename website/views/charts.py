@@ -0,0 +1,116 @@
+"""
+图表数据
+
+``data_charts`` 中配置了 ``aggregate`` 的图表由数据库计算：在列表过滤后的 queryset 上按 x 列分组，对 y 列聚合；
+x 列为日期、时间时按 ``bucket`` 截断（hour、day、week、month、year），``auto`` 时根据数据的时间跨度选择使点数不超过
+``points`` 的最细粒度。点数超过 ``points`` 的序列用 LTTB（Largest-Triangle-Three-Buckets）抽样，保留曲线形状。
+"""
+import datetime
+import decimal
+
+from django.db import models
+from django.db.models import Sum, Avg, Count, Max, Min
+from django.db.models.functions import TruncHour, TruncDay, TruncWeek, TruncMonth, TruncYear
+
+from website.views.utils import get_fields_from_path
+
+AGGREGATES = {'sum': Sum, 'avg': Avg, 'count': Count, 'max': Max, 'min': Min}
+# (粒度, 截断函数, 秒数)，由细到粗
+BUCKETS = (
+    ('hour', TruncHour, 3600),
+    ('day', TruncDay, 86400),
+    ('week', TruncWeek, 7 * 86400),
+    ('month', TruncMonth, 30 * 86400),
+    ('year', TruncYear, 365 * 86400),
+)
+X_NAME = '_chart_x'
+
+
+def to_number(value):
+    """
+    作图及抽样用的数值，日期、时间转为时间戳，不能转换时抛出 TypeError
+    """
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return value.toordinal() * 86400.0
+    if isinstance(value, bool) or value is None:
+        raise TypeError(value)
+    return float(value)
+
+
+def choose_bucket(field, start, end, points):
+    """
+    时间跨度内桶数不超过 points 的最细粒度，日期字段不按小时
+    """
+    if start is None or end is None:
+        return 'day'
+    span = (to_number(end) - to_number(start))
+    for name, trunc, seconds in BUCKETS:
+        if name == 'hour' and not isinstance(field, models.DateTimeField):
+            continue
+        if span / seconds < points:
+            return name
+    return 'year'
+
+
+def aggregate_series(queryset, x_field, y_fields, aggregate='sum', bucket='auto', points=1000):
+    """
+    [[(x, y), ...], ...]，每个 y 列一个序列。aggregate 为聚合方式或 {y 列: 聚合方式}
+    """
+    field = get_fields_from_path(queryset.model, x_field)[-1]
+    queryset = queryset.order_by()
+    queryset.query.distinct = False
+    x = models.F(x_field)
+    if isinstance(field, (models.DateField, models.DateTimeField)) and bucket:
+        if bucket == 'auto':
+            bounds = queryset.aggregate(start=Min(x_field), end=Max(x_field))
+            bucket = choose_bucket(field, bounds['start'], bounds['end'], points)
+        x = dict((name, trunc) for name, trunc, seconds in BUCKETS)[bucket](x_field)
+    aggregates = {}
+    for i, y in enumerate(y_fields):
+        name = aggregate.get(y, 'sum') if isinstance(aggregate, dict) else aggregate
+        aggregates['_chart_y%d' % i] = AGGREGATES[name](y)
+    rows = queryset.annotate(**{X_NAME: x}).values(X_NAME).annotate(**aggregates).order_by(X_NAME)
+    series = [[] for y in y_fields]
+    for row in rows:
+        for i, data in enumerate(series):
+            value = row['_chart_y%d' % i]
+            data.append((row[X_NAME], float(value) if isinstance(value, decimal.Decimal) else value))
+    return series
+
+
+def lttb(data, threshold):
+    """
+    Largest-Triangle-Three-Buckets 抽样：保留首尾点，其余点分为 threshold - 2 个桶，每个桶取与前一个选中点、
+    下一个桶的平均点组成的三角形面积最大的点。x、y 不是数值时原样返回
+    """
+    if threshold is None or threshold < 3 or len(data) <= threshold:
+        return data
+    try:
+        xs = [to_number(x) for x, y in data]
+        ys = [to_number(y) for x, y in data]
+    except (TypeError, ValueError):
+        return data
+    sampled = [data[0]]
+    every = (len(data) - 2) / float(threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # 下一个桶的平均点，最后一个桶取末尾点
+        next_start, next_end = end, min(int((i + 2) * every) + 1, len(data))
+        if next_start >= next_end:
+            avg_x, avg_y = xs[-1], ys[-1]
+        else:
+            avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+            avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(data[best])
+        a = best
+    sampled.append(data[-1])
+    return sampled
@@ -17,11 +17,36 @@ ACTION_CHECKBOX_NAME = getattr(settings, 'BASE_ACTION_CHECKBOX_NAME', '_selected
 ALL_VAR = getattr(settings, 'BASE_ALL_VAR', 'all')
 ORDER_VAR = getattr(settings, 'BASE_ORDER_VAR', 'o')
 PAGE_VAR = getattr(settings, 'BASE_PAGE_VAR', 'p')
+CURSOR_VAR = getattr(settings, 'BASE_CURSOR_VAR', '_c')
 COL_LIST_VAR = getattr(settings, 'BASE_COL_LIST_VAR', '_cols')
 ERROR_FLAG = getattr(settings, 'BASE_ERROR_FLAG', 'e')
 DOT = getattr(settings, 'BASE_DOT', '.')
 ROOT_PATH_NAME = getattr(settings, 'BASE_ROOT_PATH_NAME', 'website')
 EXPORT_MAX = getattr(settings, 'EXPORT_MAX', 10000)
+EXPORT_EXECUTOR = getattr(settings, 'BASE_EXPORT_EXECUTOR', 'thread')  # 后台导出的执行方式: thread、db、sync
+EXPORT_WORKERS = getattr(settings, 'BASE_EXPORT_WORKERS', 2)
+EXPORT_DIR = getattr(settings, 'BASE_EXPORT_DIR', 'exports')
+COUNT_ESTIMATE_MIN = getattr(settings, 'BASE_COUNT_ESTIMATE_MIN', 10000)  # 估算行数低于该值时改用精确计数
+QUERY_PROFILE = getattr(settings, 'BASE_QUERY_PROFILE', False)  # 是否记录每个视图请求的数据库查询
+QUERY_PROFILE_LOG = getattr(settings, 'BASE_QUERY_PROFILE_LOG', None)  # 查询记录追加写入的文件, 供 manage.py queryreport 汇总
+QUERY_SLOW_MS = getattr(settings, 'BASE_QUERY_SLOW_MS', 100)  # 单条查询超过该毫秒数记为慢查询
+QUERY_DUPLICATE_MIN = getattr(settings, 'BASE_QUERY_DUPLICATE_MIN', 5)  # 同一形式的语句执行次数达到该值时视为 N+1
+FILTER_CHOICES_CACHE = getattr(settings, 'BASE_FILTER_CHOICES_CACHE', 'default')  # 过滤器选项使用的缓存, None 时不缓存
+FILTER_CHOICES_TIMEOUT = getattr(settings, 'BASE_FILTER_CHOICES_TIMEOUT', 600)  # 过滤器选项缓存的秒数, 不经过信号的修改最多延迟这么久
+FILTER_COUNTS_TIMEOUT = getattr(settings, 'BASE_FILTER_COUNTS_TIMEOUT', 60)  # 过滤器选项记录数缓存的秒数
+SEARCH_BACKEND = getattr(settings, 'BASE_SEARCH_BACKEND', 'orm')  # 列表搜索的默认后端, 见 website.views.search
+SEARCH_INDEX_BATCH = getattr(settings, 'BASE_SEARCH_INDEX_BATCH', 500)  # searchindex 每批写入索引的对象数
+CHART_MAX_POINTS = getattr(settings, 'BASE_CHART_MAX_POINTS', 1000)  # 图表每个序列最多的点数, 超过时抽样
+RESULT_CACHE_TIMEOUT = getattr(settings, 'BASE_RESULT_CACHE_TIMEOUT', 60)  # 图表、汇总行结果缓存的秒数, 0 时不缓存
+RESULT_LOCK_TIMEOUT = getattr(settings, 'BASE_RESULT_LOCK_TIMEOUT', 30)  # 同一结果只由一个进程计算, 其他进程最多等待的秒数
+RESULT_LOCK_WAIT = getattr(settings, 'BASE_RESULT_LOCK_WAIT', 0.05)  # 等待结果时查询缓存的间隔秒数
+DASHBOARD_WIDGET_RENDER = getattr(settings, 'BASE_DASHBOARD_WIDGET_RENDER', 'sync')  # 仪表盘区块的渲染方式: sync、parallel、lazy, 见 website.views.dashboard
+DASHBOARD_WIDGET_WORKERS = getattr(settings, 'BASE_DASHBOARD_WIDGET_WORKERS', 4)  # parallel 渲染的线程数
+DASHBOARD_WIDGET_TIMEOUT = getattr(settings, 'BASE_DASHBOARD_WIDGET_TIMEOUT', 10)  # 等待单个区块的秒数, 超时的区块改为 ajax 加载或显示超时
+DASHBOARD_WIDGET_CACHE_TIMEOUT = getattr(settings, 'BASE_DASHBOARD_WIDGET_CACHE_TIMEOUT', 0)  # 仪表盘区块渲染结果的默认缓存秒数, 0 时不缓存
+USER_SETTINGS_TIMEOUT = getattr(settings, 'BASE_USER_SETTINGS_TIMEOUT', 300)  # 用户设置缓存的秒数, 保存、删除设置时同时更新缓存
+NAV_MENU_CACHE_SIZE = getattr(settings, 'BASE_NAV_MENU_CACHE_SIZE', 128)  # 进程内保存的编译好的导航菜单数, 每种权限组合一份
+NAV_MENU_TIMEOUT = getattr(settings, 'BASE_NAV_MENU_TIMEOUT', 3600)  # 导航菜单及用户权限指纹在共享缓存中的秒数
 ACTION_NAME = {
     'add': '添加 %s',
     'change': '修改 %s',
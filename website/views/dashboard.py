@@ -0,0 +1,89 @@
+"""
+仪表盘区块的渲染
+
+``DashboardViewTemplate.widget_render`` 决定区块的渲染方式：
+
+* sync: 模板中依次渲染（默认）
+* parallel: 用进程内线程池并发渲染，每个线程使用自己的数据库连接；``widget_timeout`` 秒内没有完成的区块改为 ajax 加载
+* lazy: 页面只输出区块的框架，内容由浏览器通过 ``?_widget=<序号>`` 分别加载
+
+parallel、lazy 方式下单个区块出错时只在该区块显示错误信息，不影响其他区块。
+
+区块的渲染结果按 ``Component`` 的缓存策略（``cache_timeout``、``cache_vary_on``、``cache_models``）缓存，
+区块上的刷新按钮通过 ``?_widget=<序号>&_refresh=1`` 重新渲染并更新缓存。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.db import close_old_connections
+from django.utils import timezone, translation
+
+from website.views.configs import DASHBOARD_WIDGET_WORKERS
+
+logger = logging.getLogger('website')
+
+WIDGET_VAR = '_widget'
+REFRESH_VAR = '_refresh'
+LAZY_TEMPLATE = 'website/components/lazy.tpl'
+ERROR_TEMPLATE = 'website/components/error.tpl'
+CONTENT_BOX_TEMPLATE = 'website/includes/box_content.tpl'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DASHBOARD_WIDGET_WORKERS)
+    return _executor
+
+
+def render_widget(widget, box_tpl=None):
+    """
+    渲染区块，出错时返回错误信息区块
+    """
+    try:
+        return widget.render(box_tpl=box_tpl)
+    except Exception as e:
+        logger.exception('dashboard widget %s failed', widget.id)
+        return widget.render(ERROR_TEMPLATE, box_tpl, {'error': e})
+
+
+def render_lazy(widget, url, timeout):
+    """
+    只有框架的区块，内容由 website.page.dashboard.js 从 url 加载
+    """
+    return widget.render(LAZY_TEMPLATE, extra={'widget_url': url, 'widget_timeout': timeout})
+
+
+def _render_thread(widget, language, tz):
+    # 语言、时区是线程局部的，沿用请求线程的设置
+    translation.activate(language)
+    timezone.activate(tz)
+    try:
+        return render_widget(widget)
+    finally:
+        translation.deactivate()
+        timezone.deactivate()
+        close_old_connections()
+
+
+def render_parallel(widgets, timeout):
+    """
+    在线程池中并发渲染 widgets，返回与之对应的 html 列表，timeout 秒内没有完成的为 None
+    """
+    language, tz = translation.get_language(), timezone.get_current_timezone()
+    futures = [get_executor().submit(_render_thread, w, language, tz) for w in widgets]
+    deadline = time.time() + timeout
+    result = []
+    for future in futures:
+        try:
+            result.append(future.result(max(deadline - time.time(), 0)))
+        except TimeoutError:
+            future.cancel()
+            result.append(None)
+    return result
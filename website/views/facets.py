@@ -0,0 +1,114 @@
+"""
+过滤器选项的记录数（facet）
+
+配置 ``filter_counts = True`` 后，FilterPlugin、QuickFilterPlugin 的选项型过滤器（布尔、choices、关联字段、多选）
+在每个选项旁显示记录数。每个过滤器的记录数基于除它自己之外的所有过滤、搜索条件，选中一个选项后同一过滤器的
+其他选项仍显示各自的数量。过滤器第一次输出选项时一次算出所有过滤器的记录数：
+
+* 未使用的过滤器共用列表的 queryset：选项固定的（布尔、选项不多的 choices 字段）合成一条条件聚合查询，
+  关联字段及多选过滤器各按字段路径做一次 GROUP BY，只取数量最多的 ``filter_counts_top`` 个值
+* 使用中的过滤器由 FilterPlugin 去掉它自己的条件重新生成 queryset，各做一次查询
+
+查询结果以 SQL 为键通过 :data:`website.views.filters.choices_cache` 缓存 ``BASE_FILTER_COUNTS_TIMEOUT`` 秒，
+列表的模型及字段路径上的模型变动时失效。
+"""
+from django.db.models import Count
+
+from website.views.configs import FILTER_COUNTS_TIMEOUT
+from website.views.filters import ListFieldFilter, choices_cache, queryset_scope
+
+COUNT_NAME = '_facet_count'
+
+
+def count_queryset(queryset):
+    """
+    计数使用的 queryset：去掉排序、prefetch 及 distinct（计数时按主键去重）
+    """
+    queryset = queryset.order_by().prefetch_related(None)
+    queryset.query.distinct = False
+    return queryset
+
+
+class FacetCounter(object):
+    """
+    一个请求中一组过滤器的记录数
+    """
+
+    def __init__(self, view, top=50, timeout=FILTER_COUNTS_TIMEOUT):
+        self.view = view
+        self.top = top
+        self.timeout = timeout
+        self.specs = []
+        self.counts = None
+
+    def add(self, spec, get_queryset=None):
+        """
+        登记过滤器，get_queryset(spec) 返回去掉该过滤器条件后的 queryset；过滤器未使用或 get_queryset 为 None、
+        返回 None 时使用列表的 queryset
+        """
+        # 文本、数字等输入型过滤器没有选项
+        if not isinstance(spec, ListFieldFilter) or (spec.facet_terms() is None and spec.facet_path() is None):
+            return
+        spec.facets = self
+        self.specs.append((spec, get_queryset))
+
+    def get(self, spec):
+        """
+        过滤器的 ({选项: 数量}, 是否完整)，不完整时不在其中的选项数量未知
+        """
+        if self.counts is None:
+            self.counts = {}
+            self.compute()
+        return self.counts.get(spec, ({}, False))
+
+    def compute(self):
+        shared = self.view.list_queryset
+        terms = {}
+        for spec, get_queryset in self.specs:
+            queryset = get_queryset(spec) if get_queryset is not None and spec.is_used else None
+            if queryset is None:
+                queryset = shared
+            if spec.facet_terms() is not None:
+                terms.setdefault(id(queryset), (queryset, []))[1].append(spec)
+            else:
+                self.counts[spec] = self.group_counts(queryset, spec)
+        for queryset, specs in terms.values():
+            self.terms_counts(queryset, specs)
+
+    def cached(self, name, build, scope, paths):
+        model = self.view.model
+        dependencies = [model]
+        for path in paths:
+            dependencies.extend(m for m in choices_cache.path_models(model, path) if m not in dependencies)
+        return choices_cache.get_choices(model, 'facet:%s' % name, build, scope=scope,
+                                         dependencies=dependencies, timeout=self.timeout)
+
+    def terms_counts(self, queryset, specs):
+        """
+        条件聚合：一条查询算出一组过滤器所有选项的数量
+        """
+        queryset = count_queryset(queryset)
+        aggregates, names = {}, []
+        for i, spec in enumerate(specs):
+            for j, (key, q) in enumerate(spec.facet_terms()):
+                name = 'f%d_%d' % (i, j)
+                aggregates[name] = Count('pk', filter=q, distinct=True)
+                names.append((spec, key, name))
+        scope = (queryset_scope(queryset), [(s.field_path, repr(s.facet_terms())) for s in specs])
+        result = self.cached('terms', lambda: [queryset.aggregate(**aggregates)], scope,
+                             [s.field_path for s in specs])[0]
+        for spec in specs:
+            self.counts[spec] = ({}, True)
+        for spec, key, name in names:
+            self.counts[spec][0][key] = result[name]
+
+    def group_counts(self, queryset, spec):
+        """
+        按字段路径分组，取数量最多的 top 个值
+        """
+        path = spec.facet_path()
+        queryset = count_queryset(queryset).values(path).annotate(**{COUNT_NAME: Count('pk', distinct=True)}) \
+            .order_by('-' + COUNT_NAME, path)[:self.top + 1]
+        rows = self.cached(path, lambda: [(row[path], row[COUNT_NAME]) for row in queryset],
+                           queryset_scope(queryset), [path])
+        return dict((spec.facet_key(value), n) for value, n in rows[:self.top]), len(rows) <= self.top
@@ -1,7 +1,11 @@
 import datetime
+import hashlib
+import time
 
-from django.core.exceptions import ImproperlyConfigured
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured, EmptyResultSet
+from django.apps import apps
+from django.db import connections, models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.template.loader import get_template
 from django.utils import timezone
 from django.utils.encoding import smart_str
@@ -10,10 +14,11 @@ from django.utils.safestring import mark_safe
 from django.utils.text import Truncator
 from django.utils.translation import ugettext_lazy as _
 
-from website.views.configs import EMPTY_CHANGELIST_VALUE, FILTER_PREFIX
+from website.views.configs import EMPTY_CHANGELIST_VALUE, FILTER_PREFIX, FILTER_CHOICES_CACHE, FILTER_CHOICES_TIMEOUT, \
+    RESULT_LOCK_TIMEOUT, RESULT_LOCK_WAIT
 from website.tools.dutils import RelatedObject, get_cache
 from website.views.utils import get_model_from_relation, reverse_field_path, get_limit_choices_to_from_path, \
-    prepare_lookup_value
+    prepare_lookup_value, get_fields_from_path, semijoin
 
 
 class FieldFilterManager(object):
@@ -40,6 +45,151 @@ class FieldFilterManager(object):
 manager = FieldFilterManager()
 
 
+def queryset_scope(queryset):
+    """
+    queryset 的 SQL，作为选项缓存键的一部分：视图按用户限定了 queryset 时各自缓存
+    """
+    try:
+        return repr(queryset.query.sql_with_params())
+    except EmptyResultSet:
+        return None
+
+
+def queryset_models(queryset):
+    """
+    queryset 的 SQL（包括子查询）中用到的模型
+    """
+    sql, params = queryset.query.sql_with_params()
+    qn = connections[queryset.db].ops.quote_name
+    return [m for m in apps.get_models(include_auto_created=True) if qn(m._meta.db_table) in sql]
+
+
+def _bump_choices(sender, **kwargs):
+    transaction.on_commit(lambda: choices_cache.bump(sender))
+
+
+class FilterChoicesCache(object):
+    """
+    过滤器选项缓存
+
+    选项按 (模型, 字段路径, limit_choices_to, 查询范围) 缓存，键中还包含选项涉及的各模型（模型本身、字段路径经过的
+    关联模型及多对多中间表）的版本号。这些模型 post_save、post_delete、m2m_changed 时版本号加一，旧的选项随之失效；
+    不经过信号的修改（如 ``queryset.update()``）在 ``BASE_FILTER_CHOICES_TIMEOUT`` 秒后生效。
+    """
+
+    def __init__(self, alias=FILTER_CHOICES_CACHE, timeout=FILTER_CHOICES_TIMEOUT):
+        self.alias = alias
+        self.timeout = timeout
+        self._watched = set()
+
+    @property
+    def cache(self):
+        return get_cache(self.alias)
+
+    def version_key(self, model):
+        return 'website:filterver:%s' % model._meta.label_lower
+
+    def get_version(self, model):
+        key = self.version_key(model)
+        version = self.cache.get(key)
+        if version is None:
+            # 初始值取当前时间，缓存被清除后不会回到旧的版本号
+            self.cache.add(key, int(time.time() * 1000), None)
+            version = self.cache.get(key)
+        return version
+
+    def bump(self, model):
+        try:
+            self.cache.incr(self.version_key(model))
+        except ValueError:
+            pass
+
+    def watch(self, model):
+        """
+        模型变动时使其相关的选项失效，只为用到的模型连接信号，其他模型删除时仍可批量快速删除。自动生成的多对多中间表
+        的行由 add()、remove() 等修改，只发送 m2m_changed（sender 为中间表），不连接 post_save、post_delete
+        """
+        if model in self._watched:
+            return
+        self._watched.add(model)
+        if not model._meta.auto_created:
+            post_save.connect(_bump_choices, sender=model, dispatch_uid='website.filters')
+            post_delete.connect(_bump_choices, sender=model, dispatch_uid='website.filters')
+        m2m_changed.connect(_bump_choices, sender=model, dispatch_uid='website.filters')
+
+    def path_models(self, model, field_path):
+        """
+        从 model 经 field_path 涉及的模型
+        """
+        result = [model]
+        for f in get_fields_from_path(model, field_path):
+            if f.is_relation and f.related_model is not None:
+                result.append(f.related_model)
+                if f.many_to_many:
+                    result.append(getattr(f, 'through', None) or f.remote_field.through)
+        return result
+
+    def get_choices(self, model, field_path, build, limit_choices_to=None, scope=None, dependencies=None,
+                    timeout=None):
+        """
+        返回缓存的选项，没有时调用 build() 生成，选项需可以 pickle。dependencies 为选项涉及的模型，默认为
+        :meth:`path_models`
+        """
+        if not self.alias:
+            return list(build())
+        dependencies = dependencies or self.path_models(model, field_path)
+        for m in dependencies:
+            self.watch(m)
+        versions = [(m._meta.label_lower, self.get_version(m)) for m in dependencies]
+        parts = (field_path, repr(limit_choices_to), scope, versions)
+        key = 'website:filterchoices:%s:%s' % (model._meta.label_lower,
+                                               hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+        choices = self.cache.get(key)
+        if choices is None:
+            choices = self.coalesce(key, lambda: list(build()), timeout or self.timeout)
+        return choices
+
+    def coalesce(self, key, build, timeout):
+        """
+        single-flight：缓存中没有 key 时只由一个进程（线程）调用 build() 并写入缓存，其他的等待它的结果；
+        等待超过 ``BASE_RESULT_LOCK_TIMEOUT`` 秒（计算的进程可能已退出）后自己计算
+        """
+        lock = '%s:lock' % key
+        deadline = time.time() + RESULT_LOCK_TIMEOUT
+        while not self.cache.add(lock, 1, RESULT_LOCK_TIMEOUT):
+            time.sleep(RESULT_LOCK_WAIT)
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+            if time.time() > deadline:
+                value = build()
+                self.cache.set(key, value, timeout)
+                return value
+        try:
+            # 等待锁的过程中结果可能刚刚写入
+            value = self.cache.get(key)
+            if value is None:
+                value = build()
+                self.cache.set(key, value, timeout)
+            return value
+        finally:
+            self.cache.delete(lock)
+
+    def get_result(self, model, name, build, queryset, timeout):
+        """
+        缓存基于 queryset 的计算结果（如聚合），键为 name 及 queryset 的 SQL，SQL 中用到的模型变动时失效。
+        timeout 为 0 或 None 时不缓存
+        """
+        scope = queryset_scope(queryset)
+        if not timeout or scope is None:
+            return build()
+        return self.get_choices(model, name, lambda: [build()], scope=scope, dependencies=queryset_models(queryset),
+                                timeout=timeout)[0]
+
+
+choices_cache = FilterChoicesCache()
+
+
 class BaseFilter(object):
     '''
     过滤器基类
@@ -164,7 +314,7 @@ class FieldFilter(InputFilter):
 
     def do_filte(self, queryset):
         '''根据 used_params 做查询'''
-        return queryset.filter(**self.used_params)
+        return queryset.filter(semijoin(self.model, **self.used_params))
 
 
 class ListFieldFilter(FieldFilter):
@@ -172,6 +322,42 @@ class ListFieldFilter(FieldFilter):
     列表型字段过滤器基类
     '''
     template = 'website/filters/list.tpl'
+    facets = None  # 计算各选项记录数的 website.views.facets.FacetCounter，未开启时为 None
+
+    def facet_terms(self):
+        '''
+        选项固定时返回 [(选项, Q), ...]，以条件聚合计算各选项的记录数
+        '''
+        return None
+
+    def facet_path(self):
+        '''
+        按该字段路径分组计算各选项的记录数
+        '''
+        return None
+
+    def facet_key(self, value):
+        '''
+        分组得到的值对应的选项
+        '''
+        return None if value is None else smart_str(value)
+
+    def facet_count(self, key):
+        '''
+        选项的记录数，未开启或不在统计的前几个值中时为 None
+        '''
+        if self.facets is None:
+            return None
+        counts, complete = self.facets.get(self)
+        return counts.get(key, 0 if complete else None)
+
+    def cached_choices(self, build, limit_choices_to=None, scope=None, dependencies=None, timeout=None):
+        '''
+        通过 :data:`choices_cache` 取得选项，build 在缓存中没有时生成选项
+        '''
+        return choices_cache.get_choices(self.model, self.field_path or self.field.name, build,
+                                         limit_choices_to=limit_choices_to, scope=scope,
+                                         dependencies=dependencies, timeout=timeout)
 
     def get_context(self):
         context = super(ListFieldFilter, self).get_context()
@@ -284,6 +470,12 @@ class BooleanFieldListFilter(ListFieldFilter):
     def test(cls, field, request, params, model, view, field_path):
         return isinstance(field, (models.BooleanField, models.NullBooleanField))
 
+    def facet_terms(self):
+        terms = [('1', models.Q(**{self.field_path: True})), ('0', models.Q(**{self.field_path: False}))]
+        if isinstance(self.field, models.NullBooleanField):
+            terms.append(('isnull', models.Q(**{'%s__isnull' % self.field_path: True})))
+        return terms
+
     def choices(self):
         for lookup, title in (('', _('All')), ('1', _('Yes')), ('0', _('No'))):
             yield {
@@ -292,6 +484,7 @@ class BooleanFieldListFilter(ListFieldFilter):
                     self.lookup_exact_name: lookup,
                 }, [self.lookup_isnull_name]),
                 'display': title,
+                'count': self.facet_count(lookup) if lookup else None,
             }
         if isinstance(self.field, models.NullBooleanField):
             yield {
@@ -300,17 +493,27 @@ class BooleanFieldListFilter(ListFieldFilter):
                     self.lookup_isnull_name: 'True',
                 }, [self.lookup_exact_name]),
                 'display': _('Unknown'),
+                'count': self.facet_count('isnull'),
             }
 
 
 @manager.register
 class ChoicesFieldListFilter(ListFieldFilter):
     lookup_formats = {'exact': '%s__exact'}
+    facet_terms_max = 20  # 选项不超过该数时以条件聚合计数，否则按字段分组
 
     @classmethod
     def test(cls, field, request, params, model, view, field_path):
         return bool(field.choices)
 
+    def facet_terms(self):
+        if len(self.field.flatchoices) > self.facet_terms_max:
+            return None
+        return [(smart_str(lookup), models.Q(**{self.field_path: lookup})) for lookup, title in self.field.flatchoices]
+
+    def facet_path(self):
+        return self.field_path
+
     def choices(self):
         yield {
             'selected': self.lookup_exact_val is '',
@@ -322,6 +525,7 @@ class ChoicesFieldListFilter(ListFieldFilter):
                 'selected': smart_str(lookup) == self.lookup_exact_val,
                 'query_string': self.query_string({self.lookup_exact_name: lookup}),
                 'display': title,
+                'count': self.facet_count(smart_str(lookup)),
             }
 
 
@@ -350,9 +554,8 @@ class NumberFieldListFilter(FieldFilter):
         params = self.used_params.copy()
         ne_key = '%s__ne' % self.field_path
         if ne_key in params:
-            queryset = queryset.exclude(
-                **{self.field_path: params.pop(ne_key)})
-        return queryset.filter(**params)
+            queryset = queryset.exclude(semijoin(self.model, **{self.field_path: params.pop(ne_key)}))
+        return queryset.filter(semijoin(self.model, **params))
 
 
 @manager.register
@@ -495,11 +698,11 @@ class RelatedFieldListFilter(ListFieldFilter):
 
         self.lookup_formats = {'in': '%%s__%s__in' % rel_name, 'exact': '%%s__%s__exact' %
                                                                         rel_name, 'isnull': '%s__isnull'}
-        self.lookup_choices = field.get_choices(include_blank=False)
-        # print('lookup_choices:', self.lookup_choices)
-        # print('field:', field)
         super(RelatedFieldListFilter, self).__init__(
             field, request, params, model, model_admin, field_path)
+        limit_choices_to = field.get_limit_choices_to() if hasattr(field, 'get_limit_choices_to') else None
+        self.lookup_choices = self.cached_choices(lambda: field.get_choices(include_blank=False),
+                                                  limit_choices_to=limit_choices_to, dependencies=[other_model])
 
         if hasattr(field, 'verbose_name'):
             self.lookup_title = field.verbose_name
@@ -527,6 +730,9 @@ class RelatedFieldListFilter(ListFieldFilter):
     def expected_parameters(self):
         return [self.lookup_kwarg, self.lookup_kwarg_isnull]
 
+    def facet_path(self):
+        return self.field_path
+
     def choices(self):
         yield {
             'selected': self.lookup_exact_val == '' and not self.lookup_isnull_val,
@@ -541,6 +747,7 @@ class RelatedFieldListFilter(ListFieldFilter):
                     self.lookup_exact_name: pk_val,
                 }, [self.lookup_isnull_name]),
                 'display': val,
+                'count': self.facet_count(smart_str(pk_val)),
             }
         if self.check_null():
             yield {
@@ -549,6 +756,7 @@ class RelatedFieldListFilter(ListFieldFilter):
                     self.lookup_isnull_name: 'True',
                 }, [self.lookup_exact_name]),
                 'display': EMPTY_CHANGELIST_VALUE,
+                'count': self.facet_count(None),
             }
 
 
@@ -568,9 +776,8 @@ class CommonFieldListFilter(FieldFilter):
         params = self.used_params.copy()
         ne_key = '%s__ne' % self.field_path
         if ne_key in params:
-            queryset = queryset.exclude(
-                **{self.field_path: params.pop(ne_key)})
-        return queryset.filter(**params)
+            queryset = queryset.exclude(semijoin(self.model, **{self.field_path: params.pop(ne_key)}))
+        return queryset.filter(semijoin(self.model, **params))
 
 
 @manager.register
@@ -583,40 +790,19 @@ class MultiSelectFieldListFilter(ListFieldFilter):
     """
     template = 'website/filters/checklist.tpl'
     lookup_formats = {'in': '%s__in'}
-    cache_config = {'enabled': False, 'key': 'quickfilter_%s', 'timeout': 3600, 'cache': 'default'}
+    cache_config = {'enabled': False, 'timeout': None}  # timeout 为 None 时使用 BASE_FILTER_CHOICES_TIMEOUT
 
     @classmethod
     def test(cls, field, request, params, model, view, field_path):
         return True
 
-    def get_cached_choices(self):
-        if not self.cache_config['enabled']:
-            return None
-        c = get_cache(self.cache_config['cache'])
-        return c.get(self.cache_config['key'] % self.field_path)
-
-    def set_cached_choices(self, choices):
-        if not self.cache_config['enabled']:
-            return
-        c = get_cache(self.cache_config['cache'])
-        return c.set(self.cache_config['key'] % self.field_path, choices)
-
     def __init__(self, field, request, params, model, model_admin, field_path, field_order_by=None, field_limit=None,
                  sort_key=None, cache_config=None):
         super(MultiSelectFieldListFilter, self).__init__(field, request, params, model, model_admin, field_path)
 
-        # Check for it in the cachce
         if cache_config is not None and type(cache_config) == dict:
-            self.cache_config.update(cache_config)
-
-        if self.cache_config['enabled']:
-            self.field_path = field_path
-            choices = self.get_cached_choices()
-            if choices:
-                self.lookup_choices = choices
-                return
+            self.cache_config = dict(self.cache_config, **cache_config)
 
-        # Else rebuild it
         queryset = self.view.queryset().exclude(**{"%s__isnull" % field_path: True}).values_list(field_path,
                                                                                                  flat=True).distinct()
         # queryset = self.view.queryset().distinct(field_path).exclude(**{"%s__isnull"%field_path:True})
@@ -625,15 +811,22 @@ class MultiSelectFieldListFilter(ListFieldFilter):
             # Do a subquery to order the distinct set
             queryset = self.view.queryset().filter(id__in=queryset).order_by(field_order_by)
 
-        if field_limit is not None and type(field_limit) == int and queryset.count() > field_limit:
-            queryset = queryset[:field_limit]
+        def build():
+            qs = queryset
+            if field_limit is not None and type(field_limit) == int and qs.count() > field_limit:
+                qs = qs[:field_limit]
+            return [str(it) for it in qs.values_list(field_path, flat=True) if str(it).strip() != ""]
 
-        self.lookup_choices = [str(it) for it in queryset.values_list(field_path, flat=True) if str(it).strip() != ""]
+        if self.cache_config['enabled']:
+            self.lookup_choices = self.cached_choices(build, scope=(queryset_scope(queryset), field_limit),
+                                                      timeout=self.cache_config['timeout'])
+        else:
+            self.lookup_choices = build()
         if sort_key is not None:
             self.lookup_choices = sorted(self.lookup_choices, key=sort_key)
 
-        if self.cache_config['enabled']:
-            self.set_cached_choices(self.lookup_choices)
+    def facet_path(self):
+        return self.field_path
 
     def choices(self):
         self.lookup_in_val = (type(self.lookup_in_val) in (tuple, list)) and self.lookup_in_val or list(
@@ -650,6 +843,7 @@ class MultiSelectFieldListFilter(ListFieldFilter):
                 'remove_query_string': self.query_string(
                     {self.lookup_in_name: ",".join([v for v in self.lookup_in_val if v != val]), }),
                 'display': val,
+                'count': self.facet_count(val),
             }
 
 
@@ -670,12 +864,11 @@ class AllValuesFieldListFilter(ListFieldFilter):
         limit_choices_to = get_limit_choices_to_from_path(model, field_path)
         queryset = queryset.filter(limit_choices_to)
 
-        self.lookup_choices = (queryset
-                               .distinct()
-                               .order_by(field.name)
-                               .values_list(field.name, flat=True))
         super(AllValuesFieldListFilter, self).__init__(
             field, request, params, model, view, field_path)
+        self.lookup_choices = self.cached_choices(
+            lambda: queryset.distinct().order_by(field.name).values_list(field.name, flat=True),
+            limit_choices_to=limit_choices_to, dependencies=[parent_model])
 
     def choices(self):
         yield {
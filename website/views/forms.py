@@ -1,3 +1,6 @@
+import hashlib
+import time
+
 import django.contrib
 from django import forms
 from django.contrib.auth import authenticate
@@ -9,14 +12,22 @@ from django.core.exceptions import PermissionDenied
 from django.db.models.base import ModelBase
 from django.forms import ModelChoiceField
 from django.http import QueryDict
+from django.middleware.csrf import get_token
 from django.template import RequestContext
 from django.test import RequestFactory
 from django.urls import reverse, NoReverseMatch
+from django.utils import translation
 from django.utils.http import urlencode
 from django.utils.translation import ugettext as _, ugettext_lazy, ugettext_lazy as _, gettext as _, ugettext
 from website.models import UserComponent, Viewmark
+from website.views import permissions
+from website.views.configs import DASHBOARD_WIDGET_CACHE_TIMEOUT
+from website.views.filters import choices_cache
 import website
 
+CSRF_TOKEN_PLACEHOLDER = 'WEBSITE_CSRF_TOKEN'
+WIDGET_ID_PLACEHOLDER = 'WEBSITE_WIDGET_ID'
+
 class AdminAuthenticationForm(AuthenticationForm):
     """
     A custom authentication form used in the website app.
@@ -84,6 +95,14 @@ class Component(forms.Form):
     widget_type = 'website'
 
     base_title = None
+    # 预先渲染的内容
+    html = None
+
+    # 缓存策略：缓存的秒数（0 时不缓存）；按 user（每个用户）、permissions（权限相同的用户共用）或 None（所有用户共用）
+    # 区分；内容依赖的模型，它们变动时缓存失效
+    cache_timeout = DASHBOARD_WIDGET_CACHE_TIMEOUT
+    cache_vary_on = 'user'
+    cache_models = ()
 
     # 表单字段
     id = forms.IntegerField(label=_('Widget ID'), widget=forms.HiddenInput)
@@ -97,6 +116,8 @@ class Component(forms.Form):
         self.request = dashboard.request
         self.user = dashboard.request.user
 
+        # convert 会取出部分数据，缓存键使用原始数据（不含 id，配置相同的区块共用缓存）
+        self.cache_data = repr(sorted((k, v) for k, v in data.items() if k != 'id'))
         self.convert(data)
         super(Component, self).__init__(data)
 
@@ -123,15 +144,90 @@ class Component(forms.Form):
     @property
     def widget(self):
         '''
-        关键方法：输出内容,类似render
+        关键方法：输出内容,类似render；仪表盘预先渲染（html）后直接返回
+        '''
+        if self.html is None:
+            self.html = self.render()
+        return self.html
+
+    def render(self, template=None, box_tpl=None, extra=None):
+        '''
+        渲染区块。template 为 None 时使用 self.template 并调用 context()，否则只渲染框架（如加载中、出错）；
+        box_tpl 为外框模板
+        '''
+        box_tpl = box_tpl or (
+            self.website.style_adminlte and 'website/includes/box_ext.tpl' or 'website/includes/box.tpl')
+        key = template is None and self.get_cache_key(box_tpl)
+        html = key and choices_cache.cache.get(key)
+        if not html:
+            context = {'widget_id': key and WIDGET_ID_PLACEHOLDER or self.id, 'widget_title': self.title,
+                       'widget_icon': self.widget_icon, 'widget_type': self.widget_type, 'form': self, 'widget': self}
+            if template is None:
+                self.context(context)
+            context.update(extra or {})
+            _context = RequestContext(self.request)
+            _context.update(context)
+            _context['box_tpl'] = box_tpl
+            data = self.data
+            if key:
+                # 缓存的内容不包含 csrf token 及区块 id（其他用户的区块也会用到），输出时替换
+                _context['csrf_token'] = CSRF_TOKEN_PLACEHOLDER
+                self.data = data.copy()
+                self.data['id'] = WIDGET_ID_PLACEHOLDER
+            try:
+                html = dutils.render_to_string(template or self.template, context_instance=_context)
+            finally:
+                self.data = data
+            if key:
+                choices_cache.cache.set(key, html, self.cache_timeout)
+        if key:
+            html = html.replace(CSRF_TOKEN_PLACEHOLDER, str(get_token(self.request))).replace(
+                WIDGET_ID_PLACEHOLDER, str(self.id))
+        return html
+
+    def get_cache_models(self):
+        '''
+        API方法：内容依赖的模型
         '''
-        context = {'widget_id': self.id, 'widget_title': self.title, 'widget_icon': self.widget_icon,
-                   'widget_type': self.widget_type, 'form': self, 'widget': self}
-        self.context(context)
-        _context = RequestContext(self.request)
-        _context.update(context)
-        _context['box_tpl'] = self.website.style_adminlte and 'website/includes/box_ext.tpl' or 'website/includes/box.tpl'
-        return dutils.render_to_string(self.template, context_instance=_context)
+        return list(self.cache_models)
+
+    def get_cache_vary(self):
+        if self.cache_vary_on == 'user':
+            return self.user.pk
+        elif self.cache_vary_on == 'permissions':
+            return self.user.is_superuser, sorted(self.user.get_all_permissions())
+        return None
+
+    def get_cache_generation_key(self):
+        '''
+        按区块类型及配置生成，按用户区分时才包含区块 id，权限相同（或所有）的用户配置相同的区块共用缓存
+        '''
+        widget_id = self.id if self.cache_vary_on == 'user' else None
+        parts = (self.widget_type, widget_id, self.cache_data, self.get_cache_vary(), self.dashboard.widget_customiz,
+                 translation.get_language())
+        return 'website:widgetgen:%s' % hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+    def get_cache_key(self, box_tpl):
+        '''
+        渲染结果的缓存键，不缓存时为 None。键中包含依赖模型的版本号及区块的刷新次数
+        '''
+        if not self.cache_timeout or not choices_cache.alias:
+            return None
+        models = self.get_cache_models()
+        for m in models:
+            choices_cache.watch(m)
+        generation_key = self.get_cache_generation_key()
+        parts = (box_tpl, choices_cache.cache.get(generation_key),
+                 [(m._meta.label_lower, choices_cache.get_version(m)) for m in models])
+        return '%s:%s' % (generation_key.replace('widgetgen', 'widget'),
+                          hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+    def refresh_cache(self):
+        '''
+        使该区块的缓存失效（仪表盘中的“刷新”）
+        '''
+        if self.cache_timeout and choices_cache.alias:
+            choices_cache.cache.set(self.get_cache_generation_key(), time.time(), None)
 
     def context(self, context):
         '''
@@ -217,6 +313,8 @@ class QuickBtnComponent(Component):
     template = "website/components/qbutton.tpl"
     base_title = _("Quick Buttons")
     widget_icon = 'fa fa-caret-square-o-right'
+    # 按钮按模型的 view 权限显示
+    cache_vary_on = 'permissions'
 
     def convert(self, data):
         self.q_btns = data.pop('btns', [])
@@ -233,7 +331,8 @@ class QuickBtnComponent(Component):
             btn = {}
             if 'model' in b:
                 model = self.get_model(b['model'])
-                if not self.user.has_perm("%s.view_%s" % (model._meta.app_label, model._meta.model_name)):
+                if not permissions.get_snapshot(self.request).has_perm(
+                        "%s.view_%s" % (model._meta.app_label, model._meta.model_name)):
                     continue
                 btn['url'] = reverse("%s:%s_%s_%s" % (self.website.namespace, model._meta.app_label,
                                                       model._meta.model_name, b.get('view', 'changelist')))
@@ -282,6 +381,9 @@ class ModelFormComponent(Component):
     def has_perm(self):
         return self.dashboard.has_model_perm(self.model, self.model_perm)
 
+    def get_cache_models(self):
+        return super(ModelFormComponent, self).get_cache_models() + [self.model]
+
     def filte_choices_model(self, model, modeladmin):
         '''
         过滤出有权限的模型
@@ -339,6 +441,8 @@ class AddFormWidget(ModelFormComponent, PartialComponent):
     template = "website/components/addform.tpl"
     model_perm = 'add'
     widget_icon = 'fa fa-plus'
+    # 表单不缓存
+    cache_timeout = 0
 
     def setup(self):
         from website.views.views import CreateViewTemplate
@@ -442,6 +546,9 @@ class ViewmarkWidget(PartialComponent):
     def has_perm(self):
         return True
 
+    def get_cache_models(self):
+        return super(ViewmarkWidget, self).get_cache_models() + [self.list_view.model, Viewmark]
+
     def context(self, context):
         list_view = self.list_view
         list_view.make_result_list()
@@ -0,0 +1,121 @@
+"""
+后台导出任务
+
+列表页提交后台导出时 ExportPlugin 只记录一条 ExportJob（模型、列表地址、过滤参数、导出列、格式），
+任务由执行器在请求之外完成：重新构造列表页的导出请求，将输出写入临时文件后保存到 default_storage。
+
+执行器由 ``BASE_EXPORT_EXECUTOR`` 配置：
+
+* thread: 进程内线程池（默认，无需外部服务）
+* db: 任务只写入数据库，由 ``manage.py exportworker`` 领取执行
+* sync: 在提交任务的请求内直接执行，用于测试和调试
+"""
+import logging
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve
+from django.utils import timezone
+
+from website.models import ExportJob
+from website.views.configs import EXPORT_EXECUTOR, EXPORT_WORKERS, EXPORT_DIR
+
+logger = logging.getLogger('website')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ExportJobError(Exception):
+    pass
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS)
+    return _executor
+
+
+def submit(job, executor=None):
+    """
+    提交导出任务, 在事务提交后才交给执行器, 保证执行器能读到任务记录
+    """
+    executor = executor or EXPORT_EXECUTOR
+    if executor == 'sync':
+        run_job(job.pk)
+    elif executor == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(run_thread_job, job.pk))
+    return job
+
+
+def claim_job(job_id):
+    """
+    领取任务: 只有状态仍为 pending 的任务才能被领取, 避免多个 worker 重复执行
+    """
+    return ExportJob.objects.filter(pk=job_id, status='pending').update(status='running') == 1
+
+
+def make_request(job):
+    """
+    根据任务记录重新构造列表页的导出请求
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = job.path
+    request.GET = QueryDict(job.query)
+    request.META.update({'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'QUERY_STRING': job.query})
+    request.user = job.user
+    request.export_job = job
+    return request
+
+
+def run_job(job_id):
+    if not claim_job(job_id):
+        return
+    job = ExportJob.objects.select_related('user').get(pk=job_id)
+    try:
+        match = resolve(job.path)
+        response = match.func(make_request(job), *match.args, **match.kwargs)
+        if response.status_code != 200 or not response.has_header('Content-Disposition'):
+            raise ExportJobError('导出请求返回了 %s' % response.status_code)
+        with tempfile.TemporaryFile() as f:
+            for chunk in (response.streaming_content if response.streaming else [response.content]):
+                f.write(chunk)
+            f.seek(0)
+            name = '%s/%s/%s.%s' % (EXPORT_DIR, job.pk, job.content_type.model, job.export_type)
+            job.file = default_storage.save(name, File(f))
+        job.status = 'done'
+    except Exception:
+        logger.exception('export job %s failed', job_id)
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+    job.finished = timezone.now()
+    # rows 由导出过程单独更新, 这里不覆盖
+    job.save(update_fields=['status', 'file', 'error', 'finished'])
+    return job
+
+
+def run_thread_job(job_id):
+    try:
+        return run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def run_pending(limit=None):
+    """
+    依次执行等待中的任务, 返回执行的任务数
+    """
+    count = 0
+    for job_id in ExportJob.objects.filter(status='pending').order_by('pk').values_list('pk', flat=True)[:limit]:
+        if run_job(job_id):
+            count += 1
+    return count
@@ -0,0 +1,185 @@
+"""
+导航菜单的编译
+
+菜单按权限过滤、组装成树后的结果只取决于用户的权限，按 ``(权限指纹, is_superuser, 函数型权限的结果)`` 编译一次，
+保存在进程内的 LRU（``BASE_NAV_MENU_CACHE_SIZE`` 项）和共享缓存（``BASE_NAV_MENU_TIMEOUT`` 秒）中，每个请求只复制
+一份并标记选中的菜单项。
+
+用户的权限指纹以 ``website:navmenu:perms:<版本号>:<用户 id>`` 缓存，省去每个请求读取权限的查询：用户保存时删除该
+用户的指纹，用户权限、用户组、组权限变动及权限、组删除时版本号加一，所有用户的指纹重新计算。
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from website.views import permissions
+from website.views.configs import NAV_MENU_CACHE_SIZE, NAV_MENU_TIMEOUT
+from website.views.rowcache import permission_fingerprint
+
+GENERATION_KEY = 'website:navmenu:gen'
+
+_compiled = OrderedDict()  # 进程内编译好的菜单 {键: 菜单}，按最近使用排序
+_compiled_lock = threading.Lock()
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, int(time.time() * 1000))
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump(**kwargs):
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        pass
+
+
+def perms_key(user_id):
+    return 'website:navmenu:perms:%s:%s' % (get_generation(), user_id)
+
+
+def user_fingerprint(user):
+    """
+    用户权限的指纹，匿名用户不缓存
+    """
+    if user.pk is None:
+        return permission_fingerprint(user)
+    key = perms_key(user.pk)
+    fingerprint = cache.get(key)
+    if fingerprint is None:
+        permissions.prefetch(user)
+        fingerprint = permission_fingerprint(user)
+        cache.set(key, fingerprint, NAV_MENU_TIMEOUT)
+    return fingerprint
+
+
+def levels(menutree):
+    """
+    菜单树的各层，``WebSite.get_select_menu`` 会在树中留下以模块名为键的空节点，跳过
+    """
+    return [menutree[i] for i in sorted(k for k in menutree if isinstance(k, int))]
+
+
+def node_branches(node):
+    branch = node['branch']
+    return branch if isinstance(branch, list) else []
+
+
+def menu_nodes(menutree):
+    """
+    菜单树中所有直接包含菜单项的节点
+    """
+    for level in levels(menutree):
+        yield level
+        for b in node_branches(level):
+            yield b
+
+
+def _signature_default(o):
+    if callable(o):
+        return '%s.%s' % (o.__module__, getattr(o, '__qualname__', o.__class__.__name__))
+    return str(o)
+
+
+def menu_info(website):
+    """
+    菜单定义的摘要及其中函数型的权限，进程内只计算一次
+
+    摘要使菜单定义改变（如重新部署）后不会取到共享缓存中旧的菜单；函数型权限的结果取决于用户本身而不只是权限，
+    每个请求计算
+    """
+    info = getattr(website, '_nav_menu_info', None)
+    if info is None:
+        menutree = website.menus
+        signature = hashlib.md5(json.dumps(levels(menutree), default=_signature_default).encode('utf-8'))
+        perms = [l['perm'] for node in menu_nodes(menutree) for l in node['leaf'] if callable(l.get('perm'))]
+        info = website._nav_menu_info = (signature.hexdigest(), perms)
+    return info
+
+
+def build(view):
+    """
+    按 view 的用户权限过滤菜单并组装成树，去掉没有菜单项的分组
+    """
+    menutree = copy.deepcopy(view.website.menus)
+
+    for node in menu_nodes(menutree):
+        node['leaf'] = [l for l in node['leaf'] if view._check_menu_permission(l)]
+        for l in node['leaf']:
+            l.pop('perm', None)
+
+    nav_menu = {'data': {}, 'branch': [], 'leaf': []}
+    nav_menu['branch'] = menutree[0]['branch']
+    nav_menu['leaf'] = menutree[0]['leaf']
+
+    def deep(i, nav_menu):
+        for l in node_branches(menutree[i]):
+            for r in nav_menu['branch']:
+                if l['up'] == r['data']['title']:
+                    if type(r['branch']) != list:
+                        r['branch'] = []
+                    r['branch'].append(l)
+            i += 1
+            deep(i, nav_menu['branch'])
+
+    deep(1, nav_menu)
+
+    def prune(node):
+        node['branch'] = [b for b in node_branches(node) if prune(b)]
+        return node['leaf'] or node['branch']
+
+    prune(nav_menu)
+    return nav_menu
+
+
+def get_nav_menu(view):
+    """
+    view 的用户可见的菜单，返回的是副本，可以直接标记选中的菜单项
+    """
+    website = view.website
+    user = view.user
+    signature, perms = menu_info(website)
+    parts = (website.namespace, signature, user_fingerprint(user), user.is_superuser,
+             tuple(bool(perm(user)) for perm in perms))
+    key = 'website:navmenu:%s' % hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    with _compiled_lock:
+        nav_menu = _compiled.get(key)
+        if nav_menu is not None:
+            _compiled.move_to_end(key)
+    if nav_menu is None:
+        nav_menu = cache.get(key)
+        if nav_menu is None:
+            nav_menu = build(view)
+            cache.set(key, nav_menu, NAV_MENU_TIMEOUT)
+        with _compiled_lock:
+            _compiled[key] = nav_menu
+            while len(_compiled) > NAV_MENU_CACHE_SIZE:
+                _compiled.popitem(last=False)
+    return copy.deepcopy(nav_menu)
+
+
+def _user_saved(sender, instance, **kwargs):
+    cache.delete(perms_key(instance.pk))
+
+
+_User = get_user_model()
+post_save.connect(_user_saved, sender=_User, dispatch_uid='website.navmenu')
+post_delete.connect(_user_saved, sender=_User, dispatch_uid='website.navmenu')
+for _field in ('user_permissions', 'groups'):
+    # 自定义的用户模型可能没有这些字段
+    if hasattr(_User, _field):
+        m2m_changed.connect(bump, sender=getattr(_User, _field).through, dispatch_uid='website.navmenu')
+m2m_changed.connect(bump, sender=Group.permissions.through, dispatch_uid='website.navmenu')
+post_delete.connect(bump, sender=Group, dispatch_uid='website.navmenu')
+post_delete.connect(bump, sender=Permission, dispatch_uid='website.navmenu')
@@ -0,0 +1,59 @@
+"""
+请求内的权限快照
+
+:func:`get_snapshot` 返回请求用户的 :class:`PermissionSnapshot`，同一请求内只创建一次，视图、插件中的权限判断
+（``ViewUtilMixin.user_has_perm``、``has_model_perm``、菜单过滤等）都从它读取，每个权限只向认证后端询问一次。
+
+使用 Django 自带的 ``ModelBackend`` 时，创建快照时用一个查询取出用户本身及所在组的全部权限，填入
+``ModelBackend`` 的权限缓存，替代它分别查询用户权限和组权限的两个查询。
+"""
+from django.contrib.auth import get_backends
+from django.contrib.auth.backends import ModelBackend, AllowAllUsersModelBackend
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+
+REQUEST_ATTR = '_website_permissions'
+
+
+def prefetch(user):
+    """
+    一次查询取出用户的全部权限，作为 ``ModelBackend`` 的权限缓存；超级用户、未启用的用户不需要
+    """
+    if not user.is_active or user.is_anonymous or user.is_superuser or hasattr(user, '_perm_cache'):
+        return
+    if not any(type(backend) in (ModelBackend, AllowAllUsersModelBackend) for backend in get_backends()):
+        return
+    perms = Permission.objects.filter(Q(user=user) | Q(group__user=user)) \
+        .values_list('content_type__app_label', 'codename').distinct()
+    user._perm_cache = {'%s.%s' % (ct, name) for ct, name in perms}
+
+
+class PermissionSnapshot(object):
+    """
+    某用户的权限判断结果 {权限: 是否有权限}
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._results = {}
+        prefetch(user)
+
+    def has_perm(self, perm):
+        result = self._results.get(perm)
+        if result is None:
+            result = self._results[perm] = self.user.has_perm(perm)
+        return result
+
+    def has_any_perm(self, perms):
+        return any(self.has_perm(perm) for perm in perms)
+
+
+def get_snapshot(request):
+    """
+    请求用户的权限快照，同一请求内共用
+    """
+    snapshot = getattr(request, REQUEST_ATTR, None)
+    if snapshot is None or snapshot.user is not request.user:
+        snapshot = PermissionSnapshot(request.user)
+        setattr(request, REQUEST_ATTR, snapshot)
+    return snapshot
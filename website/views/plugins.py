@@ -4,32 +4,36 @@ import io
 import json
 import operator
 import re
+import tempfile
 import urllib.parse
+from decimal import Decimal
 from functools import reduce
 
 import django.contrib
 from django import forms
 from django.contrib.contenttypes.models import ContentType
 from crispy_forms.layout import Field, Column, Layout
-from website.models import Viewmark, UserSetting
+from website.models import Viewmark, UserSetting, ExportJob
 from website.tools import dutils
 from website.tools.dutils import render_to_string, JsonErrorDict, RelatedObject
 from website.tools.storage import get_storage
 from website.tools.types import SortedDict
 from website.views.configs import ACTION_CHECKBOX_NAME, COL_LIST_VAR, ORDER_VAR, SEARCH_VAR, FILTER_PREFIX, \
-    RELATE_PREFIX, ALL_VAR, EXPORT_MAX
+    RELATE_PREFIX, ALL_VAR, EXPORT_MAX, EXPORT_EXECUTOR, RESULT_CACHE_TIMEOUT
 from website.views.fields import AdminImageField, InlineShowField, Inline, InlineFormset, \
     ModelTreeChoiceField, ModelTreeChoiceFieldFK, ModelTreeChoiceFieldFKLeaf, Fieldset
 from website.views.fieldsets import Container
 from website.views.filters import manager as filter_manager, DateFieldListFilter, DateBaseFilter, \
-    RelatedFieldSearchFilter, QuickFilterMultiSelectFieldListFilter
+    RelatedFieldSearchFilter, QuickFilterMultiSelectFieldListFilter, choices_cache
 from website.views.utils import model_format_dict, display_for_field, label_for_field, get_fields_from_path, \
-    lookup_needs_distinct, get_model_from_relation
+    lookup_needs_distinct, get_model_from_relation, NotRelationField, semijoin
 from website.views.views import ViewUtilMixin, ListViewTemplate, ActionViewTemplate, \
     BatchDeletionViewTemplate, \
     ModelFormViewTemplate, GenericInlineModelView, InlineFormViewTemplate, DetailView, DetailViewMixin, StepsHelper, \
     ListRow, \
     ListCell
+from website.views import jobs, search, usersettings
+from website.views.facets import FacetCounter
 from website.views.forms import ManagementForm
 from website.views.widgets import RelatedFieldWidgetWrapper, ImageWidget
 from django.conf import settings
@@ -37,15 +41,19 @@ from django.core.cache import cache
 from django.core.exceptions import FieldDoesNotExist, SuspiciousOperation, ValidationError, ImproperlyConfigured
 from django.db import models
 from django.db.models import Min, Max, Avg, Sum, Count, Q, BooleanField, NullBooleanField, ManyToManyField, TextField, \
-    ForeignKey
+    ForeignKey, DateTimeField, DateField, TimeField, IntegerField, FloatField, DecimalField, prefetch_related_objects, \
+    OuterRef, Subquery
 from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Coalesce
 from django.forms import all_valid, modelform_factory, Media
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse, FileResponse
 from django.template import RequestContext, loader
 from django.templatetags.static import static
 from django.urls import reverse, NoReverseMatch
+from django.utils import timezone
 from django.utils.encoding import force_str, smart_str
-from django.utils.html import escape
+from django.utils.html import escape, format_html
+from django.utils.http import RFC3986_SUBDELIMS
 from django.utils.text import capfirst
 from django.utils.translation import ungettext, ugettext as _, ugettext_lazy as _
 from django.utils.safestring import mark_safe
@@ -75,6 +83,8 @@ QUERY_TERMS = {
 }
 # <editor-fold desc="多选插件">
 checkbox_form_field = forms.CheckboxInput({'class': 'action-select'}, lambda value: False)
+# 与 checkbox_form_field.render 的输出相同，每行都要渲染，不经过模板引擎
+checkbox_html = '<input type="checkbox" name="%s" value="{}" class="action-select">' % ACTION_CHECKBOX_NAME
 
 
 def action_checkbox(obj):
@@ -82,7 +92,7 @@ def action_checkbox(obj):
         _pk = obj['_pk']
     else:
         _pk = obj.pk
-    return checkbox_form_field.render(ACTION_CHECKBOX_NAME, force_str(_pk))
+    return format_html(checkbox_html, force_str(_pk))
 
 
 action_checkbox.verbose_name = mark_safe(
@@ -90,6 +100,7 @@ action_checkbox.verbose_name = mark_safe(
 action_checkbox.allow_tags = True
 action_checkbox.allow_export = False
 action_checkbox.is_column = False
+action_checkbox.only = ()  # 只用到主键
 
 
 class ActionPlugin(ViewPlugin):
@@ -146,14 +157,23 @@ class ActionPlugin(ViewPlugin):
                 choices.append((ac_url + '?', ac.verbose_name, ac.icon))
         return choices
 
+    def _has_results(self):
+        # keyset 分页时 result_count 为 None
+        av = self.view
+        return bool(av.result_count) if av.result_count is not None else bool(av.result_list)
+
     def get_context(self, context):
-        if self.view.result_count:
+        if self._has_results():
             av = self.view
-            selection_note_all = ungettext('%(total_count)s selected', 'All %(total_count)s selected', av.result_count)
+            if av.result_count is None:
+                selection_note_all = _('All selected')
+            else:
+                selection_note_all = ungettext('%(total_count)s selected', 'All %(total_count)s selected',
+                                               av.result_count) % {'total_count': av.result_count}
             m_action_choices = self._get_action_choices()
             new_context = {
                 'selection_note': _('0 of %(cnt)s selected') % {'cnt': len(av.result_list)},
-                'selection_note_all': selection_note_all % {'total_count': av.result_count},
+                'selection_note_all': selection_note_all,
                 'action_choices': m_action_choices[:3],
                 'action_choices_more': len(m_action_choices) > 3 and m_action_choices[3:] or [],
             }
@@ -206,7 +226,7 @@ class ActionPlugin(ViewPlugin):
         '''获取所有action'''
         if not self.view.opts:
             actions = self.actions or self.view.form_actions
-            return [ac for ac in actions if not ac.perm or (ac.perm and self.user.has_perm('auth.' + ac.perm))]
+            return [ac for ac in actions if not ac.perm or (ac.perm and self.user_has_perm('auth.' + ac.perm))]
 
         if self.actions is None:
             return SortedDict()
@@ -260,18 +280,18 @@ class ActionPlugin(ViewPlugin):
             item.classes.append("action-checkbox-column")
         return item
 
-    def makecell(self, item, obj, field_name, row):
-        if item.field is None and field_name == 'action_checkbox':
-            item.classes.append("action-checkbox")
-        return item
+    def makecolumn(self, column, field_name):
+        if column.field is None and field_name == 'action_checkbox':
+            column.classes.append("action-checkbox")
+        return column
 
     def get_media(self, media):
-        if self.view.result_count:
+        if self._has_results():
             media = media + self.vendor('website.plugin.actions.js', 'website.plugins.css')
         return media
 
     def block_results_bottom(self, context, nodes):
-        if self.view.result_count:
+        if self._has_results():
             _tpl = 'website/blocks/grid.results_bottom.actions.tpl' if self.view.grid else 'website/blocks/form.results_bottom.actions.tpl'
             nodes.append(render_to_string(_tpl, context_instance=context))
 
@@ -289,6 +309,7 @@ AGGREGATE_TITLE = {
 
 class AggregationPlugin(ViewPlugin):
     aggregate_fields = {}
+    result_cache_timeout = RESULT_CACHE_TIMEOUT
 
     def init_request(self, *args, **kwargs):
         return bool(self.aggregate_fields)
@@ -315,10 +336,23 @@ class AggregationPlugin(ViewPlugin):
 
         return item
 
+    def get_aggregates(self):
+        return dict((agg.default_alias, agg) for agg in [AGGREGATE_METHODS[method](field_name) for field_name, method
+                                                          in self.aggregate_fields.items() if method in AGGREGATE_METHODS])
+
+    def get_result_totals(self, totals):
+        totals.update(self.get_aggregates())
+        return totals
+
     def _get_aggregate_row(self):
-        queryset = self.view.list_queryset._clone()
-        obj = queryset.aggregate(*[AGGREGATE_METHODS[method](field_name) for field_name, method in
-                                   list(self.aggregate_fields.items()) if method in AGGREGATE_METHODS])
+        obj = self.view.result_totals
+        if obj is None:
+            # 估算总数、keyset 分页时没有与总数一起计算
+            queryset = self.view.list_queryset._clone()
+            aggregates = self.get_aggregates()
+            obj = choices_cache.get_result(self.model, 'aggregate:%r' % sorted(aggregates.items()),
+                                           lambda: queryset.aggregate(**aggregates), queryset,
+                                           self.result_cache_timeout)
 
         row = ListRow()
         row['is_display_first'] = False
@@ -357,18 +391,65 @@ class AjaxListPlugin(AjaxPlugin):
             return list_fields
         return list_display
 
+    def get_values_fields(self, fields):
+        """
+        返回的列都是模型的具体字段或外键路径（如 author__name）时，返回 {列: 模型字段}，否则返回 None
+
+        外键字段本身显示为关联对象的字符串，需要模型实例，只有使用 attname（如 author_id）时可以 values()
+        """
+        values_fields = SortedDict()
+        for name in fields:
+            try:
+                path = get_fields_from_path(self.model, name)
+            except (FieldDoesNotExist, NotRelationField, AttributeError):
+                return None
+            field = path[-1]
+            if any(f.many_to_many or f.one_to_many for f in path) or not getattr(field, 'concrete', False):
+                return None
+            if field.is_relation and name.split(LOOKUP_SEP)[-1] != field.attname:
+                return None
+            values_fields[name] = field
+        return values_fields
+
+    def get_values_result(self, fields):
+        """
+        直接以 values_list() 取得当前页的数据，不生成模型实例及 ListRow、ListCell。返回 (headers, objects)，
+        不满足条件时返回 None：keyset 分页时当前页已经取出，插件处理行、单元格时需要按原方式生成
+        """
+        av = self.view
+        result_list = av.result_list
+        if not isinstance(result_list, models.QuerySet) or result_list._result_cache is not None \
+                or any(av.has_pluginhook(name) for name in ('results', 'makerow', 'makecell')):
+            return None
+        values_fields = self.get_values_fields(fields)
+        if values_fields is None:
+            return None
+        names = list(values_fields)
+        headers = dict([(name, force_str(field.verbose_name)) for name, field in values_fields.items()])
+        objects = [dict([(name, escape(str(value))) for name, value in zip(names, row)])
+                   for row in result_list.prefetch_related(None).values_list(*names)]
+        return headers, objects
+
     def get_result_list(self, response):
         av = self.view
         base_fields = self.get_list_display(av.base_list_display)
-        headers = dict([(c.field_name, force_str(c.text)) for c in av.makeheaders(
-        ).cells if c.field_name in base_fields])
+        # 与 ListRow 中单元格的顺序相同
+        result = self.get_values_result([f for f in av.list_display if f in base_fields])
+        if result is not None:
+            headers, objects = result
+        else:
+            headers = dict([(c.field_name, force_str(c.text)) for c in av.makeheaders(
+            ).cells if c.field_name in base_fields])
 
-        objects = [dict([(o.field_name, escape(str(o.value))) for i, o in
-                         enumerate([c for c in r.cells if c.field_name in base_fields])])
-                   for r in av.results()]
+            objects = [dict([(o.field_name, escape(str(o.value))) for i, o in
+                             enumerate([c for c in r.cells if c.field_name in base_fields])])
+                       for r in av.results()]
 
-        return self.render_response(
-            {'headers': headers, 'objects': objects, 'total_count': av.result_count, 'has_more': av.has_more})
+        result = {'headers': headers, 'objects': objects, 'total_count': av.result_count, 'has_more': av.has_more}
+        if av.keyset_columns:
+            # keyset 分页时返回下一页游标，供无限滚动使用
+            result['cursor'] = av.next_cursor
+        return self.render_response(result)
 
 
 class AjaxFormPlugin(AjaxPlugin):
@@ -602,8 +683,8 @@ class ViewmarkPlugin(ViewPlugin):
             'bk_has_selected': has_selected,
             'bk_list_base_url': list_base_url,
             'bk_post_url': post_url,
-            'has_add_permission_viewmark': self.view.request.user.has_perm('website.add_viewmark'),
-            'has_change_permission_viewmark': self.view.request.user.has_perm('website.change_viewmark')
+            'has_add_permission_viewmark': self.user_has_perm('website.add_viewmark'),
+            'has_change_permission_viewmark': self.user_has_perm('website.change_viewmark')
         }
         context.update(new_context)
         return context
@@ -657,6 +738,22 @@ class ViewmarkPlugin(ViewPlugin):
 
     ``order`` : 排序信息, 如果不写则使用数据列表的排序
 
+    ``aggregate`` : 设置后由数据库在过滤后的全部数据上按 x 列分组计算, 不再只取列表的当前页. 值为 ``sum``、``avg``、
+    ``count``、``max``、``min`` 之一, 或 ``{y 列: 聚合方式}``
+
+    ``bucket`` : 配置了 ``aggregate`` 且 x 列为日期、时间时的分组粒度 ``hour``、``day``、``week``、``month``、``year``,
+    默认 ``auto`` 根据数据的时间跨度选择, None 时不截断
+
+    ``points`` : 每个序列最多的点数, 超过时用 LTTB 抽样, 默认为 ``BASE_CHART_MAX_POINTS``
+
+    ``cache`` : 配置了 ``aggregate`` 时结果缓存的秒数, 默认为 ``result_cache_timeout``, 0 时不缓存
+
+使用数据库聚合的示例::
+
+    data_charts = {
+        "sales": {'title': u"Sales", "x-field": "created", "y-field": ("amount",), "aggregate": "sum"},
+    }
+
 版本
 ----
 
@@ -729,46 +826,50 @@ class DetailsPlugin(ViewPlugin):
     show_detail_fields = []
     show_all_rel_details = True
 
-    def makecell(self, item, obj, field_name, row):
-        if (self.show_all_rel_details or (field_name in self.show_detail_fields)):
-
-            rel_obj = None
-            if isinstance(item.field, models.ForeignKey):
-                rel_obj = getattr(obj, field_name)
-            elif field_name in self.show_detail_fields:
-                rel_obj = obj
-            if rel_obj:
-                if rel_obj.__class__ in self.website.modelconfigs:
-                    try:
-                        model_admin = self.website.modelconfigs[rel_obj.__class__]
-                        has_view_perm = model_admin(self.view.request).has_view_permission(rel_obj)
-                        has_change_perm = model_admin(self.view.request).has_change_permission(rel_obj)
-                    except:
-                        has_view_perm = self.view.has_model_perm(rel_obj.__class__, 'view')
-                        has_change_perm = self.has_model_perm(rel_obj.__class__, 'change')
-                else:
+    def makecolumn(self, column, field_name):
+        if (self.show_all_rel_details and isinstance(column.field, models.ForeignKey)) \
+                or field_name in self.show_detail_fields:
+            column.transforms.append(self.detail_cell)
+        return column
+
+    def detail_cell(self, item, obj, row):
+        rel_obj = None
+        if isinstance(item.field, models.ForeignKey):
+            rel_obj = getattr(obj, item.field_name)
+        elif item.field_name in self.show_detail_fields:
+            rel_obj = obj
+        if rel_obj:
+            if rel_obj.__class__ in self.website.modelconfigs:
+                try:
+                    model_admin = self.website.modelconfigs[rel_obj.__class__]
+                    has_view_perm = model_admin(self.view.request).has_view_permission(rel_obj)
+                    has_change_perm = model_admin(self.view.request).has_change_permission(rel_obj)
+                except:
                     has_view_perm = self.view.has_model_perm(rel_obj.__class__, 'view')
                     has_change_perm = self.has_model_perm(rel_obj.__class__, 'change')
+            else:
+                has_view_perm = self.view.has_model_perm(rel_obj.__class__, 'view')
+                has_change_perm = self.has_model_perm(rel_obj.__class__, 'change')
 
-            if rel_obj and has_view_perm:
-                opts = rel_obj._meta
-                try:
-                    item_res_uri = reverse(
-                        '%s:%s_%s_detail' % (self.website.module_name,
-                                             opts.app_label, opts.model_name),
-                        args=(getattr(rel_obj, opts.pk.attname),))
-                    if item_res_uri:
-                        if has_change_perm:
-                            edit_url = reverse(
-                                '%s:%s_%s_change' % (self.website.module_name, opts.app_label, opts.model_name),
-                                args=(getattr(rel_obj, opts.pk.attname),))
-                        else:
-                            edit_url = ''
-                        item.btns.append(
-                            '<a data-res-uri="%s" data-edit-uri="%s" class="details-handler" rel="tooltip" title="%s"><i class="fa fa-info-circle"></i></a>'
-                            % (item_res_uri, edit_url, _('Details of %s') % escape(escape(str(rel_obj)))))
-                except NoReverseMatch:
-                    pass
+        if rel_obj and has_view_perm:
+            opts = rel_obj._meta
+            try:
+                item_res_uri = reverse(
+                    '%s:%s_%s_detail' % (self.website.module_name,
+                                         opts.app_label, opts.model_name),
+                    args=(getattr(rel_obj, opts.pk.attname),))
+                if item_res_uri:
+                    if has_change_perm:
+                        edit_url = reverse(
+                            '%s:%s_%s_change' % (self.website.module_name, opts.app_label, opts.model_name),
+                            args=(getattr(rel_obj, opts.pk.attname),))
+                    else:
+                        edit_url = ''
+                    item.btns.append(
+                        '<a data-res-uri="%s" data-edit-uri="%s" class="details-handler" rel="tooltip" title="%s"><i class="fa fa-info-circle"></i></a>'
+                        % (item_res_uri, edit_url, _('Details of %s') % escape(escape(str(rel_obj)))))
+            except NoReverseMatch:
+                pass
         return item
 
     # Media
@@ -818,24 +919,27 @@ class EditablePlugin(ViewPlugin):
             self.model_form = self.getmodelviewclass(ModelFormViewTemplate, self.model).form_obj
         return active
 
-    def makecell(self, item, obj, field_name, row):
-        if self.list_editable and item.field and item.field.editable and (field_name in self.list_editable):
-            pk = getattr(obj, obj._meta.pk.attname)
-            field_label = label_for_field(field_name, obj,
+    def makecolumn(self, column, field_name):
+        if self.list_editable and column.field and column.field.editable and (field_name in self.list_editable):
+            field_label = label_for_field(field_name, self.model,
                                           model_admin=self.view,
                                           return_attr=False
                                           )
-
-            item.wraps.insert(0, '<span class="editable-field">%s</span>')
-            item.btns.append((
-                                     '<a class="editable-handler" title="%s" data-editable-field="%s" data-editable-loadurl="%s">' +
-                                     '<i class="fa fa-edit"></i></a>') %
-                             (_("Enter %s") % field_label, field_name,
-                              self.view.model_admin_url('patch', pk) + '?fields=' + field_name))
-
-            if field_name not in self.editable_need_fields:
-                self.editable_need_fields[field_name] = item.field
-        return item
+            title = _("Enter %s") % field_label
+            self.editable_need_fields[field_name] = column.field
+
+            def editable_cell(item, obj, row):
+                if item.field:
+                    pk = getattr(obj, obj._meta.pk.attname)
+                    item.wraps.insert(0, '<span class="editable-field">%s</span>')
+                    item.btns.append((
+                                             '<a class="editable-handler" title="%s" data-editable-field="%s" data-editable-loadurl="%s">' +
+                                             '<i class="fa fa-edit"></i></a>') %
+                                     (title, field_name,
+                                      self.view.model_admin_url('patch', pk) + '?fields=' + field_name))
+
+            column.transforms.append(editable_cell)
+        return column
 
     # Media
     def get_media(self, media):
@@ -851,9 +955,10 @@ class EditablePlugin(ViewPlugin):
 # <editor-fold desc="导出插件">
 """
 数据导出
-默认情况下, xadmin 会提供 Excel, CSV, XML, json 四种格式的数据导出.
-可以通过设置 list_export 属性来指定使用哪些导出格式 (四种各使用分别用 ``xls``, ``csv``, ``xml``, ``json`` 表示)
+默认情况下, xadmin 会提供 Excel, CSV, XML, json, ndjson 五种格式的数据导出.
+可以通过设置 list_export 属性来指定使用哪些导出格式 (分别用 ``xls``, ``csv``, ``xml``, ``json``, ``ndjson`` 表示)
 将 list_export 设置为 None 来禁用数据导出功能.
+csv, json, ndjson 导出全部数据时使用 StreamingHttpResponse 按块读取 queryset 边读边写, 内存占用与数据量无关.
 """
 try:
     import xlwt
@@ -871,21 +976,28 @@ except:
 
 
 class ExportMenuPlugin(ViewPlugin):
-    list_export = ('xlsx', 'xls', 'csv', 'xml', 'json')
+    list_export = ('xlsx', 'xls', 'csv', 'xml', 'json', 'ndjson')
     export_names = {'xlsx': 'Excel 2007', 'xls': 'Excel', 'csv': 'CSV',
-                    'xml': 'XML', 'json': 'JSON'}
+                    'xml': 'XML', 'json': 'JSON', 'ndjson': 'NDJSON'}
+    export_async = True  # 是否提供后台导出
 
     def init_request(self, *args, **kwargs):
         self.list_export = [
             f for f in self.list_export
             if (f != 'xlsx' or has_xlsxwriter) and (f != 'xls' or has_xlwt)]
 
+    def get_media(self, media):
+        if self.list_export and self.export_async:
+            media = media + self.vendor('website.plugin.export.js')
+        return media
+
     def block_top_toolbar(self, context, nodes):
         if self.list_export:
             context.update({
-                'show_export_all': self.view.paginator.count > self.view.list_per_page and not ALL_VAR in self.view.request.GET,
+                'show_export_all': self.view.multi_page and not ALL_VAR in self.view.request.GET,
                 'form_params': self.view.get_form_params({'_do_': 'export'}, ('export_type',)),
                 'export_types': [{'type': et, 'name': self.export_names[et]} for et in self.list_export],
+                'export_async': self.export_async,
             })
             nodes.append(
                 render_to_string('website/blocks/model_list.top_toolbar.exports.tpl', context_instance=context))
@@ -894,7 +1006,14 @@ class ExportMenuPlugin(ViewPlugin):
 class ExportPlugin(ViewPlugin):
     export_mimes = {'xlsx': 'application/vnd.ms-excel',
                     'xls': 'application/vnd.ms-excel', 'csv': 'text/csv',
-                    'xml': 'application/xhtml+xml', 'json': 'application/json'}
+                    'xml': 'application/xhtml+xml', 'json': 'application/json',
+                    'ndjson': 'application/x-ndjson'}
+    export_streams = ('csv', 'json', 'ndjson')  # 流式输出的格式
+    export_files = ('xlsx', 'xls')  # 导出全部数据时先写入临时文件再输出的格式
+    xls_max_rows = 65536  # xls 单个工作表的行数上限
+    export_max = EXPORT_MAX  # 导出全部数据时的最大条数, 为 None 时流式导出不限制条数
+    export_chunk_size = 2000  # 流式导出时每次从数据库读取的条数
+    export_executor = EXPORT_EXECUTOR  # 后台导出的执行方式, 见 website.views.jobs
 
     def init_request(self, *args, **kwargs):
         '''
@@ -928,53 +1047,83 @@ class ExportPlugin(ViewPlugin):
         new_rows.insert(0, [force_str(c.text) for c in context['result_headers'].cells if c.export])
         return new_rows
 
-    def get_xlsx_export(self, context):
+    def _sheet_kind(self, o):
         '''
-        导出 xlsx
+        表格导出时一列的写入方式, 由该列的字段类型决定
+        '''
+        f = o.field
+        if f is None:
+            return 'boolean' if getattr(o.attr, 'boolean', False) else 'default'
+        if f.choices or f.is_relation:
+            return 'default'
+        if isinstance(f, (BooleanField, NullBooleanField)):
+            return 'boolean'
+        if isinstance(f, DateTimeField):
+            return 'datetime'
+        if isinstance(f, DateField):
+            return 'date'
+        if isinstance(f, TimeField):
+            return 'time'
+        if isinstance(f, (IntegerField, FloatField, DecimalField)):
+            return 'number'
+        return 'default'
+
+    def _sheet_value(self, o, kind):
+        if kind == 'default' or o.field is None and kind != 'boolean':
+            return self._format_value(o)
+        value = o.value
+        if kind == 'datetime' and value is not None and timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        elif kind == 'number' and isinstance(value, Decimal):
+            value = float(value)
+        return value
+
+    def _sheet_rows(self, rows):
+        '''
+        逐行生成表格导出的 (每列写入方式, 值), 每列的写入方式只在第一行确定一次
+        '''
+        kinds = None
+        for r in rows:
+            cells = [o for o in r.cells if getattr(o, 'export', False)]
+            if kinds is None:
+                kinds = [self._sheet_kind(o) for o in cells]
+            yield kinds, [self._sheet_value(o, kind) for o, kind in zip(cells, kinds)]
+
+    def write_xlsx_export(self, output, headers, rows):
+        '''
+        导出 xlsx: constant_memory 模式下按行写出, 内存占用与行数无关
         '''
-        datas = self._get_datas(context)
-        output = io.StringIO()
         export_header = (
                 self.request.GET.get('export_xlsx_header', 'off') == 'on')
 
         model_name = self.opts.verbose_name
-        book = xlsxwriter.Workbook(output)
+        book = xlsxwriter.Workbook(output, {'constant_memory': True})
         sheet = book.add_worksheet(
             "%s %s" % (_('Sheet'), force_str(model_name)))
-        styles = {'datetime': book.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
-                  'date': book.add_format({'num_format': 'yyyy-mm-dd'}),
-                  'time': book.add_format({'num_format': 'hh:mm:ss'}),
-                  'header': book.add_format(
-                      {'font': 'name Times New Roman', 'color': 'red', 'bold': 'on', 'num_format': '#,##0.00'}),
-                  'default': book.add_format()}
-
-        if not export_header:
-            datas = datas[1:]
-        for rowx, row in enumerate(datas):
-            for colx, value in enumerate(row):
-                if export_header and rowx == 0:
-                    cell_style = styles['header']
-                else:
-                    if isinstance(value, datetime.datetime):
-                        cell_style = styles['datetime']
-                    elif isinstance(value, datetime.date):
-                        cell_style = styles['date']
-                    elif isinstance(value, datetime.time):
-                        cell_style = styles['time']
-                    else:
-                        cell_style = styles['default']
-                sheet.write(rowx, colx, value, cell_style)
+        formats = {'datetime': book.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
+                   'date': book.add_format({'num_format': 'yyyy-mm-dd'}),
+                   'time': book.add_format({'num_format': 'hh:mm:ss'}),
+                   'header': book.add_format(
+                       {'font': 'name Times New Roman', 'color': 'red', 'bold': 'on', 'num_format': '#,##0.00'})}
+
+        rowx = 0
+        if export_header:
+            for colx, text in enumerate(force_str(c.text) for c in headers.cells if c.export):
+                sheet.write(rowx, colx, text, formats['header'])
+            rowx += 1
+        styles = None
+        for kinds, values in self._sheet_rows(rows):
+            if styles is None:
+                styles = [formats.get(kind) for kind in kinds]
+            for colx, value in enumerate(values):
+                sheet.write(rowx, colx, value, styles[colx])
+            rowx += 1
         book.close()
 
-        output.seek(0)
-        return output.getvalue()
-
-    def get_xls_export(self, context):
+    def write_xls_export(self, output, headers, rows):
         '''
-        导出 xls
+        导出 xls: 每写完一批行即 flush, 超过 xls 的行数上限时截断
         '''
-        datas = self._get_datas(context)
-        output = io.StringIO()
         export_header = (
                 self.request.GET.get('export_xls_header', 'off') == 'on')
 
@@ -982,32 +1131,38 @@ class ExportPlugin(ViewPlugin):
         book = xlwt.Workbook(encoding='utf8')
         sheet = book.add_sheet(
             "%s %s" % (_('Sheet'), model_name))
-        styles = {'datetime': xlwt.easyxf(num_format_str='yyyy-mm-dd hh:mm:ss'),
-                  'date': xlwt.easyxf(num_format_str='yyyy-mm-dd'),
-                  'time': xlwt.easyxf(num_format_str='hh:mm:ss'),
-                  'header': xlwt.easyxf('font: name Times New Roman, color-index red, bold on',
-                                        num_format_str='#,##0.00'),
-                  'default': xlwt.Style.default_style}
-
-        if not export_header:
-            datas = datas[1:]
-        for rowx, row in enumerate(datas):
-            for colx, value in enumerate(row):
-                if export_header and rowx == 0:
-                    cell_style = styles['header']
-                else:
-                    if isinstance(value, datetime.datetime):
-                        cell_style = styles['datetime']
-                    elif isinstance(value, datetime.date):
-                        cell_style = styles['date']
-                    elif isinstance(value, datetime.time):
-                        cell_style = styles['time']
-                    else:
-                        cell_style = styles['default']
-                sheet.write(rowx, colx, value, style=cell_style)
+        formats = {'datetime': xlwt.easyxf(num_format_str='yyyy-mm-dd hh:mm:ss'),
+                   'date': xlwt.easyxf(num_format_str='yyyy-mm-dd'),
+                   'time': xlwt.easyxf(num_format_str='hh:mm:ss'),
+                   'header': xlwt.easyxf('font: name Times New Roman, color-index red, bold on',
+                                         num_format_str='#,##0.00')}
+
+        rowx = 0
+        if export_header:
+            for colx, text in enumerate(force_str(c.text) for c in headers.cells if c.export):
+                sheet.write(rowx, colx, text, style=formats['header'])
+            rowx += 1
+        styles = None
+        for kinds, values in self._sheet_rows(rows):
+            if rowx >= self.xls_max_rows:
+                break
+            if styles is None:
+                styles = [formats.get(kind, xlwt.Style.default_style) for kind in kinds]
+            for colx, value in enumerate(values):
+                sheet.write(rowx, colx, value, style=styles[colx])
+            rowx += 1
+            if not rowx % self.export_chunk_size:
+                sheet.flush_row_data()
         book.save(output)
 
-        output.seek(0)
+    def get_xlsx_export(self, context):
+        output = io.BytesIO()
+        self.write_xlsx_export(output, context['result_headers'], context['results'])
+        return output.getvalue()
+
+    def get_xls_export(self, context):
+        output = io.BytesIO()
+        self.write_xls_export(output, context['result_headers'], context['results'])
         return output.getvalue()
 
     def _format_csv_text(self, t):
@@ -1018,17 +1173,67 @@ class ExportPlugin(ViewPlugin):
             t = '"%s"' % t
         return t
 
-    def get_csv_export(self, context):
-        datas = self._get_datas(context)
-        stream = []
+    def _iter_datas(self, headers, rows):
+        '''
+        逐行生成导出数据, 第一行为表头, 与 _get_datas 的结果相同
+        '''
+        yield [force_str(c.text) for c in headers.cells if c.export]
+        for r in rows:
+            yield [self._format_value(o) for o in r.cells if getattr(o, 'export', False)]
+
+    def _iter_objects(self, headers, rows):
+        '''
+        逐行生成导出对象, 与 _get_objects 的结果相同
+        '''
+        headers = [force_str(c.text) for c in headers.cells if c.export]
+        for r in rows:
+            yield dict(zip(headers, [self._format_value(o) for o in r.cells if getattr(o, 'export', False)]))
 
+    def _chunked(self, lines):
+        '''
+        将逐行输出的文本按 export_chunk_size 合并后输出, 减少响应的写入次数
+        '''
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= self.export_chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
+    def stream_csv_export(self, headers, rows):
+        datas = self._iter_datas(headers, rows)
         if self.request.GET.get('export_csv_header', 'off') != 'on':
-            datas = datas[1:]
+            next(datas)
+
+        for i, row in enumerate(datas):
+            # 文件主要面向windows平台
+            yield (i and '\r\n' or '') + ','.join(map(self._format_csv_text, row))
+
+    def stream_json_export(self, headers, rows):
+        indent = (self.request.GET.get('export_json_format', 'off') == 'on') and 4 or None
+        if indent:
+            yield '{\n    "objects": ['
+            for i, obj in enumerate(self._iter_objects(headers, rows)):
+                dumped = json.dumps(obj, ensure_ascii=False, indent=indent).replace('\n', '\n        ')
+                yield '%s\n        %s' % (i and ',' or '', dumped)
+            yield '\n    ]\n}'
+        else:
+            yield '{"objects": ['
+            for i, obj in enumerate(self._iter_objects(headers, rows)):
+                yield (i and ', ' or '') + json.dumps(obj, ensure_ascii=False)
+            yield ']}'
 
-        for row in datas:
-            stream.append(','.join(map(self._format_csv_text, row)))
+    def stream_ndjson_export(self, headers, rows):
+        for obj in self._iter_objects(headers, rows):
+            yield json.dumps(obj, ensure_ascii=False) + '\n'
 
-        return '\r\n'.join(stream)  # 文件主要面向windows平台
+    def get_csv_export(self, context):
+        return ''.join(self.stream_csv_export(context['result_headers'], context['results']))
+
+    def get_ndjson_export(self, context):
+        return ''.join(self.stream_ndjson_export(context['result_headers'], context['results']))
 
     def _to_xml(self, xml, data):
         if isinstance(data, (list, tuple)):
@@ -1065,25 +1270,120 @@ class ExportPlugin(ViewPlugin):
         return json.dumps({'objects': results}, ensure_ascii=False,
                           indent=(self.request.GET.get('export_json_format', 'off') == 'on') and 4 or None)
 
+    def _set_attachment(self, response, file_type):
+        file_name = self.opts.verbose_name.replace(' ', '_') if self.opts else self.view.verbose_name
+        response['Content-Disposition'] = ('attachment; filename=%s.%s' % (
+            file_name, file_type)).encode('utf-8')
+        return response
+
     def get_response(self, response, context, *args, **kwargs):
         file_type = self.request.GET.get('export_type', 'csv')
+        self._job_progress(len(context['results']))
         response = HttpResponse(
             content_type="%s; charset=UTF-8" % self.export_mimes[file_type])
-
-        file_name = self.opts.verbose_name.replace(' ', '_') if self.opts else self.view.verbose_name
-        response['Content-Disposition'] = ('attachment; filename=%s.%s' % (
-            file_name, file_type)).encode('utf-8')
+        self._set_attachment(response, file_type)
 
         response.write(getattr(self, 'get_%s_export' % file_type)(context))
         return response
 
+    def get_stream_response(self, file_type):
+        '''
+        流式导出全部数据: 不做 COUNT, 不生成整页的 results, 按块读取 queryset, 逐行 makerow 后立即格式化输出
+        '''
+        av = self.view
+        av.ordering_field_columns = av.get_ordering_field_columns()
+        headers = av.makeheaders()
+        # 只生成需要导出的列, 并跳过链接的生成（选择框、操作按钮等列逐行渲染的开销很大）
+        # 查询计划也只按导出的列生成
+        av.list_display = [c.field_name for c in headers.cells if c.export]
+        av.list_queryset = av.get_list_queryset()
+        queryset = av.list_queryset
+        if self.export_max:
+            queryset = queryset[:self.export_max]
+        # iterator() 不执行 prefetch_related, 改为每块数据读取后统一 prefetch
+        prefetch = queryset._prefetch_related_lookups
+
+        def rows():
+            count = 0
+            chunk = []
+            for obj in queryset.iterator(chunk_size=self.export_chunk_size):
+                chunk.append(obj)
+                if len(chunk) < self.export_chunk_size:
+                    continue
+                yield from chunk_rows(chunk)
+                count += len(chunk)
+                chunk = []
+                self._job_progress(count)
+            yield from chunk_rows(chunk)
+            self._job_progress(count + len(chunk))
+
+        def chunk_rows(chunk):
+            if prefetch:
+                prefetch_related_objects(chunk, *prefetch)
+            for obj in chunk:
+                obj._nolink = True
+                yield av.makerow(obj)
+
+        rows = rows()
+        if file_type in self.export_files:
+            output = tempfile.TemporaryFile()
+            getattr(self, 'write_%s_export' % file_type)(output, headers, rows)
+            output.seek(0)
+            response = FileResponse(output, content_type=self.export_mimes[file_type])
+        else:
+            response = StreamingHttpResponse(
+                self._chunked(getattr(self, 'stream_%s_export' % file_type)(headers, rows)),
+                content_type="%s; charset=UTF-8" % self.export_mimes[file_type])
+        return self._set_attachment(response, file_type)
+
+    def _job_progress(self, rows):
+        job = getattr(self.request, 'export_job', None)
+        if job:
+            ExportJob.objects.filter(pk=job.pk).update(rows=rows)
+
+    def get_export_columns(self):
+        '''
+        当前列表中需要导出的列, 与 makeheader 中的判断一致
+        '''
+        columns = []
+        for field_name in self.view.list_display:
+            if field_name == 'action_checkbox':
+                continue
+            text, attr = label_for_field(field_name, self.model, model_admin=self.view, return_attr=True)
+            if not attr or field_name == '__str__' or getattr(attr, 'allow_export', True):
+                columns.append(field_name)
+        return columns
+
+    def enqueue_export(self, file_type):
+        '''
+        后台导出: 只记录导出任务并返回任务状态的地址, 导出由执行器在请求之外完成
+        '''
+        query = self.request.GET.copy()
+        query.pop('export_async', None)
+        job = ExportJob(user=self.request.user, content_type=ContentType.objects.get_for_model(self.model),
+                        path=self.request.path, query=query.urlencode(), export_type=file_type)
+        job.set_columns(self.get_export_columns())
+        job.save()
+        jobs.submit(job, self.export_executor)
+        return self.render_json({'id': job.pk, 'url': self.get_site_url('export_job', job.pk)})
+
     # View Methods
     def get_result_list(self, __):
         '''
         控制导出的grid数据
         '''
+        job = getattr(self.request, 'export_job', None)
+        if job:
+            # 执行后台任务时按任务记录的列导出
+            self.view.list_display = job.get_columns() or self.view.list_display
+        elif self.request.GET.get('export_async', 'off') == 'on':
+            return self.enqueue_export(self.request.GET.get('export_type', 'csv'))
+
         if self.request.GET.get('all', 'off') == 'on':
-            self.view.list_per_page = EXPORT_MAX  # sys.maxint
+            file_type = self.request.GET.get('export_type', 'csv')
+            if file_type in self.export_streams + self.export_files:
+                return self.get_stream_response(file_type)
+            self.view.list_per_page = self.export_max or EXPORT_MAX  # sys.maxint
         return __()
 
     def makeheader(self, item, field_name, row):
@@ -1095,11 +1395,10 @@ class ExportPlugin(ViewPlugin):
             item.export = False
         return item
 
-    def makecell(self, item, obj, field_name, row):
-        item.export = item.field or field_name == '__str__' or getattr(item.attr, 'allow_export', True)
-        if field_name == 'action_checkbox':
-            item.export = False
-        return item
+    def makecolumn(self, column, field_name):
+        export = bool(column.field or field_name == '__str__' or getattr(column.attr, 'allow_export', True))
+        column.cell_attrs['export'] = export and field_name != 'action_checkbox'
+        return column
 
 
 # </editor-fold>
@@ -1117,12 +1416,25 @@ class IncorrectLookupParameters(Exception):
     pass
 
 
+def set_facet_base(view, queryset):
+    """
+    记录过滤插件过滤之前的 queryset，FilterPlugin、QuickFilterPlugin 中先执行的一个记录，计算过滤器选项的记录数时从它重新生成
+    """
+    if getattr(view, 'facet_base', None) is None:
+        view.facet_base = queryset
+
+
 class FilterPlugin(ViewPlugin):
     list_filter = ()
     search_fields = []
+    search_backend = None
+    search_backend_options = {}
+    search_order_by_rank = True
     free_query_filter = True
     filter_default_list = []
     filter_list_position = None
+    filter_counts = False
+    filter_counts_top = 50
 
     def __init__(self, view):
         super().__init__(view)
@@ -1181,6 +1493,8 @@ class FilterPlugin(ViewPlugin):
         return clean_lookup in self.list_filter
 
     def get_list_queryset(self, queryset):
+        set_facet_base(self.view, queryset)
+        self.facet_search = []
         lookup_params = dict([(k[len('_p_'):], v) for k, v in self.view.params.items()
                               if k.startswith('_p_') and v != ''])
         # print('queryset:', lookup_params)
@@ -1223,7 +1537,6 @@ class FilterPlugin(ViewPlugin):
                                                    self.model, self.view, field_path=field_path)
                     if len(field_parts) > 1:
                         spec.title = "%s%s" % (field_parts[-2].related_model._meta.verbose_name, spec.title)
-                    use_distinct = (use_distinct or lookup_needs_distinct(self.opts, field_path))
                 # print('has output:',spec.has_output())
                 if spec and spec.has_output():
                     try:
@@ -1243,6 +1556,10 @@ class FilterPlugin(ViewPlugin):
         self.has_filters = bool(self.filter_specs)
         self.view.filter_specs = self.filter_specs
         self.view.filter_default = self.filter_default
+        if self.filter_counts:
+            counter = FacetCounter(self.view, self.filter_counts_top)
+            for spec in self.filter_specs:
+                counter.add(spec, self.get_facet_queryset)
         self.view.used_filter_num = len([f for f in self.filter_specs if f.is_used and f not in self.filter_default])
 
         try:
@@ -1257,7 +1574,8 @@ class FilterPlugin(ViewPlugin):
                 if k.endswith('__in'):
                     m_v = v.split(',')
                     m_lookup_params[k] = m_v
-            queryset = queryset.filter(**m_lookup_params)
+            queryset = queryset.filter(semijoin(self.model, **m_lookup_params))
+            self.facet_lookup_params = m_lookup_params
         except (SuspiciousOperation, ImproperlyConfigured):
             raise
         except Exception as e:
@@ -1265,37 +1583,57 @@ class FilterPlugin(ViewPlugin):
 
         ######## search part
         query = self.request.GET.get(SEARCH_VAR, '')
-
-        def construct_search(field_name):
-            if field_name.startswith('^'):
-                return "%s__istartswith" % field_name[1:]
-            elif field_name.startswith('='):
-                return "%s__iexact" % field_name[1:]
-            elif field_name.startswith('@'):
-                return "%s__search" % field_name[1:]
-            else:
-                return "%s__icontains" % field_name
-
-        if self.search_fields and query:
-            if not self.view.search_sphinx_ins:
-                orm_lookups = [construct_search(str(search_field))
-                               for search_field in self.search_fields]
-                for bit in query.split():
-                    or_queries = [models.Q(**{orm_lookup: bit})
-                                  for orm_lookup in orm_lookups]
-                    queryset = queryset.filter(reduce(operator.or_, or_queries))
-                if not use_distinct:
-                    for search_spec in orm_lookups:
-                        if lookup_needs_distinct(self.opts, search_spec):
-                            use_distinct = True
-                            break
+        backend = self.get_search_backend()
+        if backend is not None and query.strip():
+            conditions, rank = backend.search(query)
+            for q in conditions:
+                queryset = queryset.filter(q)
+                self.facet_search.append(q)
+            use_distinct = use_distinct or backend.needs_distinct()
+            if rank is not None and self.search_order_by_rank and not self.view.params.get(ORDER_VAR):
+                queryset = queryset.annotate(**{search.RANK_NAME: rank}).order_by(
+                    '-' + search.RANK_NAME, *queryset.query.order_by)
             self.view.search_query = query
 
+        self.facet_distinct = use_distinct
         if use_distinct:
             return queryset.distinct()
         else:
             return queryset
 
+    def get_search_backend(self):
+        """
+        列表使用的搜索后端，没有配置搜索时为 None
+        """
+        if self.view.search_sphinx_ins:
+            return search.get_backend(self.model, 'sphinx', self.search_fields, {'index': self.view.search_sphinx_ins})
+        if not self.search_fields:
+            return None
+        return search.get_backend(self.model, self.search_backend, self.search_fields, self.search_backend_options)
+
+    def get_facet_queryset(self, spec, exclude=None):
+        """
+        去掉过滤器 spec（或参数 exclude）的条件后重新生成的 queryset，用于计算使用中的过滤器各选项的记录数
+        """
+        exclude = set(spec.used_params) if exclude is None else exclude
+        # 从两个过滤插件都还没有过滤的 queryset 重新生成，再应用快速过滤及本插件的过滤器
+        queryset = self.view.facet_base
+        specs = list(self.filter_specs)
+        for plugin in self.view.plugins:
+            if isinstance(plugin, QuickFilterPlugin):
+                specs.extend(getattr(plugin, 'filter_specs', []))
+        for s in specs:
+            if s is not spec and not exclude & set(s.used_params):
+                try:
+                    queryset = s.do_filte(queryset)
+                except ValidationError:
+                    pass
+        queryset = queryset.filter(
+            semijoin(self.model, **dict((k, v) for k, v in self.facet_lookup_params.items() if k not in exclude)))
+        for q in self.facet_search:
+            queryset = queryset.filter(q)
+        return queryset.distinct() if self.facet_distinct else queryset
+
     def get_media(self, media):
         if bool(list(filter(lambda s: isinstance(s, DateFieldListFilter) or isinstance(s, DateBaseFilter),
                             self.filter_specs))):
@@ -1330,6 +1668,8 @@ class FilterPlugin(ViewPlugin):
 class QuickFilterPlugin(ViewPlugin):
     list_quick_filter = ()  # these must be a subset of list_filter to work
     quickfilter = {}
+    filter_counts = False
+    filter_counts_top = 50
 
     search_fields = ()
     free_query_filter = True
@@ -1393,7 +1733,6 @@ class QuickFilterPlugin(ViewPlugin):
         for p_key, p_val in list(lookup_params.items()):
             if p_val == "False":
                 lookup_params[p_key] = False
-        use_distinct = False
 
         if not hasattr(self.view, 'quickfilter'):
             self.view.quickfilter = {}
@@ -1409,6 +1748,7 @@ class QuickFilterPlugin(ViewPlugin):
                 if not self.lookup_allowed(key, value):
                     raise SuspiciousOperation("Filtering by %s not allowed" % key)
 
+        set_facet_base(self.view, queryset)
         self.filter_specs = []
         if self.list_quick_filter:
             for list_quick_filter in self.list_quick_filter:
@@ -1445,8 +1785,6 @@ class QuickFilterPlugin(ViewPlugin):
                 if len(field_parts) > 1:
                     spec.title = "%s %s" % (field_parts[-2].name, spec.title)
 
-                    # Check if we need to use distinct()
-                use_distinct = True  # (use_distinct orlookup_needs_distinct(self.opts, field_path))
                 if spec and spec.has_output():
                     try:
                         new_qs = spec.do_filte(queryset)
@@ -1461,11 +1799,22 @@ class QuickFilterPlugin(ViewPlugin):
         self.has_filters = bool(self.filter_specs)
         self.view.quickfilter['filter_specs'] = self.filter_specs
         self.view.quickfilter['used_filter_num'] = len([f for f in self.filter_specs if f.is_used])
+        if self.filter_counts:
+            counter = FacetCounter(self.view, self.filter_counts_top)
+            for spec in self.filter_specs:
+                counter.add(spec, self.get_facet_queryset)
 
-        if use_distinct:
-            return queryset.distinct()
-        else:
-            return queryset
+        # 过滤器的多值关联条件已改写为子查询，不需要 distinct
+        return queryset
+
+    def get_facet_queryset(self, spec):
+        """
+        快速过滤的参数也由 FilterPlugin 作为其他参数应用，由它去掉 spec 的参数重新生成 queryset
+        """
+        for plugin in self.view.plugins:
+            if isinstance(plugin, FilterPlugin) and hasattr(plugin, 'facet_lookup_params'):
+                return plugin.get_facet_queryset(None, set(spec.used_params))
+        return None
 
     def block_left_navbar(self, context, nodes):
         nodes.append(
@@ -1551,27 +1900,24 @@ class ModelListPlugin(ViewPlugin):
     def init_request(self, *args, **kwargs):
         return bool(self.list_gallery)
 
-    def makecell(self, item, obj, field_name, row):
-        opts = obj._meta
-        try:
-            f = opts.get_field(field_name)
-        except models.FieldDoesNotExist:
-            f = None
-        if f:
-            if isinstance(f, models.ImageField):
-                img = getattr(obj, field_name)
-                if img:
-                    db_value = str(img)
-                    if db_value.startswith('/'):
-                        file_path = urllib.parse.urljoin(settings.REMOTE_MEDIA_URL, db_value)
-                    else:
-                        file_path = img.url
-                    if type(self.list_gallery) == str:
-                        file_path = '%s%s' % (file_path, self.list_gallery)
-                    item.text = mark_safe(
-                        '<a href="%s" target="_blank" data-gallery="gallery"><img src="%s" class="field_img"/></a>' % (
-                            file_path, file_path))
-        return item
+    def makecolumn(self, column, field_name):
+        if isinstance(column.field, models.ImageField) and column.field_name == column.name:
+            column.transforms.append(self.image_cell)
+        return column
+
+    def image_cell(self, item, obj, row):
+        img = getattr(obj, item.field_name)
+        if img:
+            db_value = str(img)
+            if db_value.startswith('/'):
+                file_path = urllib.parse.urljoin(settings.REMOTE_MEDIA_URL, db_value)
+            else:
+                file_path = img.url
+            if type(self.list_gallery) == str:
+                file_path = '%s%s' % (file_path, self.list_gallery)
+            item.text = mark_safe(
+                '<a href="%s" target="_blank" data-gallery="gallery"><img src="%s" class="field_img"/></a>' % (
+                    file_path, file_path))
 
     # Media
     def get_media(self, media):
@@ -1785,22 +2131,24 @@ class GridLayoutPlugin(ViewPlugin):
                     self.view.list_template = self.view.get_template_list(layout['template'])
         return active
 
-    def makecell(self, item, obj, field_name, row):
+    def makecolumn(self, column, field_name):
         if self._current_layout == 'thumbnails':
-            if getattr(item.attr, 'is_column', True):
-                item.field_label = label_for_field(
+            if getattr(column.attr, 'is_column', True):
+                column.cell_attrs['field_label'] = label_for_field(
                     field_name, self.model,
                     model_admin=self.view,
                     return_attr=False
                 )
-            if getattr(item.attr, 'thumbnail_img', False):
-                setattr(item, 'thumbnail_hidden', True)
-                row['thumbnail_img'] = item
-            elif item.is_display_link:
-                setattr(item, 'thumbnail_hidden', True)
-                row['thumbnail_label'] = item
+            column.transforms.append(self.thumbnail_cell)
+        return column
 
-        return item
+    def thumbnail_cell(self, item, obj, row):
+        if getattr(item.attr, 'thumbnail_img', False):
+            setattr(item, 'thumbnail_hidden', True)
+            row['thumbnail_img'] = item
+        elif item.is_display_link:
+            setattr(item, 'thumbnail_hidden', True)
+            row['thumbnail_label'] = item
 
     # Block Views
     def block_top_toolbar(self, context, nodes):
@@ -1882,8 +2230,7 @@ class ModelFormPlugin(PortalPlugin):
             fs_map[f.css_id] = f
 
         try:
-            layout_pos = UserSetting.objects.get(
-                user=self.user, key=self._portal_key()).value
+            layout_pos = usersettings.get_settings(self.request).get(self._portal_key())
             layout_cs = layout_pos.split('|')
             for i, c in enumerate(cs):
                 c.fields = [fs_map.pop(j) for j in layout_cs[i].split(
@@ -2024,8 +2371,30 @@ class RefreshPlugin(ViewPlugin):
 '''
 
 
+ROW_TOKEN = 'WEBSITE_ROW_%s_'  # 生成行模板时占位，不会被 reverse() 转义
+
+
+def row_token(name):
+    return ROW_TOKEN % name
+
+
+def row_template(html, *names):
+    '''
+    将 html 中 names 的占位换成 %(name)s，其余的 % 转义，各行用 ``template % values`` 生成
+    '''
+    html = html.replace('%', '%%')
+    for name in names:
+        html = html.replace(row_token(name), '%%(%s)s' % name)
+    return html
+
+
+RELATED_COUNT_PREFIX = '_related_count_'
+PK_SAFE_CHARS = RFC3986_SUBDELIMS + '/~:@'
+
+
 class RelateMenuPlugin(ViewPlugin):
     related_list = []
+    show_related_count = False
     use_related_menu = True
     use_op_menu = True
     op_menu_btn = True
@@ -2094,12 +2463,16 @@ class RelateMenuPlugin(ViewPlugin):
             'verbose_name': verbose_name
         }
 
-    def related_link(self, instance):
+    def get_related_template(self):
         '''
-        外键关联菜单列
+        关联菜单列的 html 模板，每个请求生成一次，各行只需填入主键（及关联对象的数量）
         '''
+        if hasattr(self, '_related_template'):
+            return self._related_template
+
         links = []
-        for r, view_perm, add_perm in self.get_related_list():
+        self.related_counts = []
+        for i, (r, view_perm, add_perm) in enumerate(self.get_related_list()):
             info = RelateMenuPlugin.get_r_model_info(r)
             label = info['label']
             model_name = info['model_name']
@@ -2110,11 +2483,17 @@ class RelateMenuPlugin(ViewPlugin):
 
             if view_perm:
                 list_url = reverse('%s:%s_%s_changelist' % (self.website.module_name, label, model_name))
-                str1 = '<a href="%s?%s=%s" title="查看%s"><i class="icon fa fa-usb"></i> %s</a>' % (
+                badge = ''
+                if self.show_related_count:
+                    name = 'count%d' % i
+                    self.related_counts.append((name, RELATED_COUNT_PREFIX + r.get_accessor_name(), r))
+                    badge = row_token(name)
+                str1 = '<a href="%s?%s=%s" title="查看%s"><i class="icon fa fa-usb"></i> %s%s</a>' % (
                     list_url,
-                    RELATE_PREFIX + lookup_name, str(instance.pk),
+                    RELATE_PREFIX + lookup_name, row_token('pk'),
                     verbose_name,
-                    verbose_name
+                    verbose_name,
+                    badge
                 )
             else:
                 str1 = '<a><span class="text-muted"><i class="icon fa fa-blank"></i> %s</span></a>' % verbose_name
@@ -2125,7 +2504,7 @@ class RelateMenuPlugin(ViewPlugin):
                 str2 = '<a class="add_link dropdown-menu-btn" href="%s?%s=%s" title="添加%s"><i class="icon fa fa-plus pull-right"></i></a>' % (
                     add_url,
                     RELATE_PREFIX + lookup_name,
-                    str(instance.pk),
+                    row_token('pk'),
                     verbose_name
                 )
             else:
@@ -2135,42 +2514,81 @@ class RelateMenuPlugin(ViewPlugin):
             link = ''.join(_tojoin)
             links.append(link)
         ul_html = '<ul class="dropdown-menu" role="menu">%s</ul>' % ''.join(links)
-        return '<div class="dropdown related_menu pull-right"><a title="%s" class="relate_menu dropdown-toggle" data-toggle="dropdown"><i class="icon fa fa-ellipsis-v"></i></a>%s</div>' % (
+        html = '<div class="dropdown related_menu pull-right"><a title="%s" class="relate_menu dropdown-toggle" data-toggle="dropdown"><i class="icon fa fa-ellipsis-v"></i></a>%s</div>' % (
             _('Related Objects'), ul_html)
+        self._related_template = row_template(html, 'pk', *[name for name, attr, r in self.related_counts])
+        return self._related_template
+
+    def related_link(self, instance):
+        '''
+        外键关联菜单列
+        '''
+        values = {'pk': str(instance.pk)}
+        template = self.get_related_template()
+        for name, attr, r in self.related_counts:
+            count = getattr(instance, attr, None)
+            values[name] = count is not None and ' <span class="badge">%d</span>' % count or ''
+        return template % values
 
     related_link.verbose_name = '&nbsp;'
     related_link.allow_tags = True
     related_link.allow_export = False
     related_link.is_column = False
+    related_link.only = ()  # 只用到主键
+
+    def get_op_template(self):
+        '''
+        操作列的 html 模板，每个请求生成一次，各行只需填入主键
+        '''
+        if hasattr(self, '_op_template'):
+            return self._op_template
 
-    def op_link(self, instance):
-        _model = self.view.model
         links = []
-        # if self.has_view_perm:
-        #     links.append('''<a %s="%s" data-edit-uri="%s" rel="tooltip" title="%s" %s >%s 查看</a>''' % (
-        #         self.op_menu_btn and 'data-res-uri' or 'href', self.view.model_admin_url('detail', instance.pk),
-        #         self.view.model_admin_url('change', instance.pk), escape(escape(str(instance))),
-        #         self.op_menu_btn and 'class="btn btn-info btn-xs details-handler"' or '',
-        #         self.op_menu_btn and '<i class="fa fa-search-plus"></i>' or ''))
         if not self.view.pop and self.has_change_perm:
             links.append('''<a href="%s" %s >%s %s</a>''' % (
-                self.view.model_admin_url('change', instance.pk),
+                self.view.model_admin_url('change', row_token('pk')),
                 self.op_menu_btn and 'class="btn  btn-xs"' or '',
                 self.use_menu_icon and '<i class="fa fa-edit"></i>' or '',
                 self.use_menu_name and '修改' or ''))
         if not self.view.pop and self.has_delete_perm:
             links.append('''<a href="%s" %s >%s %s</a>''' % (
-                self.view.model_admin_url('delete', instance.pk),
+                self.view.model_admin_url('delete', row_token('pk')),
                 self.op_menu_btn and 'class="btn  btn-xs"' or '',
                 self.use_menu_icon and '<i class="fa fa-trash"></i>' or '',
                 self.use_menu_name and '删除' or ''))
 
-        return ' '.join(links)
+        self._op_template = row_template(' '.join(links), 'pk')
+        return self._op_template
+
+    def op_link(self, instance):
+        # 与 reverse() 对参数的转义相同
+        return self.get_op_template() % {'pk': urllib.parse.quote(str(instance.pk), safe=PK_SAFE_CHARS)}
 
     op_link.verbose_name = '&nbsp;'
     op_link.allow_tags = True
     op_link.allow_export = False
     op_link.is_column = False
+    op_link.only = ()  # 只用到主键
+
+    def get_result_list(self, __):
+        response = __()
+        # 关联对象的数量只在当前页的查询中用子查询计算，不影响总数的查询
+        result_list = getattr(self.view, 'result_list', None)
+        if 'related_link' in self.view.list_display and isinstance(result_list, models.QuerySet):
+            self.get_related_template()
+            if self.related_counts:
+                self.view.result_list = result_list.annotate(**dict(
+                    (attr, self.related_count_expression(r)) for name, attr, r in self.related_counts))
+        return response
+
+    def related_count_expression(self, r):
+        '''
+        关联对象数量的子查询，与关联菜单链接的过滤条件相同
+        '''
+        info = RelateMenuPlugin.get_r_model_info(r)
+        queryset = r.related_model._default_manager.filter(**{info['lookup_name']: OuterRef('pk')}) \
+            .order_by().values(r.field.name).annotate(_count=Count('*')).values('_count')
+        return Coalesce(Subquery(queryset, output_field=IntegerField()), 0)
 
     def get_list_display(self, list_display):
         self.has_view_perm = self.view.has_permission('view')
@@ -2532,10 +2950,9 @@ class ThemePlugin(ViewPlugin):
 
     def _get_theme(self):
         if self.user:
-            try:
-                return UserSetting.objects.get(user=self.user, key="website-theme").value
-            except Exception:
-                pass
+            theme = usersettings.get_settings(self.request).get("website-theme")
+            if theme is not None:
+                return theme
         if '_theme' in self.request.COOKIES:
             return urllib.parse.unquote(self.request.COOKIES['_theme'])
         return self.default_theme
@@ -0,0 +1,247 @@
+"""
+视图的数据库查询记录
+
+打开 ``BASE_QUERY_PROFILE`` 后，``ViewTemplate.as_view`` 生成的视图在每个请求中（包括模板渲染）通过
+``connection.execute_wrapper`` 记录查询数、数据库耗时、重复执行的语句形式（去掉参数后的 SQL）以及发出查询的钩子：
+
+* 写入 logger ``website``，出现 N+1（同一形式的语句执行 ``BASE_QUERY_DUPLICATE_MIN`` 次以上）或慢查询时为 warning
+* DEBUG 时写入响应头 ``X-Website-Queries``
+* 配置了 ``BASE_QUERY_PROFILE_LOG`` 时每个请求追加一行 JSON，由 ``manage.py queryreport`` 汇总输出
+
+测试中可以使用 :class:`QueryAssertionsMixin` 的 ``assertMaxQueries`` 限制视图的查询数。
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+from website.views.configs import QUERY_PROFILE_LOG, QUERY_SLOW_MS, QUERY_DUPLICATE_MIN
+
+logger = logging.getLogger('website')
+
+HEADER = 'X-Website-Queries'
+
+_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_local = threading.local()
+_lock = threading.Lock()
+active = 0  # 当前进程中正在记录的请求数, 为 0 时 pluginhook 不做任何处理
+
+
+def normalize_sql(sql):
+    """
+    语句形式：参数、字面量替换为 ?，IN 列表合并为 (...)，只有参数不同的语句形式相同
+    """
+    return _in_list.sub('(...)', _literal.sub('?', sql.replace('%s', '?')))
+
+
+def current():
+    """
+    当前线程正在记录的 :class:`QueryProfile`
+    """
+    return getattr(_local, 'profile', None)
+
+
+class QueryProfile:
+    """
+    一个请求中的查询记录，``with profile:`` 期间当前线程所有数据库连接上的查询都会被记录
+
+    查询归属于发出它的最内层钩子：视图方法记为钩子名，插件方法记为定义它的 ``插件类名.钩子名``
+    """
+
+    def __init__(self, name, path=''):
+        self.name = name
+        self.path = path
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+        self.hooks = Counter()
+        self.shape_hooks = {}
+        self.slow = []
+        self.stack = []
+        self._wrappers = []
+        self._previous = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            shape = normalize_sql(sql)
+            hook = self.stack[-1] if self.stack else '-'
+            self.count += 1
+            self.time += duration
+            self.shapes[shape] += 1
+            self.hooks[hook] += 1
+            self.shape_hooks.setdefault(shape, Counter())[hook] += 1
+            if duration * 1000 >= QUERY_SLOW_MS:
+                self.slow.append((round(duration * 1000, 1), shape))
+
+    def __enter__(self):
+        global active
+        self._previous = current()
+        _local.profile = self
+        for conn in connections.all():
+            wrapper = conn.execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        with _lock:
+            active += 1
+        return self
+
+    def __exit__(self, *exc):
+        global active
+        with _lock:
+            active -= 1
+        while self._wrappers:
+            self._wrappers.pop().__exit__(*exc)
+        _local.profile = self._previous
+
+    def wrap(self, label, fun):
+        stack = self.stack
+
+        def wrapped(*args, **kwargs):
+            stack.append(label)
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                stack.pop()
+
+        return wrapped
+
+    def wrap_hook(self, name, cf, boundchain):
+        """
+        为 pluginhook 的视图方法及插件函数链加上归属标记
+        """
+        if boundchain:
+            boundchain = [(self.wrap(getattr(pf, '__qualname__', name), pf), kind) for pf, kind in boundchain]
+        return self.wrap(name, cf), boundchain
+
+    @property
+    def duplicates(self):
+        """
+        执行了多次的语句形式 [(形式, 次数, {钩子: 次数}), ...]，次数多的在前
+        """
+        return [(shape, n, dict(self.shape_hooks[shape])) for shape, n in self.shapes.most_common() if n > 1]
+
+    def has_problem(self):
+        return bool(self.slow) or any(n >= QUERY_DUPLICATE_MIN for shape, n, hooks in self.duplicates)
+
+    def header(self):
+        return '%d queries; %.1fms; %d duplicated' % (self.count, self.time * 1000, len(self.duplicates))
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'path': self.path,
+            'count': self.count,
+            'time': round(self.time * 1000, 2),
+            'hooks': dict(self.hooks),
+            'duplicates': self.duplicates,
+            'slow': self.slow,
+        }
+
+    def describe(self, top=5):
+        lines = ['%s: %s' % (' '.join(filter(None, (self.name, self.path))), self.header())]
+        for shape, n, hooks in self.duplicates[:top]:
+            lines.append('  %dx [%s] %s' % (n, ', '.join(sorted(hooks)), shape))
+        for duration, shape in self.slow[:top]:
+            lines.append('  slow %.1fms %s' % (duration, shape))
+        return '\n'.join(lines)
+
+    def finish(self, response=None):
+        """
+        请求结束：写日志、响应头及查询记录文件
+        """
+        if response is not None and settings.DEBUG:
+            response[HEADER] = self.header()
+        if self.has_problem():
+            logger.warning(self.describe())
+        else:
+            logger.info(self.describe(top=0))
+        if QUERY_PROFILE_LOG:
+            line = json.dumps(self.as_dict(), ensure_ascii=False)
+            with _lock:
+                with open(QUERY_PROFILE_LOG, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+
+
+def profile_view(view):
+    """
+    记录视图函数的查询，TemplateResponse 延迟到渲染结束后再结束记录
+    """
+
+    def wrapper(request, *args, **kwargs):
+        match = getattr(request, 'resolver_match', None)
+        profile = QueryProfile(match.view_name if match else request.path, request.path)
+        with profile:
+            response = profile.wrap('view', view)(request, *args, **kwargs)
+        if getattr(response, 'streaming', False):
+            # 流式响应在输出时才执行查询，响应头此时已经发出
+            response.streaming_content = profiled_stream(profile, response.streaming_content)
+            return response
+        if getattr(response, 'is_rendered', True):
+            profile.finish(response)
+            return response
+
+        render = response.render
+
+        def profiled_render():
+            if response.is_rendered:
+                return render()
+            with profile:
+                result = profile.wrap('render', render)()
+            profile.finish(response)
+            return result
+
+        response.render = profiled_render
+        return response
+
+    return wrapper
+
+
+def profiled_stream(profile, content):
+    iterator = iter(content)
+    while True:
+        with profile:
+            chunk = profile.wrap('stream', next)(iterator, None)
+        if chunk is None:
+            break
+        yield chunk
+    profile.finish()
+
+
+class QueryAssertionsMixin:
+    """
+    TestCase 的混入类::
+
+        class TestBookList(QueryAssertionsMixin, TestCase):
+            def test_queries(self):
+                self.assertMaxQueries(BookListView.as_view(), 10, request)
+    """
+
+    def assertMaxQueries(self, view, n, request=None, *args, **kwargs):
+        """
+        执行视图函数并渲染响应，查询数超过 n 时失败，失败信息列出重复的语句及发出查询的钩子。返回 :class:`QueryProfile`
+        """
+        if request is None:
+            from django.test import RequestFactory
+            request = RequestFactory().get('/')
+        profile = QueryProfile(request.path)
+        with profile:
+            response = view(request, *args, **kwargs)
+            if not getattr(response, 'is_rendered', True):
+                response.render()
+            elif getattr(response, 'streaming', False):
+                for chunk in profile.wrap('stream', list)(response.streaming_content):
+                    pass
+        if profile.count > n:
+            self.fail('%d queries executed, %d expected at most\n%s' % (profile.count, n, profile.describe()))
+        profile.response = response
+        return profile
@@ -0,0 +1,215 @@
+"""
+列表行缓存
+
+配置 ``list_row_cache = True`` 后，``ListViewTemplate.results`` 对每个对象先查缓存，命中时直接还原 makerow 的结果
+（包括所有插件对单元格的处理），未命中的行生成后写入缓存。缓存键由以下部分组成：
+
+* 模型及主键，配置了 ``list_row_cache_version`` （如 ``updated_at``）时还包括该字段的值
+* 模型的版本号：模型本身或它的外键、多对多字段关联的模型发生 post_save、post_delete、m2m_changed 时加一，
+  不经过信号的修改（如 ``queryset.update()``）需要配合 ``list_row_cache_version`` 使用
+* 列表的显示列、链接列及影响行内容的请求参数（分页、排序、搜索、过滤参数除外）
+* 用户权限的指纹，权限相同的用户共享缓存
+
+行的内容只能取决于对象本身和用户权限，与用户身份相关的列不要开启。每个模型的命中次数记录在缓存中，由
+:func:`stats` 读取。
+"""
+import datetime
+import hashlib
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils.encoding import smart_str
+from django.utils.translation import get_language
+
+from website.views.configs import PAGE_VAR, CURSOR_VAR, ORDER_VAR, SEARCH_VAR, ALL_VAR, FILTER_PREFIX
+
+# 与行内容无关的请求参数
+ROW_INDEPENDENT_VARS = (PAGE_VAR, CURSOR_VAR, ORDER_VAR, SEARCH_VAR, ALL_VAR, '_')
+# 可以直接缓存的单元格值类型，其他值（如多对多字段的管理器）以字符串缓存
+VALUE_TYPES = (str, int, float, bool, Decimal, datetime.date, datetime.time, datetime.timedelta, models.Model)
+
+_models = set()  # 开启了行缓存的模型
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def generation_key(model):
+    return 'website:rowgen:%s' % model_label(model)
+
+
+def get_generation(model):
+    """
+    模型当前的版本号。初始值取当前时间，缓存被清除后不会回到旧的版本号而取到过期的行
+    """
+    key = generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000))
+        generation = cache.get(key)
+    return generation
+
+
+def bump(model):
+    """
+    模型变动后，该模型及通过外键、多对多关联到它的模型中开启了行缓存的，版本号加一
+    """
+    targets = {model} | {r.related_model for r in model._meta.related_objects}
+    for m in targets & _models:
+        try:
+            cache.incr(generation_key(m))
+        except ValueError:
+            # 还没有版本号，说明没有缓存过行
+            pass
+
+
+def enable(model):
+    """
+    登记开启了行缓存的模型，注册模型配置时调用，进程启动后即可处理其他进程中缓存的行
+
+    只为该模型及其外键、多对多关联的模型连接信号：有接收者的模型删除时不能批量快速删除
+    """
+    if model in _models:
+        return
+    _models.add(model)
+    senders = {model}
+    for f in model._meta.get_fields():
+        # 模型上定义的外键、多对多字段，反向关联的变动不影响行的版本号
+        if f.is_relation and not f.auto_created and f.related_model is not None:
+            senders.add(f.related_model)
+            if f.many_to_many:
+                senders.add(f.remote_field.through)
+    for sender in senders:
+        # 自动生成的中间表的行只由 add()、remove() 等修改，只发送 m2m_changed
+        if not sender._meta.auto_created:
+            post_save.connect(invalidate, sender=sender, dispatch_uid='website.rowcache')
+            post_delete.connect(invalidate, sender=sender, dispatch_uid='website.rowcache')
+        m2m_changed.connect(invalidate, sender=sender, dispatch_uid='website.rowcache')
+
+
+def invalidate(sender, instance=None, **kwargs):
+    bump(sender)
+    if instance is not None and instance.__class__ is not sender:
+        # m2m_changed 的 sender 是中间表
+        bump(instance.__class__)
+        model = kwargs.get('model')
+        if model is not None:
+            bump(model)
+
+
+def permission_fingerprint(user):
+    if not user.is_active:
+        return 'inactive'
+    if user.is_superuser:
+        return 'superuser'
+    return hashlib.md5(','.join(sorted(user.get_all_permissions())).encode('utf-8')).hexdigest()
+
+
+def view_key(view):
+    """
+    一个请求中所有行共用的缓存键前缀
+    """
+    params = sorted((k, v) for k, v in view.request.GET.lists()
+                    if k not in ROW_INDEPENDENT_VARS and not k.startswith(FILTER_PREFIX))
+    parts = (view.request.path, get_language(), get_generation(view.model), tuple(view.list_display),
+             tuple(view.list_display_links), view.pop, params, permission_fingerprint(view.user))
+    return 'website:row:%s:%s' % (model_label(view.model), hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+
+def freeze_row(row):
+    """
+    将 makerow 生成的 ListRow 转为可以缓存的数据：单元格的 field、attr 在还原时从列上取得
+    """
+    cells = []
+    index = {}
+    for i, cell in enumerate(row.cells):
+        index[id(cell)] = i
+        data = dict(cell.__dict__)
+        del data['row']
+        field, attr = data.pop('field'), data.pop('attr')
+        data['looked_up'] = field is not None or attr is not None
+        if not isinstance(data['value'], VALUE_TYPES) and data['value'] is not None:
+            data['value'] = smart_str(data['value'])
+        cells.append(data)
+    items = {}
+    for k, v in row.items():
+        if k == 'object':
+            continue
+        items[k] = ('cell', index[id(v)]) if id(v) in index else ('value', v)
+    attrs = dict((k, v) for k, v in row.__dict__.items() if k != 'cells')
+    return cells, items, attrs
+
+
+def thaw_row(view, data, obj):
+    from website.views.views import ListRow, ListCell
+
+    cells, items, attrs = data
+    row = ListRow()
+    row.cells = []
+    for d in cells:
+        cell = ListCell.__new__(ListCell)
+        cell.__dict__.update(d)
+        column = view.get_column(cell.field_name)
+        looked_up = cell.__dict__.pop('looked_up')
+        cell.field = column.field if looked_up else None
+        cell.attr = column.attr if looked_up else None
+        cell.row = row
+        row.cells.append(cell)
+    for k, (kind, v) in items.items():
+        row[k] = row.cells[v] if kind == 'cell' else v
+    row['object'] = obj
+    row.__dict__.update(attrs)
+    return row
+
+
+def cached_rows(view, objs):
+    """
+    按行缓存生成列表的行
+    """
+    enable(view.model)
+    prefix = view_key(view)
+    version = view.list_row_cache_version
+    objs = list(objs)
+    keys = ['%s:%s:%s' % (prefix, obj.pk, smart_str(getattr(obj, version)) if version else '') for obj in objs]
+    cached = cache.get_many(keys)
+    rows, missed = [], {}
+    for key, obj in zip(keys, objs):
+        data = cached.get(key)
+        if data is None:
+            row = view.makerow(obj)
+            missed[key] = freeze_row(row)
+        else:
+            row = thaw_row(view, data, obj)
+        rows.append(row)
+    if missed:
+        cache.set_many(missed, view.list_row_cache_timeout)
+    view.row_cache_hits = len(objs) - len(missed)
+    view.row_cache_misses = len(missed)
+    record(view.model, view.row_cache_hits, view.row_cache_misses)
+    return rows
+
+
+def record(model, hits, misses):
+    for name, n in (('hits', hits), ('misses', misses)):
+        if n:
+            key = 'website:rowstats:%s:%s' % (model_label(model), name)
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, n)
+            except ValueError:
+                cache.set(key, n, None)
+
+
+def stats(model):
+    """
+    模型行缓存的命中情况 ``{'hits': 命中行数, 'misses': 未命中行数, 'ratio': 命中率}``
+    """
+    label = model_label(model)
+    values = cache.get_many(['website:rowstats:%s:hits' % label, 'website:rowstats:%s:misses' % label])
+    hits = values.get('website:rowstats:%s:hits' % label, 0)
+    misses = values.get('website:rowstats:%s:misses' % label, 0)
+    return {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else 0.0}
@@ -0,0 +1,541 @@
+"""
+列表搜索后端
+
+FilterPlugin 按模型配置的 ``search_backend`` 处理搜索框的输入（``search_sphinx_ins`` 配置时固定使用 sphinx），
+未配置时使用 ``BASE_SEARCH_BACKEND``：
+
+* ``orm`` 原有方式，每个词在 ``search_fields`` 上 icontains（``^`` ``=`` ``@`` 前缀分别为 istartswith、iexact、search）
+  取或，各词取与，大表上是全表扫描
+* ``sqlite_fts`` SQLite FTS5 虚拟表，按词前缀匹配，bm25 排名
+* ``postgres`` tsvector 表加 GIN 索引，按词前缀匹配，ts_rank 排名，``search_fields`` 按顺序取 A、B、C、D 权重
+* ``memory`` 进程内的倒排索引，适合几千行以内的小表，词内子串匹配，模型变动后重建
+* ``sphinx`` 原 ``search_sphinx_ins`` 的方式，最多取 500 个结果
+
+``sqlite_fts``、``postgres`` 的索引表 ``website_search_<表名>`` 由 ``manage.py searchindex`` 建立，之后模型及
+``search_fields`` 路径上的关联模型保存、删除时同步；不经过信号的修改（``queryset.update()``、多对多的变动）需要重新
+执行 searchindex。支持排名的后端在用户没有指定排序时按相关度排序（``search_order_by_rank = False`` 关闭）。
+
+其他后端继承 :class:`SearchBackend` 并用 :func:`register` 注册，``search_backend`` 也可以直接配置为类。
+"""
+import operator
+import re
+import threading
+from functools import reduce
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, router
+from django.db.models import Case, When, Value, FloatField
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import smart_str
+
+from website.views.configs import SEARCH_BACKEND, SEARCH_INDEX_BATCH
+from website.views.filters import choices_cache
+from website.views.utils import get_fields_from_path, semijoin
+
+RANK_NAME = '_search_rank'
+
+_words = re.compile(r'\w+', re.UNICODE)
+
+backends = {}  # 后端名称: 后端类
+_instances = {}  # 每个模型及配置共用的后端实例
+_lock = threading.Lock()
+
+
+def register(backend_class):
+    backends[backend_class.name] = backend_class
+    return backend_class
+
+
+def get_backend(model, backend=None, search_fields=(), options=None):
+    """
+    模型配置对应的后端实例，相同的配置共用一个实例
+    """
+    backend = backend or SEARCH_BACKEND
+    if isinstance(backend, str):
+        if backend not in backends:
+            raise ImproperlyConfigured('Unknown search backend "%s", choices are: %s'
+                                       % (backend, ', '.join(sorted(backends))))
+        backend = backends[backend]
+    options = options or {}
+    key = (model, backend, tuple(str(f) for f in search_fields), repr(sorted(options.items())))
+    instance = _instances.get(key)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = _instances[key] = backend(model, search_fields, **options)
+    return instance
+
+
+def enable(model, config):
+    """
+    注册模型配置时调用：建立后端实例并连接索引同步的信号
+    """
+    if not getattr(config, 'search_fields', None) or getattr(config, 'search_sphinx_ins', None):
+        return
+    backend = get_backend(model, getattr(config, 'search_backend', None), config.search_fields,
+                          getattr(config, 'search_backend_options', None))
+    backend.watch()
+
+
+def indexes():
+    """
+    需要建立索引的后端实例
+    """
+    return [b for b in list(_instances.values()) if b.indexed]
+
+
+class InSubquery(RawSQL):
+    """
+    作为 ``pk__in`` 参数的 SQL 子查询，RawSQL 自带的括号会使 IN 两边各一层括号，变成只取第一行的标量子查询
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def field_path(search_field):
+    return search_field.lstrip('^=@')
+
+
+def related_model(model, path):
+    return get_fields_from_path(model, path)[-1].related_model
+
+
+def words(text):
+    return _words.findall(smart_str(text).lower())
+
+
+def field_text(obj, path):
+    """
+    对象在搜索字段路径上的文本，多对多、反向关联的多个值以空格连接
+    """
+    values = [obj]
+    for name in path.split(LOOKUP_SEP):
+        found = []
+        for value in values:
+            value = getattr(value, name, None)
+            if isinstance(value, models.Manager):
+                found.extend(value.all())
+            elif value is not None:
+                found.append(value)
+        values = found
+    return ' '.join(smart_str(v) for v in values)
+
+
+class SearchBackend(object):
+    """
+    搜索后端：把搜索词转为 queryset 的过滤条件，支持排名的给出相关度表达式
+    """
+    name = None
+    ranked = False  # 是否支持按相关度排序
+    indexed = False  # 是否需要由 searchindex 建立索引
+
+    def __init__(self, model, search_fields, **options):
+        self.model = model
+        self.search_fields = [str(f) for f in search_fields]
+        self.paths = [field_path(f) for f in self.search_fields]
+        self.options = options
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.model._meta.label)
+
+    def get_conditions(self, query):
+        """
+        搜索条件 [Q, ...]，依次 filter 到列表的 queryset 上
+        """
+        raise NotImplementedError
+
+    def needs_distinct(self):
+        """
+        搜索条件是否会使对象重复，需要 distinct
+        """
+        return False
+
+    def rank(self, query):
+        """
+        相关度表达式，越大越相关，不支持时为 None
+        """
+        return None
+
+    def search(self, query):
+        """
+        (搜索条件, 相关度表达式)
+        """
+        return self.get_conditions(query), self.rank(query) if self.ranked else None
+
+    def watch(self):
+        pass
+
+
+@register
+class ORMSearchBackend(SearchBackend):
+    name = 'orm'
+
+    def lookups(self):
+        lookups = []
+        for f in self.search_fields:
+            if f.startswith('^'):
+                lookups.append("%s__istartswith" % f[1:])
+            elif f.startswith('='):
+                lookups.append("%s__iexact" % f[1:])
+            elif f.startswith('@'):
+                lookups.append("%s__search" % f[1:])
+            else:
+                lookups.append("%s__icontains" % f)
+        return lookups
+
+    def get_conditions(self, query):
+        lookups = self.lookups()
+        return [semijoin(self.model, reduce(operator.or_, [models.Q(**{lookup: bit}) for lookup in lookups]))
+                for bit in query.split()]
+
+
+class IndexedSearchBackend(SearchBackend):
+    """
+    索引存放在数据库表 ``website_search_<表名>`` 中的后端，行与模型对象按主键对应。索引表建立之前按 orm 方式搜索，
+    也不同步
+    """
+    indexed = True
+    vendor = None  # 支持的数据库
+    key_column = None  # 索引表中对象主键的列
+
+    def __init__(self, model, search_fields, **options):
+        super(IndexedSearchBackend, self).__init__(model, search_fields, **options)
+        self.table = 'website_search_%s' % model._meta.db_table
+        self.fallback = ORMSearchBackend(model, search_fields)
+        self._ready = False
+
+    def ready(self):
+        """
+        索引表是否已经建立
+        """
+        if not self._ready:
+            self._ready = self.table in self.connection.introspection.table_names()
+        return self._ready
+
+    def search(self, query):
+        if not self.ready():
+            return self.fallback.search(query)
+        return super(IndexedSearchBackend, self).search(query)
+
+    @property
+    def connection(self):
+        connection = connections[router.db_for_write(self.model)]
+        if connection.vendor != self.vendor:
+            raise ImproperlyConfigured('Search backend "%s" needs a %s database, %s uses %s'
+                                       % (self.name, self.vendor, self.model._meta.label, connection.vendor))
+        return connection
+
+    def qn(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def pk_column(self):
+        opts = self.model._meta
+        return '%s.%s' % (self.qn(opts.db_table), self.qn(opts.pk.column))
+
+    def documents(self, objs):
+        return [(obj.pk, [field_text(obj, path) for path in self.paths]) for obj in objs]
+
+    def create(self, cursor):
+        raise NotImplementedError
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS %s' % self.qn(self.table))
+        self._ready = False
+
+    def write(self, cursor, documents):
+        """
+        写入（替换）[(主键, [字段文本, ...]), ...]
+        """
+        raise NotImplementedError
+
+    def remove(self, pks):
+        if pks and self.ready():
+            with self.connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                    self.qn(self.table), self.qn(self.key_column), ', '.join(['%s'] * len(pks))), list(pks))
+
+    def update(self, objs):
+        objs = list(objs)
+        if objs and self.ready():
+            with self.connection.cursor() as cursor:
+                self.write(cursor, self.documents(objs))
+
+    def sync(self, rebuild=False, batch_size=SEARCH_INDEX_BATCH):
+        """
+        建立索引表并写入全部对象，删除已不存在的对象，rebuild 时先删除索引表。返回写入的对象数
+        """
+        with self.connection.cursor() as cursor:
+            if rebuild:
+                self.drop(cursor)
+            self.create(cursor)
+        self._ready = True
+        prefetch = set(path.rsplit(LOOKUP_SEP, 1)[0] for path in self.paths if LOOKUP_SEP in path)
+        queryset = self.model._default_manager.order_by('pk').prefetch_related(*prefetch)
+        count, last = 0, None
+        while True:
+            objs = list((queryset if last is None else queryset.filter(pk__gt=last))[:batch_size])
+            if not objs:
+                break
+            self.update(objs)
+            count += len(objs)
+            last = objs[-1].pk
+        if not rebuild:
+            opts = self.model._meta
+            with self.connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s WHERE %s NOT IN (SELECT %s FROM %s)' % (
+                    self.qn(self.table), self.qn(self.key_column), self.qn(opts.pk.column), self.qn(opts.db_table)))
+        return count
+
+    def watch(self):
+        """
+        模型保存、删除时更新索引；search_fields 路径上的关联模型保存时更新引用它的对象
+        """
+        self.connection  # 数据库不支持时在注册模型配置时报错
+        uid = 'website.search.%s' % self.table
+        post_save.connect(self.on_save, sender=self.model, dispatch_uid=uid)
+        post_delete.connect(self.on_delete, sender=self.model, dispatch_uid=uid)
+        for path in self.paths:
+            if LOOKUP_SEP not in path:
+                continue
+            related = related_model(self.model, path.rsplit(LOOKUP_SEP, 1)[0])
+            if related is not self.model:
+                post_save.connect(self.on_related_save, sender=related,
+                                  dispatch_uid='%s.%s' % (uid, related._meta.label_lower))
+
+    def on_save(self, sender, instance, raw=False, **kwargs):
+        if not raw:
+            self.update([instance])
+
+    def on_delete(self, sender, instance, **kwargs):
+        self.remove([instance.pk])
+
+    def on_related_save(self, sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        lookups = [path.rsplit(LOOKUP_SEP, 1)[0] for path in self.paths if LOOKUP_SEP in path]
+        q = reduce(operator.or_, [models.Q(**{lookup: instance.pk}) for lookup in lookups
+                                  if related_model(self.model, lookup) is sender])
+        self.update(self.model._default_manager.filter(q).distinct())
+
+
+@register
+class SQLiteFTSSearchBackend(IndexedSearchBackend):
+    """
+    SQLite FTS5，rowid 为对象主键（要求整数主键），每个搜索字段一列
+    """
+    name = 'sqlite_fts'
+    vendor = 'sqlite'
+    ranked = True
+    key_column = 'rowid'
+
+    def columns(self):
+        return ['f%d' % i for i in range(len(self.paths))]
+
+    def create(self, cursor):
+        if not isinstance(self.model._meta.pk, (models.AutoField, models.IntegerField)):
+            raise ImproperlyConfigured('Search backend "sqlite_fts" needs an integer primary key on %s'
+                                       % self.model._meta.label)
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize='%s')" % (
+            self.qn(self.table), ', '.join(self.columns()), self.options.get('tokenize', 'unicode61')))
+
+    def write(self, cursor, documents):
+        table = self.qn(self.table)
+        cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % table, [(pk,) for pk, texts in documents])
+        cursor.executemany('INSERT INTO %s (rowid, %s) VALUES (%s)' % (
+            table, ', '.join(self.columns()), ', '.join(['%s'] * (len(self.paths) + 1))),
+                           [[pk] + texts for pk, texts in documents])
+
+    def match(self, query):
+        """
+        FTS5 查询：每个词作为前缀，各词取与
+        """
+        return ' '.join('"%s"*' % bit.replace('"', '""') for bit in query.split())
+
+    def get_conditions(self, query):
+        table = self.qn(self.table)
+        return [models.Q(pk__in=InSubquery('SELECT rowid FROM %s WHERE %s MATCH %%s' % (table, table),
+                                       [self.match(query)]))]
+
+    def rank(self, query):
+        table = self.qn(self.table)
+        weights = ''.join(', %s' % float(w) for w in self.options.get('weights', ()))
+        return RawSQL('SELECT -bm25(%s%s) FROM %s WHERE %s MATCH %%s AND rowid = %s' % (
+            table, weights, table, table, self.pk_column()), [self.match(query)], output_field=FloatField())
+
+
+@register
+class PostgresSearchBackend(IndexedSearchBackend):
+    """
+    PostgreSQL tsvector 表，GIN 索引，``config`` 选项为文本搜索配置（默认 simple）
+    """
+    name = 'postgres'
+    vendor = 'postgresql'
+    ranked = True
+    key_column = 'object_id'
+
+    @property
+    def config(self):
+        return self.options.get('config', 'simple')
+
+    def create(self, cursor):
+        table = self.qn(self.table)
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s (object_id %s PRIMARY KEY, document tsvector NOT NULL)' % (
+            table, self.model._meta.pk.rel_db_type(self.connection)))
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s USING GIN (document)' % (
+            self.qn('%s_document' % self.table), table))
+
+    def write(self, cursor, documents):
+        vector = ' || '.join("setweight(to_tsvector(%%s::regconfig, %%s), '%s')" % 'ABCD'[min(i, 3)]
+                             for i in range(len(self.paths)))
+        params = []
+        for pk, texts in documents:
+            params.append([pk] + [p for text in texts for p in (self.config, text)])
+        cursor.executemany('INSERT INTO %s (object_id, document) VALUES (%%s, %s) '
+                           'ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document'
+                           % (self.qn(self.table), vector), params)
+
+    def tsquery(self, query):
+        """
+        每个词作为前缀，各词取与，没有词时为 None
+        """
+        return ' & '.join('%s:*' % w for w in words(query)) or None
+
+    def get_conditions(self, query):
+        tsquery = self.tsquery(query)
+        if tsquery is None:
+            return [models.Q(pk__in=[])]
+        return [models.Q(pk__in=InSubquery('SELECT object_id FROM %s WHERE document @@ to_tsquery(%%s::regconfig, %%s)'
+                                       % self.qn(self.table), [self.config, tsquery]))]
+
+    def rank(self, query):
+        tsquery = self.tsquery(query)
+        if tsquery is None:
+            return None
+        return RawSQL('SELECT ts_rank(document, to_tsquery(%%s::regconfig, %%s)) FROM %s WHERE object_id = %s' % (
+            self.qn(self.table), self.pk_column()), [self.config, tsquery], output_field=FloatField())
+
+
+@register
+class MemorySearchBackend(SearchBackend):
+    """
+    进程内的倒排索引 {词: {主键: 次数}}，模型的版本号（见 :data:`website.views.filters.choices_cache`）变化时重建。
+    对象超过 ``max_rows`` （默认 5000）时不建索引，按 orm 方式搜索
+    """
+    name = 'memory'
+    ranked = True
+
+    def __init__(self, model, search_fields, **options):
+        super(MemorySearchBackend, self).__init__(model, search_fields, **options)
+        self.max_rows = options.get('max_rows', 5000)
+        self.fallback = ORMSearchBackend(model, search_fields)
+        self._index = None  # (版本号, 倒排索引)
+
+    def watch(self):
+        choices_cache.watch(self.model)
+        for path in self.paths:
+            for model in choices_cache.path_models(self.model, path):
+                choices_cache.watch(model)
+
+    def version(self):
+        if not choices_cache.alias:
+            # 没有版本号，每次重建
+            return object()
+        return tuple(choices_cache.get_version(m) for path in self.paths
+                     for m in choices_cache.path_models(self.model, path))
+
+    def index(self):
+        version = self.version()
+        current = self._index
+        if current is not None and current[0] == version:
+            return current[1]
+        rows = list(self.model._default_manager.order_by().values_list('pk', *self.paths)[:self.max_rows + 1])
+        if len(set(row[0] for row in rows)) > self.max_rows:
+            index = None
+        else:
+            index = {}
+            for row in rows:
+                for value in row[1:]:
+                    if value is not None:
+                        for word in words(value):
+                            postings = index.setdefault(word, {})
+                            postings[row[0]] = postings.get(row[0], 0) + 1
+        self._index = (version, index)
+        return index
+
+    def scores(self, index, query):
+        """
+        {主键: 得分}：查询中的每个词都要是某个索引词的子串，完整匹配的词得分加倍
+        """
+        result = None
+        for term in words(query):
+            matched = {}
+            for word, postings in index.items():
+                if term in word:
+                    weight = 2 if word == term else 1
+                    for pk, n in postings.items():
+                        matched[pk] = matched.get(pk, 0) + n * weight
+            if result is None:
+                result = matched
+            else:
+                result = dict((pk, score + matched[pk]) for pk, score in result.items() if pk in matched)
+        return result or {}
+
+    def get_conditions(self, query):
+        return self.search(query)[0]
+
+    def rank(self, query):
+        return self.search(query)[1]
+
+    def search(self, query):
+        index = self.index()
+        if index is None:
+            return self.fallback.search(query)
+        scores = self.scores(index, query)
+        rank = Case(*[When(pk=pk, then=Value(float(score))) for pk, score in scores.items()],
+                    default=Value(0.0), output_field=FloatField()) if scores else None
+        return [models.Q(pk__in=sorted(scores))], rank
+
+
+@register
+class SphinxSearchBackend(SearchBackend):
+    """
+    ``search_sphinx_ins`` 配置的 sphinx 索引，``index`` 选项为 sphinx 的查询集，最多取 ``limit`` （默认 500）个结果
+    """
+    name = 'sphinx'
+    ranked = True
+
+    def __init__(self, model, search_fields, index=None, limit=500, **options):
+        super(SphinxSearchBackend, self).__init__(model, search_fields, **options)
+        self.index = index
+        self.limit = limit
+
+    def ids(self, query):
+        """
+        按相关度排列的主键
+        """
+        query_set = self.index.query(query)
+        query_set.set_options(mode='SPH_MATCH_EXTENDED2')
+        query_set.set_options(rankmode='SPH_SORT_RELEVANCE')
+        query_set.order_by('-@weight', '-@id')
+        query_set._maxmatches = self.limit
+        query_set._limit = self.limit
+        ids = [r['id'] for r in query_set._get_sphinx_results()['matches'][:self.limit]]
+        if query.isdigit():
+            ids.append(int(query))
+        return ids
+
+    def get_conditions(self, query):
+        return self.search(query)[0]
+
+    def rank(self, query):
+        return self.search(query)[1]
+
+    def search(self, query):
+        ids = self.ids(query)
+        rank = Case(*[When(pk=pk, then=Value(float(len(ids) - i))) for i, pk in enumerate(ids)],
+                    default=Value(0.0), output_field=FloatField()) if ids else None
+        return [models.Q(pk__in=ids)], rank
@@ -0,0 +1,99 @@
+"""
+用户设置的读取
+
+:func:`get_settings` 返回请求用户的 :class:`UserSettings`，同一请求内只创建一次。用户的全部 ``UserSetting``
+一次查询载入，并以 ``website:usersettings:<用户 id>`` 缓存 ``BASE_USER_SETTINGS_TIMEOUT`` 秒；``UserSetting``
+post_save、post_delete 及 :meth:`UserSettings.set` 在事务提交后删除该用户的缓存，下次读取时重新载入。不经过信号的
+修改（如 ``queryset.update()``）在缓存过期后生效，或通过 :meth:`UserSettings.set` 写入。
+"""
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from website.models import UserSetting
+from website.views.configs import USER_SETTINGS_TIMEOUT
+
+REQUEST_ATTR = '_website_user_settings'
+
+
+def cache_key(user_id):
+    return 'website:usersettings:%s' % user_id
+
+
+class UserSettings(object):
+    """
+    某用户的全部设置 {键: 值}，json 值只解析一次
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._values = None
+        self._json = {}
+
+    @property
+    def values(self):
+        if self._values is None:
+            if not self.user or self.user.pk is None:
+                self._values = {}
+            else:
+                self._values = cache.get(cache_key(self.user.pk))
+                if self._values is None:
+                    self._values = dict(UserSetting.objects.filter(user_id=self.user.pk).order_by('pk')
+                                        .values_list('key', 'value'))
+                    cache.set(cache_key(self.user.pk), self._values, USER_SETTINGS_TIMEOUT)
+        return self._values
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def json(self, key, default=None):
+        """
+        json 格式的设置值，没有该设置或格式错误时返回 default
+        """
+        if key not in self._json:
+            try:
+                self._json[key] = json.loads(self.values[key])
+            except (KeyError, TypeError, ValueError):
+                return default
+        return self._json[key]
+
+    def set(self, key, value):
+        """
+        保存设置，同一键有多条记录时全部更新
+        """
+        if not UserSetting.objects.filter(user_id=self.user.pk, key=key).update(value=value):
+            UserSetting.objects.create(user_id=self.user.pk, key=key, value=value)
+        self.values[key] = value
+        self._json.pop(key, None)
+        invalidate(self.user.pk)
+
+
+def get_settings(request):
+    """
+    请求用户的设置，同一请求内共用
+    """
+    settings = getattr(request, REQUEST_ATTR, None)
+    if settings is None:
+        settings = UserSettings(getattr(request, 'user', None))
+        setattr(request, REQUEST_ATTR, settings)
+    return settings
+
+
+def invalidate(user_id):
+    """
+    事务提交后删除用户设置的缓存：回滚的修改不会进入缓存，并发的修改也不会互相覆盖
+    """
+    transaction.on_commit(lambda: cache.delete(cache_key(user_id)))
+
+
+def _changed(sender, instance, **kwargs):
+    invalidate(instance.user_id)
+
+
+post_save.connect(_changed, sender=UserSetting, dispatch_uid='website.usersettings')
+post_delete.connect(_changed, sender=UserSetting, dispatch_uid='website.usersettings')
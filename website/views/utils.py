@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
+import base64
 import calendar
 import datetime
 import decimal
+import json
+import uuid
 
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.urls import reverse
-from django.db import models
+from django.db import models, connections
 from django.db.models.deletion import Collector
 from django.db.models.sql.query import LOOKUP_SEP
 from django.forms import Media
@@ -124,6 +127,44 @@ def lookup_needs_distinct(opts, lookup_path):
     return False
 
 
+def lookup_is_multivalued(model, lookup):
+    """
+    查询路径是否经过多对多或反向外键，这样的条件直接 filter 时一个对象可能对应多行
+    """
+    for name in lookup.split(LOOKUP_SEP):
+        try:
+            field = model._meta.get_field(name)
+        except models.FieldDoesNotExist:
+            # 查询类型（exact、in 等）或 pk
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        if not field.is_relation or field.related_model is None:
+            return False
+        model = field.related_model
+    return False
+
+
+def q_lookups(q):
+    for child in q.children:
+        if isinstance(child, models.Q):
+            for lookup in q_lookups(child):
+                yield lookup
+        else:
+            yield child[0]
+
+
+def semijoin(model, *args, **kwargs):
+    """
+    过滤条件 Q：经过多值关联时改写为 ``pk__in`` 子查询（半连接），结果中的对象不会重复，不需要 distinct。
+    同一次调用中的条件作用于同一个关联对象，与在一次 filter() 中相同
+    """
+    q = models.Q(*args, **kwargs)
+    if any(lookup_is_multivalued(model, lookup) for lookup in q_lookups(q)):
+        return models.Q(pk__in=model._base_manager.filter(q).values('pk'))
+    return q
+
+
 def prepare_lookup_value(key, value):
     """
     Returns a lookup value prepared to be used in queryset filtering.
@@ -454,6 +495,33 @@ def display_for_field(value, field):
         return smart_str(value)
 
 
+def display_func_for_field(field):
+    """
+    返回与 ``display_for_field(value, field)`` 结果相同的单参数函数，字段类型只判断一次，
+    供列表页按列渲染时逐行调用
+    """
+    from website.views.configs import EMPTY_CHANGELIST_VALUE
+
+    if field.flatchoices:
+        choices = dict(field.flatchoices)
+        return lambda value: choices.get(value, EMPTY_CHANGELIST_VALUE)
+    elif isinstance(field, models.BooleanField) or isinstance(field, models.NullBooleanField):
+        return boolean_icon
+    elif isinstance(field, models.DateTimeField):
+        func = lambda value: formats.localize(tz_localtime(value))
+    elif isinstance(field, (models.DateField, models.TimeField)):
+        func = formats.localize
+    elif isinstance(field, models.DecimalField):
+        func = lambda value: formats.number_format(value, field.decimal_places)
+    elif isinstance(field, models.FloatField):
+        func = formats.number_format
+    elif isinstance(field.remote_field, models.ManyToManyRel):
+        func = lambda value: ', '.join([smart_str(obj) for obj in value.all()])
+    else:
+        func = smart_str
+    return lambda value: EMPTY_CHANGELIST_VALUE if value is None else func(value)
+
+
 def display_for_value(value, boolean=False):
     from website.views.configs import EMPTY_CHANGELIST_VALUE
 
@@ -499,19 +567,16 @@ def reverse_field_path(model, path):
     parent = model
     pieces = path.split(LOOKUP_SEP)
     for piece in pieces:
-        field, model, direct, m2m = parent._meta.get_field_by_name(piece)
+        field = parent._meta.get_field_by_name(piece)[0]
         # skip trailing data field if extant:
-        if len(reversed_path) == len(pieces) - 1:  # final iteration
-            try:
-                get_model_from_relation(field)
-            except NotRelationField:
-                break
-        if direct:
+        if len(reversed_path) == len(pieces) - 1 and not field.is_relation:  # final iteration
+            break
+        if not (field.auto_created and not field.concrete):
             related_name = field.related_query_name()
             parent = field.remote_field.model
         else:
             related_name = field.field.name
-            parent = field.model
+            parent = field.related_model
         reversed_path.insert(0, related_name)
     return (parent, LOOKUP_SEP.join(reversed_path))
 
@@ -565,6 +630,130 @@ def get_limit_choices_to_from_path(model, path):
         return models.Q(**limit_choices_to)  # convert dict to Q
 
 
+def get_keyset_columns(model, ordering):
+    """
+    keyset（游标）分页的排序列
+
+    将 queryset 的排序解析为 [(查询路径, 是否倒序, 模型字段), ...]，末尾保证有主键作为唯一排序；
+    关联字段使用其 attname（如 author_id），排序中含表达式、随机排序、多值关联或可以为 NULL 的列（包括经过可以为空
+    的关联）时返回 None，使用页码分页
+    """
+    opts = model._meta
+    columns = []
+    for o in ordering:
+        if not isinstance(o, str) or o == '?':
+            return None
+        desc = o.startswith('-')
+        path = o.lstrip('-')
+        if path == 'pk':
+            path = opts.pk.name
+        try:
+            fields = get_fields_from_path(model, path)
+        except (models.FieldDoesNotExist, NotRelationField, AttributeError):
+            return None
+        if any(f.many_to_many or f.one_to_many or getattr(f, 'null', False) for f in fields):
+            return None
+        field = fields[-1]
+        if field.is_relation:
+            path = LOOKUP_SEP.join(path.split(LOOKUP_SEP)[:-1] + [field.attname])
+        columns.append((path, desc, field))
+        if len(fields) == 1 and field.primary_key:
+            # 主键之后的排序列不再影响顺序
+            return columns
+    columns.append((opts.pk.attname, False, opts.pk))
+    return columns
+
+
+def get_keyset_values(obj, columns):
+    """
+    取得对象在各排序列上的值
+    """
+    values = []
+    for path, desc, field in columns:
+        value = obj
+        for piece in path.split(LOOKUP_SEP):
+            value = getattr(value, piece, None) if value is not None else None
+        values.append(value)
+    return values
+
+
+def keyset_predicate(columns, values, reverse=False):
+    """
+    生成定位到游标之后（reverse 时为之前）的查询条件：
+    (c1 > v1) | (c1 = v1 & c2 > v2) | ...，倒序列使用 lt
+
+    排序列不会为 NULL（见 get_keyset_columns）。values 与 columns 个数不同或含有 NULL（游标被改过）时抛出 ValueError
+    """
+    if len(values) != len(columns):
+        raise ValueError('Cursor has %d values, ordering has %d columns' % (len(values), len(columns)))
+    q = None
+    equal = {}
+    for (path, desc, field), value in zip(columns, values):
+        value = field.to_python(value)
+        if value is None:
+            raise ValueError('Cursor value for %s is null' % path)
+        cond = models.Q(**equal) & models.Q(**{'%s__%s' % (path, 'lt' if desc != reverse else 'gt'): value})
+        q = cond if q is None else q | cond
+        equal[path] = value
+    return q
+
+
+def estimate_count(queryset):
+    """
+    使用数据库的统计信息估算 queryset 的行数，无法估算时返回 None
+
+    PostgreSQL：没有过滤条件时读取 pg_class.reltuples，否则使用 EXPLAIN 的 Plan Rows；
+    其他数据库（如 SQLite）不支持估算
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    queryset = queryset.order_by()
+    with connection.cursor() as cursor:
+        if not queryset.query.where and not queryset.query.distinct:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return int(row[0])
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, reverse=False):
+    """
+    将排序列的值编码为 url 中使用的游标，reverse 表示向前翻页
+    """
+    data = json.dumps([[_cursor_value(v) for v in values], int(reverse)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解码游标，返回 (values, reverse)，游标非法时抛出 ValueError
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values, reverse = json.loads(data.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor %r' % cursor)
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor %r' % cursor)
+    return values, bool(reverse)
+
+
 def sortkeypicker(keynames):
     negate = set()
     for i, k in enumerate(keynames):
@@ -1,5 +1,6 @@
 import copy
 import functools
+import hashlib
 import inspect
 import json
 import pickle
@@ -20,23 +21,27 @@ from django.contrib.auth.tokens import default_token_generator
 from website import models
 from website.tools.storage import NoFileStorageConfigured, get_storage
 from website.tools.types import SortedDict
-from website.views import widgets, configs
+from website.views import widgets, configs, querylog, rowcache, charts, filters, dashboard, usersettings, \
+    navmenu, permissions
 from website.views.forms import AdminAuthenticationForm, componentmanager, WidgetDataError, ManagementForm
-from website.models import UserSetting, Viewmark
+from website.models import UserSetting, Viewmark, ExportJob
 from website.views.fields import FakeMethodField, ShowField, ResultField, replace_field_to_value, \
     ReadOnlyField, DeleteField, Fieldset, PermissionModelMultipleChoiceField
 from website.views.fieldsets import Row, Col, Main, Side, Container
 from website.views.configs import EMPTY_CHANGELIST_VALUE, SEARCH_VAR, \
     TO_FIELD_VAR, ACTION_CHECKBOX_NAME, ALL_VAR, ORDER_VAR, PAGE_VAR, COL_LIST_VAR, ERROR_FLAG, ROOT_PATH_NAME, \
-    BATCH_CHECKBOX_NAME, DOT, ACTION_NAME
+    BATCH_CHECKBOX_NAME, DOT, ACTION_NAME, CURSOR_VAR, COUNT_ESTIMATE_MIN, QUERY_PROFILE, \
+    CHART_MAX_POINTS, RESULT_CACHE_TIMEOUT, DASHBOARD_WIDGET_RENDER, DASHBOARD_WIDGET_TIMEOUT
 from website.tools import dutils
 from website.tools.dutils import JsonErrorDict, JSONEncoder
 from website.views.utils import model_ngettext, get_deleted_objects, unquote, label_for_field, lookup_field, \
-    boolean_icon, display_for_field, vendor, User, csrf_protect_m, JSONEncoder
+    boolean_icon, display_for_field, display_func_for_field, vendor, User, csrf_protect_m, JSONEncoder, get_keyset_columns, \
+    get_keyset_values, keyset_predicate, encode_cursor, decode_cursor, estimate_count
 from website.views.widgets import ChangeFieldWidgetWrapper, WidgetTypeSelect
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.paginator import Paginator, Page, InvalidPage
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.forms import modelform_factory, formsets, BaseInlineFormSet, inlineformset_factory, HiddenInput
 from django.forms.forms import DeclarativeFieldsMetaclass
 from django.forms.formsets import DELETION_FIELD_NAME
@@ -57,8 +62,8 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Column
 from django.conf import settings
 from django.core.exceptions import PermissionDenied, ValidationError, ObjectDoesNotExist
-from django.db import router, models
-from django.http import HttpResponse, HttpResponseRedirect, Http404, HttpResponseNotFound
+from django.db import router, models, transaction
+from django.http import HttpResponse, HttpResponseRedirect, Http404, HttpResponseNotFound, FileResponse
 from django.template.response import TemplateResponse, SimpleTemplateResponse
 from django.utils.decorators import classonlymethod, method_decorator
 from django.utils.encoding import force_str, force_text, smart_str
@@ -127,8 +132,75 @@ def execfunchain(pluginfuns, lenth, fun, *args, **kwargs):
         return execfunchain(pluginfuns, lenth - 1, execfun, *args, **kwargs)
 
 
+"""
+插件方法的三种形式，在视图类创建时（ViewMeta）一次性判定，调用时不再做 inspect
+"""
+PLUGIN_NOARG = 0  # def fun(self)          先执行视图方法，且视图方法必须没有返回值
+PLUGIN_PASS = 1  # def fun(self, __, ...)  视图方法作为 __ 传入，由插件决定何时执行
+PLUGIN_VALUE = 2  # def fun(self, v, ...)  视图方法的结果作为第一个参数传入
+
+
+def pluginkind(pf):
+    """
+    判定插件方法的形式，返回 PLUGIN_NOARG、PLUGIN_PASS 或 PLUGIN_VALUE
+    """
+    fargs = inspect.getfullargspec(pf)[0]
+    if len(fargs) == 1:
+        return PLUGIN_NOARG
+    return PLUGIN_PASS if fargs[1] == '__' else PLUGIN_VALUE
+
+
+def compilefunchain(pluginclasses, name):
+    """
+    编译一个钩子的插件函数链：取出含有同名方法的插件类，按 priority 排序并判定形式
+
+    返回 ((插件类, priority, 形式), ...)，排序稳定，同 priority 时保持插件注册顺序
+    """
+    chain = []
+    for a in pluginclasses:
+        pn = getattr(a, name, None)
+        if callable(pn):
+            chain.append((a, getattr(pn, 'priority', 10), pluginkind(pn)))
+    return tuple(sorted(chain, key=lambda x: x[1]))
+
+
+def bindfunchain(chain, plugins, name):
+    """
+    将编译好的函数链绑定到当前请求中生效的插件实例上，返回 [(绑定方法, 形式), ...]
+    """
+    instances = {}
+    for a in plugins:
+        instances.setdefault(a.__class__, []).append(a)
+    return [(getattr(a, name), kind) for c, pr, kind in chain for a in instances.get(c, ())]
+
+
+def runfunchain(boundchain, fun, *args, **kwargs):
+    """
+    执行绑定好的函数链，语义与 :func:`execfunchain` 相同：排在最后的插件最先接收视图方法的结果
+    """
+
+    def link(pf, kind, fun):
+        if kind == PLUGIN_NOARG:
+            def execfun():
+                if fun() is None:
+                    return pf()
+                raise IncorrectPluginArg('ViewPlugin filter method need a arg to receive parent method result.')
+        elif kind == PLUGIN_PASS:
+            def execfun():
+                return pf(fun, *args, **kwargs)
+        else:
+            def execfun():
+                return pf(fun(), *args, **kwargs)
+        return execfun
+
+    for pf, kind in reversed(boundchain):
+        fun = link(pf, kind, fun)
+    return fun()
+
+
 def pluginhook(fun):
     fun.__doc__ = "``filter_hook``\n\n" + (fun.__doc__ or "")
+    name = fun.__name__
 
     @functools.wraps(fun)
     def filter(self, *args, **kwargs):
@@ -136,19 +208,25 @@ def pluginhook(fun):
         def cf():
             return fun(self, *args, **kwargs)
 
+        pns = None
         if self.plugins:
-            plugin = []
-            for a in self.plugins:
-                pn = getattr(a, fun.__name__, None)
-                if callable(pn):
-                    pr = getattr(pn, 'priority', 10)
-                    plugin.append((pr, pn))
-
-            pns = [pn for pr, pn in sorted(plugin, key=lambda x: x[0])]
-            return execfunchain(pns, len(pns) - 1, cf, *args, **kwargs)
-        else:
-            return cf()
-
+            # 绑定结果按实例缓存，self.plugins 被替换（如 init_plugin 过滤后）时重新绑定
+            bound = self.__dict__.get('_hookchains')
+            if bound is None or bound[0] is not self.plugins:
+                bound = self._hookchains = (self.plugins, {})
+            pns = bound[1].get(name)
+            if pns is None:
+                chain = self.pluginhooks.get(name)
+                if chain is None:
+                    chain = compilefunchain(self.pluginclasses, name)
+                pns = bound[1][name] = bindfunchain(chain, self.plugins, name)
+        if querylog.active:
+            profile = querylog.current()
+            if profile is not None:
+                cf, pns = profile.wrap_hook(name, cf, pns)
+        return runfunchain(pns, cf, *args, **kwargs) if pns else cf()
+
+    filter.pluginhook = True
     return filter
 
 
@@ -177,12 +255,19 @@ class ViewUtilMixin:
     def get_model_perm(self, model, name):
         return '%s.%s_%s' % (model._meta.app_label, name, model._meta.model_name)
 
+    def user_has_perm(self, perm, user=None):
+        """
+        用户是否有权限 perm，当前请求的用户从请求内的权限快照读取，见 :mod:`website.views.permissions`
+        """
+        if user is None or user is self.request.user:
+            return permissions.get_snapshot(self.request).has_perm(perm)
+        return user.has_perm(perm)
+
     def has_model_perm(self, model, name, user=None):
         """
         name  为 view、change
         """
-        user = user or self.user
-        return user.has_perm(self.get_model_perm(model, name)) or (
+        return self.user_has_perm(self.get_model_perm(model, name), user) or (
                 name == 'view' and self.has_model_perm(model, 'change', user))
 
     ########################################## HTTP 相关的函数 ##########################################
@@ -336,6 +421,7 @@ class ViewConfigMixin:
     use_related_menu = True  # 列表页 是否显示模型的关联对象菜单，默认是
     menu_icon = 'fa fa-circle-o'
     use_op_menu = True  # 列表页 是否显示查看、修改、删除等操作的链接，默认是
+    show_related_count = False  # 列表页 关联对象菜单是否显示关联对象的数量，在当前页的查询中用子查询计算，默认否
     order = 10  # 菜单排序
     group_order = 10
     menu_group = ''  # 所属菜单组
@@ -353,8 +439,16 @@ class ViewConfigMixin:
     list_exclude = ()  #: 排除显示的列
     list_display_links = ()  #: 链接字段
     list_display_links_details = True  #: 链接到详情页面而非编辑页
-    list_select_related = None  #: 是否提前加载关联数据
+    list_select_related = None  #: 是否提前加载关联数据 True（全部）、None（按显示的列自动规划）、列表（在自动规划之外追加）
+    list_prefetch_related = ()  #: 在自动规划之外追加的 prefetch_related
+    list_defer_wide = True  #: 列表未用到的大字段（TextField、BinaryField）是否延迟加载
+    list_row_cache = False  #: 是否缓存列表生成的行，见 :mod:`website.views.rowcache`
+    list_row_cache_version = None  #: 行缓存键中包含的版本字段，如 'updated_at'
+    list_row_cache_timeout = 300  #: 行缓存的秒数
     list_per_page = 30  #: 每页数
+    pagination = 'page'  #: 分页方式 page（页码分页）、keyset（游标分页，不做 COUNT，适合大表）
+    list_count = 'exact'  #: 结果总数的计数方式 exact（COUNT）、estimate（数据库估算，仅 PostgreSQL）、cache（缓存 COUNT 结果）
+    list_count_timeout = 60  #: list_count 为 cache 时计数结果的缓存秒数
     list_max_show_all = 200  #: 当点“显示全部”每页显示的最大条数
     ordering = None  #: 默认的数据排序
     list_template = None  #: 显示数据的模板 默认为 views/grid.html
@@ -368,6 +462,7 @@ class ViewConfigMixin:
     can_delete_multi = True
     show_viewmarks = True
     aggregate_fields = {}
+    result_cache_timeout = RESULT_CACHE_TIMEOUT  # 图表、汇总行结果缓存的秒数，模型变动时失效，0 时不缓存
     list_editable = []
 
     # @ filter
@@ -376,7 +471,12 @@ class ViewConfigMixin:
     filter_grid_left = False  # 是否开启列表页左侧过滤导航功能，默认为关闭
     filter_list_position: str = ''  # lift、top
     filter_default_list = []  # 指定哪些过滤字段用于左侧导航，必须为 list_filter 的子集，注意 显示在左侧导航的过滤字段不再显示在下拉过滤器中
+    filter_counts = False  # 过滤器选项旁是否显示记录数，见 website.views.facets
+    filter_counts_top = 50  # 关联字段、多选过滤器只统计记录数最多的前几个值
     search_fields = []  # 列表页搜索框可用于模糊匹配的字段
+    search_backend = None  # 搜索后端名称或类，None 时为 BASE_SEARCH_BACKEND，见 website.views.search
+    search_backend_options = {}  # 传给搜索后端的选项
+    search_order_by_rank = True  # 后端支持排名且没有指定排序时按相关度排序
 
     # @ edit
     # relfield_style = 'fk-ajax'  #: 当 Model 是其他 Model 的 ref model 时，其他 Model 在显示本 Model 的字段时使用的 Field Style
@@ -398,6 +498,7 @@ class ViewTemplate(ViewUtilMixin, View):
     base_template = 'website/base.tpl'
     need_login_permission = True
     csrf = True
+    pluginhooks = {}  # 由 ViewMeta 编译的插件函数链 {钩子名: ((插件类, priority, 形式), ...)}
 
     @classonlymethod
     def as_view(cls):
@@ -415,6 +516,8 @@ class ViewTemplate(ViewUtilMixin, View):
 
             return handler(request, *args, **kwargs)
 
+        if QUERY_PROFILE:
+            view = querylog.profile_view(view)
         update_wrapper(view, cls, updated=())
         view.need_login_permission = cls.need_login_permission
         view.login_view = getattr(cls, 'login_view', None)
@@ -435,6 +538,13 @@ class ViewTemplate(ViewUtilMixin, View):
     def init_request(self, *args, **kwargs):
         pass
 
+    def has_pluginhook(self, name):
+        """
+        当前请求生效的插件中是否有实现了钩子 name 的插件
+        """
+        classes = [c for c, pr, kind in self.pluginhooks.get(name, ())]
+        return any(a.__class__ in classes for a in self.plugins)
+
     def init_plugin(self, *args, **kwargs):
         plugins = []
         for a in self.plugins:
@@ -472,42 +582,23 @@ class LayoutViewTemplate(ViewTemplate, ViewConfigMixin):
     perm = None
 
     def _check_menu_permission(self, node):
-        need_perm = getattr(node, 'perm', None)
+        need_perm = node.get('perm')
         if need_perm is None:
             return True
         elif callable(need_perm):
             return need_perm(self.user)
         elif need_perm == 'super':  # perm项如果为 super 说明需要超级用户权限
             return self.user.is_superuser
+        elif isinstance(need_perm, (list, tuple)):  # 有其中任一权限即可
+            return any(self.user_has_perm(p) for p in need_perm)
         else:
-            return self.user.has_perm(need_perm)
+            return self.user_has_perm(need_perm)
 
     def get_nav_menu(self, app_label=None):
-        from website.tools.types import tree
-        if self.website.style_adminlte:
-            app_label = None
-        menu_session_key = app_label and 'nav_menu_%s' % app_label or 'nav_menu'
-        nav_menu = tree()
-        if not settings.DEBUG and menu_session_key in self.request.session:
-            nav_menu = json.loads(self.request.session[menu_session_key])
-        else:
-            menutree = copy.deepcopy(self.website.menus)
-            nav_menu = {'data': {}, 'branch': [], 'leaf': []}
-            nav_menu['branch'] = menutree[0]['branch']
-            nav_menu['leaf'] = menutree[0]['leaf']
-
-            def deep(i, nav_menu):
-                for l in menutree[i]['branch']:
-                    for r in nav_menu['branch']:
-                        if l['up'] == r['data']['title']:
-                            if type(r['branch']) != list:
-                                r['branch'] = []
-                            r['branch'].append(l)
-                    i += 1
-                    deep(i, nav_menu['branch'])
-
-            deep(1, nav_menu)
-        return nav_menu
+        """
+        用户可见的菜单，按用户的权限编译并缓存，见 :mod:`website.views.navmenu`
+        """
+        return navmenu.get_nav_menu(self)
 
     def get_select_menu(self):
         if hasattr(self, 'app_label'):
@@ -711,30 +802,30 @@ class ModelViewTemplate(LayoutViewTemplate):
 
     def has_view_permission(self, obj=None):
         return ('view' not in self.remove_permissions) and (
-                self.user.has_perm('%s.view_%s' % self.model_info) or self.user.has_perm(
+                self.user_has_perm('%s.view_%s' % self.model_info) or self.user_has_perm(
             '%s.change_%s' % self.model_info))
 
     def has_add_permission(self):
-        return ('add' not in self.remove_permissions) and self.user.has_perm('%s.add_%s' % self.model_info)
+        return ('add' not in self.remove_permissions) and self.user_has_perm('%s.add_%s' % self.model_info)
 
     def has_change_permission(self, obj=None):
-        return ('change' not in self.remove_permissions) and self.user.has_perm('%s.change_%s' % self.model_info)
+        return ('change' not in self.remove_permissions) and self.user_has_perm('%s.change_%s' % self.model_info)
 
     def has_delete_permission(self, obj=None):
-        return ('delete' not in self.remove_permissions) and self.user.has_perm('%s.delete_%s' % self.model_info)
+        return ('delete' not in self.remove_permissions) and self.user_has_perm('%s.delete_%s' % self.model_info)
 
     def has_permission(self, perm_code):
         raw_code = perm_code[:]
         if perm_code in ('view', 'add', 'change', 'delete'):
             perm_code = '%s.%s_%s' % (self.model._meta.app_label, perm_code, self.model_name)
-        return (raw_code not in self.remove_permissions) and self.user.has_perm(perm_code)
+        return (raw_code not in self.remove_permissions) and self.user_has_perm(perm_code)
 
     def has_model_permission(self, model, perm_code):
         opts = model._meta
         raw_code = perm_code[:]
         if perm_code in ('view', 'add', 'change', 'delete'):
             perm_code = '%s.%s_%s' % (opts.app_label, perm_code, opts.model_name)
-        return (raw_code not in self.remove_permissions) and self.user.has_perm(perm_code)
+        return (raw_code not in self.remove_permissions) and self.user_has_perm(perm_code)
 
     def get_model_perms(self):
         return {
@@ -1148,6 +1239,108 @@ class ListRow(dict):
         self.cells.append(cell)
 
 
+class ListColumn:
+    """
+    列表页一列的渲染计划
+
+    每个请求中 list_display 的每一项只解析一次：是模型字段、反向关联、视图方法、可调用对象还是模型的方法/属性，
+    字段的显示函数、样式、是否为链接列也在此时确定，之后由 :meth:`render` 逐行生成 ListCell。
+    插件通过 ``makecolumn`` 钩子修改列的 classes、cell_attrs 或向 transforms 添加 ``fun(item, obj, row)``，
+    作用于该列的每个单元格，不必再为每个单元格执行 ``makecell`` 钩子。
+    """
+
+    def __init__(self, view, field_name):
+        self.view = view
+        self.field_name = field_name
+        names = field_name.split('.')
+        self.name = names[0]
+        self.subname = names[1] if len(names) > 1 else None
+        self.field = None
+        self.attr = None
+        self.allow_tags = False
+        self.boolean = False
+        self.nowrap = False
+        self.classes = []  # 每个单元格的 css class
+        self.cell_attrs = {}  # 每个单元格需要设置的属性
+        self.transforms = []  # 逐行作用于单元格的函数 fun(item, obj, row)
+        self.is_link = self.name in view.list_display_links
+        self.first_link = not view.list_display_links  # 没有指定 list_display_links 时第一列为链接列
+
+        name = self.name
+        try:
+            self.field = view.opts.get_field(name)
+        except models.FieldDoesNotExist:
+            if callable(name):
+                self.kind = 'callable'
+                self.attr = name
+            elif hasattr(view, name) and not name == '__str__' and not name == '__unicode__':
+                self.kind = 'view'
+                self.attr = getattr(view, name)
+            else:
+                self.kind = 'object'
+                self.attr = getattr(view.model, name, None)
+            self.boolean = getattr(self.attr, 'boolean', False)
+            self.allow_tags = self.boolean or getattr(self.attr, 'allow_tags', False)
+        else:
+            if isinstance(self.field, models.ManyToOneRel):
+                self.kind = 'reverse'
+            else:
+                self.kind = 'field'
+                self.display = display_func_for_field(self.field)
+            if isinstance(self.field, (models.DateField, models.TimeField, models.ForeignKey)):
+                self.nowrap = True
+
+    def lookup(self, obj):
+        """
+        返回 (attr, value)，与 lookup_field 的结果相同
+        """
+        kind = self.kind
+        if kind == 'field' or kind == 'reverse':
+            return None, getattr(obj, self.name)
+        if kind == 'object':
+            attr = getattr(obj, self.name)
+            return attr, attr() if callable(attr) else attr
+        return self.attr, self.attr(obj)
+
+    def render(self, obj, row):
+        item = ListCell(self.field_name, row)
+        try:
+            attr, value = self.lookup(obj)
+        except (AttributeError, ObjectDoesNotExist):
+            item.text = mark_safe("<span class='text-muted'>%s</span>" % EMPTY_CHANGELIST_VALUE)
+        else:
+            if self.field is None:
+                item.allow_tags = self.allow_tags
+                item.text = boolean_icon(value) if self.boolean else smart_str(value)
+            else:
+                if self.kind == 'reverse':
+                    field_val = getattr(obj, self.field.name)
+                    if field_val is None:
+                        item.text = mark_safe("<span class='text-muted'>%s</span>" % EMPTY_CHANGELIST_VALUE)
+                    elif self.subname:
+                        item.text = getattr(field_val, self.subname)
+                    else:
+                        item.text = field_val
+                else:
+                    item.text = self.display(value)
+                if self.nowrap:
+                    item.classes.append('nowrap')
+            item.field = self.field
+            item.attr = attr
+            item.value = value
+        if (self.is_link or self.first_link and row['is_display_first']) and not hasattr(obj, '_nolink'):
+            row['is_display_first'] = False
+            item.is_display_link = True
+            item.wraps.append(self.view.get_link_wrap(obj))
+        if self.classes:
+            item.classes.extend(self.classes)
+        if self.cell_attrs:
+            item.__dict__.update(self.cell_attrs)
+        for transform in self.transforms:
+            transform(item, obj, row)
+        return item
+
+
 def inclusion_tag(file_name, context_class=Context, takes_context=False):
     """
     为 ViewTemplate 的 block appended_views 提供的便利方法，作用等同于 :meth:`django.template.Library.inclusion_tag`
@@ -1179,11 +1372,17 @@ def inclusion_tag(file_name, context_class=Context, takes_context=False):
     return wrap
 
 
+RESULT_COUNT_NAME = '_result_count'
+
+
 class ListViewTemplate(ModelViewTemplate):
     paginator_class = Paginator
     can_show_all = True
     select_close = True
     grid = True
+    keyset_columns = None  # keyset 分页生效时的排序列
+    result_count_approximate = False  # result_count 是否为估算值
+    result_totals = None  # 整个结果上的聚合值 {名称: 值}，见 get_result_totals，没有与总数一起计算时为 None
 
     # request@0
     def init_request(self, *args, **kwargs):
@@ -1212,12 +1411,15 @@ class ListViewTemplate(ModelViewTemplate):
         # 获取各种参数
         self.show_all = ALL_VAR in request.GET
         self.to_field = request.GET.get('t')
+        self.cursor = request.GET.get(CURSOR_VAR)
         self.params = dict(request.GET.items())
         # 删除已经获取的参数, 因为后面可能要用 params 或过滤数据
         if 'p' in self.params:
             del self.params['p']
         if 'e' in self.params:
             del self.params['e']
+        if CURSOR_VAR in self.params:
+            del self.params[CURSOR_VAR]
 
     # get@0
     @csrf_protect_m
@@ -1249,20 +1451,28 @@ class ListViewTemplate(ModelViewTemplate):
         # 排序及过滤等处理后的 queryset
         self.list_queryset = self.get_list_queryset()
         self.ordering_field_columns = self.get_ordering_field_columns()
+        if self.pagination == 'keyset':
+            self.keyset_columns = get_keyset_columns(
+                self.model, self.list_queryset.query.order_by or self.opts.ordering)
+            if self.keyset_columns:
+                return self.make_keyset_result_list()
         self.paginator = self.get_paginator()
 
         # 获取当前据数目
-        self.result_count = self.paginator.count
+        self.result_totals = None
+        self.result_count = self.paginator.count = self.get_result_count()
         if self.can_show_all:
             self.can_show_all = self.result_count <= self.list_max_show_all
         self.multi_page = self.result_count > self.list_per_page
 
         if (self.show_all and self.can_show_all) or not self.multi_page:
             self.result_list = self.list_queryset._clone()
+            shown = self.result_count
         else:
             try:
                 self.result_list = self.paginator.page(
                     self.page_num + 1).object_list
+                shown = min(self.list_per_page, self.result_count - self.list_per_page * self.page_num)
             except InvalidPage:
                 # 分页错误, 这里的错误页面需要调整一下
                 if configs.ERROR_FLAG in list(self.request.GET.keys()):
@@ -1271,52 +1481,189 @@ class ListViewTemplate(ModelViewTemplate):
                     })
                 return HttpResponseRedirect(
                     self.request.path + '?' + configs.ERROR_FLAG + '=1')
-        self.has_more = self.result_count > (
-                self.list_per_page * self.page_num + len(self.result_list))
+        if self.result_count_approximate:
+            shown = len(self.result_list)
+        # 本页行数按总数计算，result_list 在用到前不执行查询（AjaxListPlugin 可以改用 values()）
+        self.has_more = self.result_count > self.list_per_page * self.page_num + shown
+
+    def make_keyset_result_list(self):
+        """
+        keyset（游标）分页：按排序列加主键定位，多取一行判断有无下一页，不做 COUNT
+
+        result_count 为 None，翻页链接使用 next_cursor、prev_cursor
+        """
+        columns = self.keyset_columns
+        queryset = self.list_queryset.order_by(*[(desc and '-' or '') + path for path, desc, f in columns])
+        reverse = False
+        if self.cursor:
+            try:
+                values, reverse = decode_cursor(self.cursor)
+                queryset = queryset.filter(keyset_predicate(columns, values, reverse))
+            except (ValueError, ValidationError):
+                # 游标错误时从第一页开始
+                self.cursor, reverse = None, False
+        if reverse:
+            queryset = queryset.reverse()
+
+        rows = list(queryset[:self.list_per_page + 1])
+        more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if reverse:
+            rows.reverse()
+            self.has_more, self.has_prev = True, more
+        else:
+            self.has_more, self.has_prev = more, bool(self.cursor)
+
+        self.paginator = None
+        self.result_count = None
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = self.has_more or self.has_prev
+        self.next_cursor = self.has_more and rows and encode_cursor(get_keyset_values(rows[-1], columns)) or None
+        self.prev_cursor = self.has_prev and rows and encode_cursor(get_keyset_values(rows[0], columns), True) or None
+
+    @pluginhook
+    def get_result_totals(self):
+        """
+        返回在整个结果（不只是当前页）上计算的聚合 {名称: 聚合表达式}，插件可以添加。精确计数时与总数合并为一次
+        查询，结果在 result_totals 中
+        """
+        return {}
+
+    def count_with_totals(self, queryset, totals):
+        """
+        一次聚合查询得到 (总数, {名称: 值})
+        """
+        values = queryset.order_by().aggregate(**dict(totals, **{RESULT_COUNT_NAME: Count('*')}))
+        return values.pop(RESULT_COUNT_NAME), values
+
+    @pluginhook
+    def get_result_count(self):
+        """
+        返回列表结果总数，计数方式由 list_count 决定。有 get_result_totals 时总数与其一起计算，list_count 为 cache
+        时按 list_count_timeout 缓存，模型变动时失效
+        """
+        queryset = self.list_queryset
+        if self.list_count == 'estimate':
+            count = estimate_count(queryset)
+            if count is not None and count >= COUNT_ESTIMATE_MIN:
+                self.result_count_approximate = True
+                return count
+        totals = self.get_result_totals()
+        if totals:
+            if self.list_count == 'cache':
+                count, self.result_totals = filters.choices_cache.get_result(
+                    self.model, 'totals:%r' % sorted(totals.items()), lambda: self.count_with_totals(queryset, totals),
+                    queryset, self.list_count_timeout)
+            else:
+                count, self.result_totals = self.count_with_totals(queryset, totals)
+            return count
+        if self.list_count == 'cache':
+            # 以去掉排序后的查询语句作为 key，过滤条件、权限限制等都会体现在语句中
+            sql, params = queryset.order_by().query.sql_with_params()
+            key = 'website:count:%s.%s:%s' % (self.app_label, self.model_name,
+                                              hashlib.md5(('%s%r' % (sql, params)).encode('utf-8')).hexdigest())
+            count = cache.get(key)
+            if count is None:
+                count = queryset.count()
+                cache.set(key, count, self.list_count_timeout)
+            return count
+        return queryset.count()
 
     # get@111
     @pluginhook
     def get_list_queryset(self):
 
-        # 首先取得基本的 queryset
-        if self.search_sphinx_ins:
-            query = self.request.GET.get('_q_', '')
-            if query:
-                query_set = self.search_sphinx_ins.query(query)
-                query_set.set_options(mode='SPH_MATCH_EXTENDED2')
-                query_set.set_options(rankmode='SPH_SORT_RELEVANCE')
-                query_set.order_by('-@weight', '-@id')
-                query_set._maxmatches = 500
-                query_set._limit = 500
-
-                sph_results = query_set._get_sphinx_results()
-                result_ids = [r['id'] for r in sph_results['matches'][:500]]
-                if query.isdigit():
-                    result_ids.append(int(query))
-                queryset = self.queryset().filter(id__in=result_ids)
-            else:
-                queryset = self.queryset()
-        else:
-            queryset = self.queryset()
+        # 首先取得基本的 queryset，搜索（包括 search_sphinx_ins）由 FilterPlugin 处理
+        queryset = self.queryset()
+        queryset = self.apply_queryset_plan(queryset, self.get_queryset_plan())
+        queryset = queryset.order_by(*self.get_ordering())
+        return queryset
+
+    @pluginhook
+    def get_queryset_plan(self):
+        """
+        根据列表要显示的列规划查询：外键及反向一对一列 select_related，多对多列 prefetch_related，
+        列表未用到的大字段延迟加载。
+
+        视图方法、模型方法等列可以通过函数属性声明需要的查询::
+
+            def author_name(self, obj):
+                return obj.author.name
+            author_name.select_related = ('author',)
+            author_name.prefetch_related = ()
+            author_name.only = ('author',)  # 用到的本模型字段，声明后才允许延迟加载其他大字段
+
+        返回 ``{'select_related': [...], 'prefetch_related': [...], 'defer': [...]}``
+        """
+        select_related, prefetch_related, fields = [], [], set()
+        known = True  # 是否知道列表用到的全部字段
+
+        def add(lst, names):
+            for n in names:
+                if n not in lst:
+                    lst.append(n)
+
+        for field_name in list(self.list_display) + [f for f in self.list_display_links if f not in self.list_display]:
+            column = self.get_column(field_name)
+            field = column.field
+            if field is None:
+                attr = column.attr
+                add(select_related, getattr(attr, 'select_related', ()))
+                add(prefetch_related, getattr(attr, 'prefetch_related', ()))
+                only = getattr(attr, 'only', None)
+                if only is None:
+                    known = known and column.kind == 'object' and attr is None
+                else:
+                    fields.update(only)
+            elif column.kind == 'reverse':
+                if field.one_to_one:
+                    add(select_related, [field.name])
+            elif isinstance(field, models.ManyToManyField):
+                add(prefetch_related, [field.name])
+            elif field.concrete:
+                fields.add(field.name)
+                if field.is_relation:
+                    add(select_related, [field.name])
+
+        # 排序字段（keyset 分页需要读取）及弹窗页选择时读取的字段
+        for o in self.get_ordering():
+            if isinstance(o, str):
+                fields.add(o.lstrip('-').split('__')[0])
+        if self.pop:
+            for var in ('s', 't'):
+                if var in self.request.GET:
+                    fields.add(self.request.GET[var])
+            only = getattr(self.model.__str__, 'only', None)
+            known = known and only is not None
+            fields.update(only or ())
+
+        if self.list_select_related is True:
+            select_related = True
+        elif self.list_select_related:
+            add(select_related, self.list_select_related)
+        add(prefetch_related, self.list_prefetch_related)
+
+        defer = []
+        if known and self.list_defer_wide:
+            defer = [f.name for f in self.opts.concrete_fields if not f.primary_key and f.name not in fields and
+                     f.get_internal_type() in ('TextField', 'BinaryField', 'JSONField')]
+        return {'select_related': select_related, 'prefetch_related': prefetch_related, 'defer': defer}
+
+    def apply_queryset_plan(self, queryset, plan):
+        """
+        按 :meth:`get_queryset_plan` 的结果调整 queryset，queryset 已经指定的 select_related、only/defer 优先
+        """
         if not queryset.query.select_related:
-            if self.list_select_related:
+            if plan['select_related'] is True:
                 queryset = queryset.select_related()
-            elif not self.list_select_related:
-                related_fields = []
-                for field_name in self.list_display:
-                    try:
-                        field = self.opts.get_field(field_name)
-                    except models.FieldDoesNotExist:
-                        pass
-                    else:
-                        if isinstance(field.remote_field, models.ManyToOneRel):
-                            related_fields.append(field_name)
-                if related_fields:
-                    queryset = queryset.select_related(*related_fields)
-            else:
-                pass
-
-        queryset = queryset.order_by(*self.get_ordering())
+            elif plan['select_related']:
+                queryset = queryset.select_related(*plan['select_related'])
+        if plan['prefetch_related']:
+            lookups = [l for l in plan['prefetch_related'] if l not in queryset._prefetch_related_lookups]
+            queryset = queryset.prefetch_related(*lookups)
+        if plan['defer'] and queryset.query.deferred_loading == (frozenset(), True):
+            queryset = queryset.defer(*plan['defer'])
         return queryset
 
     # get@2
@@ -1473,6 +1820,13 @@ class ListViewTemplate(ModelViewTemplate):
 
     @inclusion_tag('website/includes/pagination.tpl')
     def block_pagination(self, context, nodes, page_type='normal'):
+        if self.keyset_columns:
+            return {
+                'cl': self,
+                'keyset': True,
+                'prev_url': self.prev_cursor and self.get_query_string({CURSOR_VAR: self.prev_cursor, PAGE_VAR: None}),
+                'next_url': self.next_cursor and self.get_query_string({CURSOR_VAR: self.next_cursor, PAGE_VAR: None}),
+            }
         paginator, page_num = self.paginator, self.page_num
 
         pagination_required = (
@@ -1681,83 +2035,61 @@ class ListViewTemplate(ModelViewTemplate):
         row.cells = [self.makeheader(field_name, row) for field_name in self.list_display]
         return row
 
-    @pluginhook
-    def makecell(self, obj, field_name, row):
-        item = ListCell(field_name, row)  # 首先初始化
-        field_name_split = field_name.split('.')
-        field_name = field_name_split[0]
-        try:
-            f, attr, value = lookup_field(field_name, obj, self)
-        except (AttributeError, ObjectDoesNotExist):
-            item.text = mark_safe("<span class='text-muted'>%s</span>" % EMPTY_CHANGELIST_VALUE)
+    def get_link_wrap(self, obj):
+        """
+        链接列单元格的链接
+        """
+        if self.list_display_links_details:
+            url = self.get_detail_url(obj)
         else:
-            if f is None:
-                # Model 属性或是 iview 属性列
-                item.allow_tags = getattr(attr, 'allow_tags', False)
-                boolean = getattr(attr, 'boolean', False)
-                if boolean:
-                    item.allow_tags = True
-                    item.text = boolean_icon(value)
-                else:
-                    item.text = smart_str(value)
+            url = self.get_object_url(obj)
+        if self.pop:
+            if 's' in self.request.GET:
+                show = getattr(obj, self.request.GET.get('s'))
+                if callable(show): show = show()
             else:
-                # 处理关联列
+                show = escape(Truncator(obj).words(14, truncate='...'))
+            show = str(show).replace('%', '%%').replace("\'", "\\\'")
+            pop = format_html(' class="for_multi_select" show="{0}" sid="{1}" ', show,
+                              getattr(obj, str(self.request.GET.get('t')), ''))
+        else:
+            pop = ''
+        return '<a href="%s" %s>%%s</a>' % (url, pop)
 
-                if isinstance(f, models.ManyToOneRel):
-                    field_val = getattr(obj, f.name)
-                    if field_val is None:
-                        item.text = mark_safe("<span class='text-muted'>%s</span>" % EMPTY_CHANGELIST_VALUE)
-                    else:
-                        if len(field_name_split) > 1:
-                            item.text = getattr(field_val, field_name_split[1])
-                        else:
-                            item.text = field_val
-                else:
-                    item.text = display_for_field(value, f)
-                if isinstance(f, models.DateField) \
-                        or isinstance(f, models.TimeField) \
-                        or isinstance(f, models.ForeignKey):
-                    item.classes.append('nowrap')
+    @pluginhook
+    def makecolumn(self, field_name):
+        """
+        生成一列的渲染计划 :class:`ListColumn` ，插件在此添加列级的处理
+        """
+        return ListColumn(self, field_name)
 
-            item.field = f
-            item.attr = attr
-            item.value = value
-        if not hasattr(obj, '_nolink'):
-            # 如果没有指定 ``list_display_links`` , 使用第一列作为内容连接列.
-            if (item.row['is_display_first'] and not self.list_display_links) \
-                    or field_name in self.list_display_links:
-                item.row['is_display_first'] = False
-                item.is_display_link = True
-                if self.list_display_links_details:
-                    url = self.get_detail_url(obj)
-                else:
-                    url = self.get_object_url(obj)
-                if self.pop:
-                    if 's' in self.request.GET:
-                        show = getattr(obj, self.request.GET.get('s'))
-                        if callable(show): show = show()
-                    else:
-                        show = escape(Truncator(obj).words(14, truncate='...'))
-                    show = str(show).replace('%', '%%').replace("\'", "\\\'")
-                    pop = format_html(' class="for_multi_select" show="{0}" sid="{1}" ', show,
-                                      getattr(obj, str(self.request.GET.get('t')), ''))
-                else:
-                    pop = ''
-                item.wraps.append('<a href="%s" %s>%%s</a>' % (url, pop))
+    def get_column(self, field_name):
+        columns = self.__dict__.setdefault('_columns', {})
+        if field_name not in columns:
+            columns[field_name] = self.makecolumn(field_name)
+        return columns[field_name]
 
-        return item
+    @pluginhook
+    def makecell(self, obj, field_name, row):
+        return self.get_column(field_name).render(obj, row)
 
     @pluginhook
     def makerow(self, obj):
         row = ListRow()
         row['is_display_first'] = True
         row['object'] = obj
-        row.cells = [self.makecell(
-            obj, field_name, row) for field_name in self.list_display]
+        if self.has_pluginhook('makecell'):
+            row.cells = [self.makecell(
+                obj, field_name, row) for field_name in self.list_display]
+        else:
+            # 没有插件需要逐个处理单元格时直接按列渲染
+            row.cells = [self.get_column(field_name).render(obj, row) for field_name in self.list_display]
         return row
 
     @pluginhook
     def results(self):
+        if self.list_row_cache:
+            return rowcache.cached_rows(self, self.result_list)
         results = []
         for obj in self.result_list:
             results.append(self.makerow(obj))
@@ -2614,7 +2946,7 @@ class InlineFormViewTemplate(ModelFormViewTemplate):
     def has_add_permission(self):
         if self.opts.auto_created:
             return self.has_change_permission()
-        return self.user.has_perm(
+        return self.user_has_perm(
             self.opts.app_label + '.add_' + self.opts.object_name.lower())
 
     def has_change_permission(self):
@@ -2624,13 +2956,13 @@ class InlineFormViewTemplate(ModelFormViewTemplate):
                 if field.remote_field and field.remote_field.model != self.parent_model:
                     opts = field.remote_field.model._meta
                     break
-        return self.user.has_perm(
+        return self.user_has_perm(
             opts.app_label + '.change_' + opts.object_name.lower())
 
     def has_delete_permission(self):
         if self.opts.auto_created:
             return self.has_change_permission()
-        return self.user.has_perm(
+        return self.user_has_perm(
             self.opts.app_label + '.delete_' + self.opts.object_name.lower())
 
 
@@ -2668,6 +3000,8 @@ class GenericInlineModelView(InlineFormViewTemplate):
 class DashboardViewTemplate(LayoutViewTemplate):
     menu_show = False
     widget_customiz = True
+    widget_render = DASHBOARD_WIDGET_RENDER  # 区块的渲染方式 sync、parallel、lazy，见 website.views.dashboard
+    widget_timeout = DASHBOARD_WIDGET_TIMEOUT  # 等待单个区块的秒数
     widgets = []
     title = _("Dashboard")
     icon = None
@@ -2695,7 +3029,8 @@ class DashboardViewTemplate(LayoutViewTemplate):
             class widget_with_perm(wid):
                 def context(self, context):
                     super(widget_with_perm, self).context(context)
-                    context.update({'has_change_permission': self.request.user.has_perm('website.change_userwidget')})
+                    context.update({'has_change_permission': permissions.get_snapshot(self.request).has_perm(
+                        'website.change_userwidget')})
 
             wid_instance = widget_with_perm(self, data or widget.get_value())
             return wid_instance
@@ -2706,43 +3041,58 @@ class DashboardViewTemplate(LayoutViewTemplate):
     def get_init_widget(self):
         '''
         初始化获取要显示的 widgets
-        注: widget_customiz=True 时才会 save
+        注: widget_customiz=True 时才会 save，见 save_init_widgets
         '''
         portal = []
+        components = []
         widgets = self.widgets
         for col in widgets:
             portal_col = []
             for opts in col:
+                widget = UserComponent(user=self.user, page_id=self.get_page_id(), widget_type=opts['type'])
+                widget.set_value(opts)
+                widget.id = 0
                 try:
-                    widget = UserComponent(user=self.user, page_id=self.get_page_id(), widget_type=opts['type'])
-                    widget.set_value(opts)
-                    if self.widget_customiz:
-                        widget.save()
-                    else:
-                        widget.id = 0
-                    portal_col.append(self.get_widget(widget))
+                    wid_instance = self.get_widget(widget)
                 except (PermissionDenied, WidgetDataError):
-                    if self.widget_customiz:
-                        widget.delete()
                     continue
+                portal_col.append(wid_instance)
+                components.append((widget, wid_instance))
             portal.append(portal_col)
         if self.widget_customiz:
-            UserSetting(
-                user=self.user, key="dashboard:%s:pos" % self.get_page_id(),
-                value='|'.join([','.join([str(w.id) for w in col]) for col in portal])).save()
+            self.save_init_widgets(portal, components)
 
         return portal
 
+    def save_init_widgets(self, portal, components):
+        '''
+        在一个事务中批量保存初始化的组件（不经过 UserComponent.save），位置一次写入 UserSetting
+        '''
+        with transaction.atomic():
+            for widget, wid_instance in components:
+                widget.id = None
+            created = UserComponent.objects.bulk_create([widget for widget, wid_instance in components])
+            if created and created[0].pk is None:
+                # 数据库不返回主键时按插入顺序取回
+                ids = UserComponent.objects.filter(user=self.user, page_id=self.get_page_id()).order_by('-pk') \
+                          .values_list('pk', flat=True)[:len(created)]
+                ids = list(ids)[::-1]
+            else:
+                ids = [widget.pk for widget in created]
+            for (widget, wid_instance), pk in zip(components, ids):
+                widget.pk = wid_instance.id = wid_instance.data['id'] = pk
+            usersettings.get_settings(self.request).set(
+                self.get_portal_key(), '|'.join([','.join([str(w.id) for w in col]) for col in portal]))
+
     @pluginhook
     def get_widgets(self):
         '''
         构造要显示的 widgets
         '''
         if self.widget_customiz:
-            portal_pos = UserSetting.objects.filter(
-                user__id=self.user.id, key=self.get_portal_key())
-            if len(portal_pos):
-                portal_pos = portal_pos[0].value
+            user_settings = usersettings.get_settings(self.request)
+            if self.get_portal_key() in user_settings:
+                portal_pos = user_settings.get(self.get_portal_key())
                 widgets = []
 
                 if portal_pos:
@@ -2770,6 +3120,42 @@ class DashboardViewTemplate(LayoutViewTemplate):
             # 不允许自定义则每次都初始化获取
             return self.get_init_widget()
 
+    def get_widget_url(self, index):
+        params = self.request.GET.copy()
+        params[dashboard.WIDGET_VAR] = index
+        return '%s?%s' % (self.request.path, params.urlencode())
+
+    def render_widgets(self):
+        '''
+        按 widget_render 预先渲染区块，sync 时由模板依次渲染
+        '''
+        widgets = [w for ws in self.widgets for w in ws]
+        if self.widget_render == 'lazy':
+            htmls = [None] * len(widgets)
+        elif self.widget_render == 'parallel':
+            htmls = dashboard.render_parallel(widgets, self.widget_timeout)
+        else:
+            return
+        for index, (widget, html) in enumerate(zip(widgets, htmls)):
+            # 未完成的区块改为 ajax 加载
+            widget.html = html or dashboard.render_lazy(widget, self.get_widget_url(index), self.widget_timeout)
+
+    def widget_response(self, index):
+        '''
+        ajax 加载的单个区块内容，index 为区块在所有列中的序号，有 REFRESH_VAR 时不使用缓存
+        '''
+        widgets = [w for ws in self.get_widgets() for w in ws]
+        try:
+            index = int(index)
+            if index < 0:
+                raise IndexError(index)
+            widget = widgets[index]
+        except (ValueError, IndexError):
+            raise Http404
+        if dashboard.REFRESH_VAR in self.request.GET:
+            widget.refresh_cache()
+        return HttpResponse(dashboard.render_widget(widget, dashboard.CONTENT_BOX_TEMPLATE))
+
     @pluginhook
     def get_title(self):
         return self.title
@@ -2794,7 +3180,10 @@ class DashboardViewTemplate(LayoutViewTemplate):
 
     @never_cache
     def get(self, request, *args, **kwargs):
+        if dashboard.WIDGET_VAR in request.GET:
+            return self.widget_response(request.GET[dashboard.WIDGET_VAR])
         self.widgets = self.get_widgets()
+        self.render_widgets()
         return self.template_response(self.template, self.get_context())
 
     @csrf_protect_m
@@ -2809,15 +3198,12 @@ class DashboardViewTemplate(LayoutViewTemplate):
                     widget = UserComponent.objects.get(
                         user=self.user, page_id=self.get_page_id(), id=widget_id)
                     widget.delete()
-                    try:
-                        portal_pos = UserSetting.objects.get(user=self.user,
-                                                             key="dashboard:%s:pos" % self.get_page_id())
+                    user_settings = usersettings.get_settings(request)
+                    portal_pos = user_settings.get(self.get_portal_key())
+                    if portal_pos is not None:
                         pos = [[w for w in col.split(',') if w != str(
-                            widget_id)] for col in portal_pos.value.split('|')]
-                        portal_pos.value = '|'.join([','.join(col) for col in pos])
-                        portal_pos.save()
-                    except Exception:
-                        pass
+                            widget_id)] for col in portal_pos.split('|')]
+                        user_settings.set(self.get_portal_key(), '|'.join([','.join(col) for col in pos]))
                 except UserComponent.DoesNotExist:
                     pass
 
@@ -2868,7 +3254,10 @@ class ModelDashboardView(DashboardViewTemplate, ModelViewTemplate):
 
     @never_cache
     def get(self, request, *args, **kwargs):
+        if dashboard.WIDGET_VAR in request.GET:
+            return self.widget_response(request.GET[dashboard.WIDGET_VAR])
         self.widgets = self.get_widgets()
+        self.render_widgets()
         return self.template_response(self.get_template_list('views/model_dashboard.tpl'), self.get_context())
 
 
@@ -4351,14 +4740,30 @@ class ChartsViewTemplate(ListViewTemplate):
 
         datas = [{"data": [], "label": force_str(label_for_field(
             i, self.model, model_admin=self))} for i in self.y_fields]
+        points = self.chart.get('points', CHART_MAX_POINTS)
+
+        if 'aggregate' in self.chart:
+            # 在过滤后的全部数据上由数据库分组聚合，不分页
+            self.list_queryset = self.get_list_queryset()
+            bucket = self.chart.get('bucket', 'auto')
+            series = filters.choices_cache.get_result(
+                self.model, 'chart:%s:%r' % (name, (self.y_fields, self.chart['aggregate'], bucket, points)),
+                lambda: charts.aggregate_series(self.list_queryset, self.x_field, self.y_fields,
+                                                self.chart['aggregate'], bucket, points),
+                self.list_queryset, self.chart.get('cache', self.result_cache_timeout))
+            for i, data in enumerate(series):
+                datas[i]["data"] = data
+        else:
+            self.make_result_list()
 
-        self.make_result_list()
+            for obj in self.result_list:
+                xf, attrs, value = lookup_field(self.x_field, obj, self)
+                for i, yfname in enumerate(self.y_fields):
+                    yf, yattrs, yv = lookup_field(yfname, obj, self)
+                    datas[i]["data"].append((value, yv))
 
-        for obj in self.result_list:
-            xf, attrs, value = lookup_field(self.x_field, obj, self)
-            for i, yfname in enumerate(self.y_fields):
-                yf, yattrs, yv = lookup_field(yfname, obj, self)
-                datas[i]["data"].append((value, yv))
+        for d in datas:
+            d["data"] = charts.lttb(d["data"], points)
 
         option = {'series': {'lines': {'show': True}, 'points': {'show': False}},
                   'grid': {'hoverable': True, 'clickable': True}}
@@ -4639,13 +5044,28 @@ class UserSettingView(ViewTemplate):
     def post(self, request):
         key = request.POST['key']
         val = request.POST['value']
-        us, created = UserSetting.objects.get_or_create(
-            user=self.user, key=key)
-        us.value = val
-        us.save()
+        usersettings.get_settings(request).set(key, val)
         return HttpResponse('')
 
 
+class ExportJobView(ViewTemplate):
+    """
+    后台导出任务的状态查询, 带 download 参数时下载导出的文件
+    """
+
+    def get(self, request, job_id):
+        job = ExportJob.objects.filter(pk=job_id, user=self.user).first()
+        if job is None:
+            raise Http404
+        if 'download' in request.GET:
+            if job.status != 'done':
+                raise Http404
+            return FileResponse(default_storage.open(job.file, 'rb'), as_attachment=True,
+                                filename='%s.%s' % (job.content_type.model, job.export_type))
+        download_url = '%s?download=1' % self.get_site_url('export_job', job.pk) if job.status == 'done' else None
+        return self.render_json({'id': job.pk, 'status': job.status, 'rows': job.rows, 'download_url': download_url})
+
+
 class GroupAddUsersView(ActionFormViewTemplate):
     verbose_name = '批量添加成员'
     app_label = 'website'
@@ -4927,6 +5347,18 @@ class UserSettingViewConfig(ViewConfigMixin):
     menu_group = '配置 个人中心'
 
 
+class ExportJobViewConfig(ViewConfigMixin):
+    menu_icon = 'fa fa-download'
+    list_display = ('content_type', 'export_type', 'status', 'rows', 'created', 'finished', 'user')
+    list_filter = ['status', 'export_type']
+    menu_group = '配置 个人中心'
+
+    def queryset(self):
+        if self.user.is_superuser:
+            return ExportJob.objects.all()
+        return ExportJob.objects.filter(user=self.user)
+
+
 class UserComponentViewConfig(ViewConfigMixin):
     menu_icon = 'fa fa-dashboard'
     list_display = ('widget_type', 'page_id', 'user')